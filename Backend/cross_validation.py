@@ -0,0 +1,117 @@
+"""
+K-fold cross-validation of the training pipeline (preprocessing and stacking model, see model_generator.py).
+The feature matrix is calculated once and cached on disk, the folds run in parallel worker processes which memory map
+the cached matrix, so the folding is not repeated and the matrix is not copied to every worker. The workers are not
+daemonic (concurrent.futures), so the stacking model of every fold can use its share of the cores in joblib workers.
+A failing fold (model_generator exits on errors) is raised as an error instead of stopping the worker. Every fold reports its
+accuracy (MSE, MAE, R2) together with the fit and predict latency, so changes to the model can be compared on both
+accuracy and speed without several full retrains.
+"""
+
+# Importing required libraries
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sklearn.impute import SimpleImputer
+from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
+from sklearn.model_selection import KFold
+from sklearn.preprocessing import StandardScaler
+
+from Backend.profiling import core_budget
+
+logger = logging.getLogger(__name__)
+
+# Function to evaluate one fold (in a worker process)
+def evaluate_fold(cache_dir, fold, cores, params=None):
+
+    """
+    Function to run the pipeline on one fold: the imputer and scaler are fitted on the training rows of the fold
+    (like model_generator.preprocess_data), the stacking model is trained on them and scored on the held-out rows.
+    Args:
+        cache_dir (str): Directory of the cached feature matrix and folds
+        fold (int): Number of the fold
+        cores (int): Number of cores for the training of this fold
+        params (dict): Hyperparameters per base model (optional, see model_generator.train_model)
+    Returns:
+        result (dict): Fold number, number of rows, MSE, MAE, R2, fit seconds and predict seconds (total and per 1000 rows)
+
+    """
+    from joblib.externals.loky import get_reusable_executor
+    from Backend.model_generator import plan_resources, train_model
+
+    X = np.load(os.path.join(cache_dir, 'X.npy'), mmap_mode='r')
+    y = np.load(os.path.join(cache_dir, 'y.npy'), mmap_mode='r')
+    train = np.load(os.path.join(cache_dir, f'train_{fold}.npy'))
+    test = np.load(os.path.join(cache_dir, f'test_{fold}.npy'))
+
+    start = time.perf_counter()
+    imputer, scaler = SimpleImputer(strategy='mean'), StandardScaler()
+    X_train = np.ascontiguousarray(scaler.fit_transform(imputer.fit_transform(X[train])), dtype=np.float32)
+    try:
+        model = train_model(X_train, y[train], resources=plan_resources(cores), params=params)
+    except SystemExit:  # train_model exits on errors, which would stop the worker
+        raise RuntimeError(f"Training of fold {fold + 1} failed, see Backend/rna_model.log for details.")
+    finally:
+        get_reusable_executor().shutdown(wait=True)  # Its joblib workers would keep the worker from exiting
+    fit_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    X_test = np.ascontiguousarray(scaler.transform(imputer.transform(X[test])), dtype=np.float32)
+    y_pred = model.predict(X_test)
+    predict_seconds = time.perf_counter() - start
+
+    return {'fold': fold + 1, 'train_rows': len(train), 'test_rows': len(test),
+            'mse': mean_squared_error(y[test], y_pred), 'mae': mean_absolute_error(y[test], y_pred),
+            'r2': r2_score(y[test], y_pred), 'fit_seconds': fit_seconds, 'predict_seconds': predict_seconds,
+            'predict_ms_per_1000_rows': 1e6 * predict_seconds / len(test)}
+
+# Function to cross-validate the pipeline
+def cross_validate(X, y, n_folds=5, n_workers=None, params=None, random_state=42, total_cores=None):
+
+    """
+    Function to run a k-fold cross-validation of the pipeline in parallel worker processes over one cached feature matrix.
+    The cores are shared between the folds that run at the same time.
+    Args:
+        X (pd.DataFrame or np.ndarray): Features (not preprocessed)
+        y (pd.Series or np.ndarray): Target values
+        n_folds (int): Number of folds
+        n_workers (int): Number of folds that run at the same time (default: one per core of total_cores, at most n_folds)
+        params (dict): Hyperparameters per base model (optional, see model_generator.train_model)
+        random_state (int): Seed of the fold split
+        total_cores (int): Total number of cores shared by the folds (default: the core budget, see profiling.core_budget)
+    Returns:
+        report (dict): Per-fold results and the mean and standard deviation of every metric over the folds
+
+    """
+    total_cores = total_cores or core_budget()
+    n_workers = max(1, min(n_folds, n_workers or total_cores))
+    logger.info(f"Cross-validating the pipeline: {n_folds} folds, {n_workers} workers.")
+
+    # Cache the feature matrix and the folds once for all the workers
+    cache_dir = tempfile.mkdtemp(prefix='castor_cv_')
+    try:
+        np.save(os.path.join(cache_dir, 'X.npy'), np.ascontiguousarray(X, dtype=np.float32))
+        np.save(os.path.join(cache_dir, 'y.npy'), np.asarray(y, dtype=np.float32))
+        for fold, (train, test) in enumerate(KFold(n_folds, shuffle=True, random_state=random_state).split(np.arange(len(y)))):
+            np.save(os.path.join(cache_dir, f'train_{fold}.npy'), train)
+            np.save(os.path.join(cache_dir, f'test_{fold}.npy'), test)
+
+        cores = max(1, total_cores // n_workers)
+        with ProcessPoolExecutor(n_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            folds = list(executor.map(evaluate_fold, [cache_dir] * n_folds, range(n_folds), [cores] * n_folds,
+                                      [params] * n_folds))
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    metrics = ['mse', 'mae', 'r2', 'fit_seconds', 'predict_seconds', 'predict_ms_per_1000_rows']
+    report = {'n_folds': n_folds, 'workers': n_workers, 'cores_per_fold': cores, 'folds': folds,
+              'mean': {metric: float(np.mean([result[metric] for result in folds])) for metric in metrics},
+              'std': {metric: float(np.std([result[metric] for result in folds])) for metric in metrics}}
+    logger.info(f"Cross-validation completed: {report['mean']}")
+    return report
@@ -0,0 +1,210 @@
+"""
+Validation of the training data (gRNA_PAM and efficacy columns) used by the admin upload, model_generator.check_data
+and the out-of-core training.
+CSV files are read in chunks (with the pyarrow CSV reader if pyarrow is installed, otherwise with pandas), so a
+large upload is validated in bounded memory, and every chunk is checked with vectorized string operations.
+Invalid rows are reported with their row index in the file and the reason, duplicate rows are dropped.
+"""
+
+# Importing required libraries
+import logging
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_COLUMNS = ['gRNA_PAM', 'efficacy']
+CHUNK_ROWS = 100000
+MAX_REPORTED_ROWS = 1000  # Invalid rows kept in the report (all of them are counted)
+
+class ValidationError(ValueError):
+    """Raised when the training data cannot be validated at all (e.g. missing columns)."""
+
+# Function to read a CSV file in chunks
+def read_csv_chunks(source, chunk_rows=CHUNK_ROWS):
+
+    """
+    Function to read the required columns of a CSV file in chunks. All the values are read as strings,
+    so the validation decides what is numeric.
+    Args:
+        source (str or file): Path or file object (e.g. an uploaded file) of the CSV file
+        chunk_rows (int): Approximate number of rows per chunk
+    Returns:
+        generator: DataFrames with the gRNA_PAM and efficacy columns, indexed by the row index in the file
+
+    """
+    if pa is not None:
+        try:
+            reader = pa_csv.open_csv(source, read_options=pa_csv.ReadOptions(block_size=chunk_rows * 64),
+                                     convert_options=pa_csv.ConvertOptions(
+                                         column_types={column: pa.string() for column in REQUIRED_COLUMNS},
+                                         include_columns=REQUIRED_COLUMNS, strings_can_be_null=True))
+        except pa.ArrowKeyError as e:  # A required column is not in the header
+            raise ValidationError(f"Missing required columns: {str(e)} | Required : {REQUIRED_COLUMNS}")
+        except pa.ArrowInvalid as e:
+            raise ValidationError(f"Could not read the required columns {REQUIRED_COLUMNS}: {str(e)}")
+        chunks = (batch.to_pandas() for batch in reader)
+    else:
+        reader = pd.read_csv(source, chunksize=chunk_rows, dtype=str)
+        first = next(reader, pd.DataFrame())
+        missing = [column for column in REQUIRED_COLUMNS if column not in first.columns]
+        if missing:
+            raise ValidationError(f"Missing required columns: {missing} | Required : {REQUIRED_COLUMNS}")
+        chunks = (chunk[REQUIRED_COLUMNS] for chunk in _chain(first, reader))
+
+    offset = 0
+    for chunk in chunks:
+        chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+        offset += len(chunk)
+        yield chunk
+
+def _chain(first, reader):
+    yield first
+    yield from reader
+
+# Function to validate a chunk of the training data
+def validate_chunk(df):
+
+    """
+    Function to validate a chunk of the training data with vectorized string operations.
+    A row is invalid if the gRNA_PAM is missing or contains other characters than A, C, G, T (in any case),
+    or if the efficacy is missing or not numeric.
+    Args:
+        df (pd.DataFrame): Chunk with the gRNA_PAM and efficacy columns
+    Returns:
+        valid (pd.DataFrame): Valid rows (efficacy converted to float)
+        invalid (pd.DataFrame): Invalid rows with the reason, indexed by the row index
+
+    """
+    sequences = df['gRNA_PAM'].astype('string')
+    efficacy = pd.to_numeric(df['efficacy'], errors='coerce')
+
+    valid_sequence = sequences.str.fullmatch(r'[ACGTacgt]+').fillna(False).astype(bool)
+    valid_efficacy = efficacy.notna()
+    valid = (valid_sequence & valid_efficacy).to_numpy()
+
+    invalid = pd.DataFrame({'gRNA_PAM': df['gRNA_PAM'][~valid], 'efficacy': df['efficacy'][~valid]})
+    reason = pd.Series('', index=invalid.index, dtype=object)
+    reason[sequences[~valid].isna().to_numpy()] = 'missing gRNA_PAM; '
+    bad_characters = sequences[~valid].str.replace(r'[ACGTacgt]', '', regex=True)
+    has_bad_characters = bad_characters.fillna('').str.len().to_numpy() > 0
+    reason[has_bad_characters] += 'invalid characters in gRNA_PAM: ' + bad_characters[has_bad_characters] + '; '
+    reason[df['efficacy'][~valid].isna().to_numpy()] += 'missing efficacy; '
+    reason[(df['efficacy'][~valid].notna() & efficacy[~valid].isna()).to_numpy()] += 'non-numeric efficacy; '
+    invalid['reason'] = reason.str.rstrip('; ')
+
+    valid_rows = pd.DataFrame({'gRNA_PAM': df['gRNA_PAM'][valid].astype(str), 'efficacy': efficacy[valid]})
+    return valid_rows, invalid
+
+# Function to create an empty validation report
+def new_report():
+
+    """
+    Function to create an empty validation report, filled by iter_valid_chunks.
+    Returns:
+        report (dict): Empty report (see validate_csv)
+
+    """
+    return {'rows': 0, 'valid_rows': 0, 'duplicate_rows': 0, 'invalid_rows': 0, 'invalid_characters': set(),
+            'invalid': []}
+
+def _update_report(report, chunk, valid, invalid, duplicates):
+    report['rows'] += len(chunk)
+    report['valid_rows'] += len(valid)
+    report['duplicate_rows'] += duplicates
+    report['invalid_rows'] += len(invalid)
+    characters = invalid['gRNA_PAM'].dropna().astype(str).str.replace(r'[ACGTacgt]', '', regex=True)
+    report['invalid_characters'].update(''.join(characters.unique()))
+    reported = sum(len(rows) for rows in report['invalid'])
+    if reported < MAX_REPORTED_ROWS:
+        report['invalid'].append(invalid.head(MAX_REPORTED_ROWS - reported))
+
+def _finish_report(report):
+    report['invalid'] = pd.concat(report['invalid']) if report['invalid'] else \
+        pd.DataFrame(columns=REQUIRED_COLUMNS + ['reason'])
+    report['invalid_characters'] = sorted(report['invalid_characters'])
+    logger.info(f"Data validation: {report['rows']} rows, {report['valid_rows']} valid, "
+                f"{report['invalid_rows']} invalid, {report['duplicate_rows']} duplicates.")
+    return report
+
+class _Deduplicator:
+    # Drops rows seen before (in this or an earlier chunk) using 64-bit hashes of the rows
+    def __init__(self):
+        self.seen = np.empty(0, dtype=np.uint64)
+
+    def __call__(self, valid):
+        hashes = pd.util.hash_pandas_object(valid, index=False).to_numpy()
+        _, first = np.unique(hashes, return_index=True)
+        keep = np.zeros(len(valid), dtype=bool)
+        keep[first] = True
+        keep &= ~np.isin(hashes, self.seen)
+        self.seen = np.union1d(self.seen, hashes)
+        return valid[keep], int((~keep).sum())
+
+# Function to validate the training data in chunks
+def iter_valid_chunks(chunks, report):
+
+    """
+    Function to validate a stream of chunks. The valid rows of every chunk are yielded without the duplicates
+    of earlier rows and the report is updated on the way.
+    Args:
+        chunks (iterable): Chunks with the gRNA_PAM and efficacy columns (e.g. from read_csv_chunks)
+        report (dict): Report to update (see validate_csv)
+    Returns:
+        generator: Valid rows of each chunk
+
+    """
+    deduplicate = _Deduplicator()
+    for chunk in chunks:
+        valid, invalid = validate_chunk(chunk)
+        valid, duplicates = deduplicate(valid)
+        _update_report(report, chunk, valid, invalid, duplicates)
+        yield valid
+
+# Function to validate a CSV file
+def validate_csv(source, chunk_rows=CHUNK_ROWS):
+
+    """
+    Function to validate a training data CSV file chunk by chunk. Only the valid rows are kept in memory.
+    Args:
+        source (str or file): Path or file object (e.g. an uploaded file) of the CSV file
+        chunk_rows (int): Approximate number of rows per chunk
+    Returns:
+        valid (pd.DataFrame): Valid rows without duplicates (gRNA_PAM and efficacy columns)
+        report (dict): Number of rows, valid, invalid and duplicate rows, the invalid characters found in the
+            sequences and the first MAX_REPORTED_ROWS invalid rows with their row index and the reason
+
+    """
+    report = new_report()
+    valid = list(iter_valid_chunks(read_csv_chunks(source, chunk_rows), report))
+    valid = pd.concat(valid) if valid else pd.DataFrame({'gRNA_PAM': pd.Series(dtype=str), 'efficacy': pd.Series(dtype=float)})
+    return valid, _finish_report(report)
+
+# Function to validate a DataFrame
+def validate_dataframe(df, chunk_rows=CHUNK_ROWS):
+
+    """
+    Function to validate training data that is already in memory, in slices of chunk_rows rows.
+    Args:
+        df (pd.DataFrame): Training data with the gRNA_PAM and efficacy columns
+        chunk_rows (int): Number of rows per slice
+    Returns:
+        valid (pd.DataFrame): Valid rows without duplicates (original index)
+        report (dict): See validate_csv
+
+    """
+    missing = [column for column in REQUIRED_COLUMNS if column not in df.columns]
+    if missing:
+        raise ValidationError(f"Missing required columns: {missing} | Required : {REQUIRED_COLUMNS}")
+    report = new_report()
+    slices = (df[REQUIRED_COLUMNS].iloc[start:start + chunk_rows] for start in range(0, len(df), chunk_rows))
+    valid = list(iter_valid_chunks(slices, report))
+    valid = pd.concat(valid) if valid else df[REQUIRED_COLUMNS].iloc[:0]
+    return valid, _finish_report(report)
@@ -0,0 +1,97 @@
+"""
+Estimators used as members of the stacking model in addition to the scikit-learn and XGBoost ones.
+They live in their own module, because the saved models reference them when they are loaded for the predictions.
+"""
+
+# Importing required libraries
+import time
+
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+from xgboost import XGBRegressor
+
+class TimedRandomForestRegressor(RandomForestRegressor):
+
+    """
+    RandomForestRegressor that records the duration of its last fit in fit_seconds_ (for the training profile).
+
+    """
+
+    def fit(self, X, y, sample_weight=None):
+        start = time.perf_counter()
+        super().fit(X, y, sample_weight=sample_weight)
+        self.fit_seconds_ = time.perf_counter() - start
+        return self
+
+class TimedXGBRegressor(XGBRegressor):
+
+    """
+    XGBRegressor that records the duration of its last fit in fit_seconds_ (for the training profile).
+
+    """
+
+    def fit(self, X, y, **kwargs):
+        start = time.perf_counter()
+        super().fit(X, y, **kwargs)
+        self.fit_seconds_ = time.perf_counter() - start
+        return self
+
+class WarmStartXGBRegressor(TimedXGBRegressor):
+
+    """
+    XGBRegressor that continues boosting from a previously trained booster.
+    The booster is passed as the init_model parameter, n_estimators is the number of boosting rounds added to it.
+    It replaces the XGBoost member of a fitted StackingRegressor (see model_generator.train_model) and is not fitted
+    on its cross-validation folds, where the previous booster would have seen the held-out rows.
+    Args:
+        init_model (xgboost.Booster): Booster to continue from (None trains from scratch).
+        **kwargs: Parameters of XGBRegressor.
+
+    """
+
+    def __init__(self, *, init_model=None, **kwargs):
+        super().__init__(**kwargs)
+        self.init_model = init_model
+
+    def get_xgb_params(self):
+        # The booster is not a training parameter of XGBoost
+        params = super().get_xgb_params()
+        params.pop('init_model', None)
+        return params
+
+    def fit(self, X, y, **kwargs):
+        if self.init_model is not None:
+            kwargs.setdefault('xgb_model', self.init_model)
+        return super().fit(X, y, **kwargs)
+
+class BlendedStackingRegressor:
+
+    """
+    Stacking model of already trained base models, used by the out-of-core training (see out_of_core.py) where the
+    base models cannot be refitted on cross-validation folds. The final estimator is fitted on the predictions of the
+    base models for held-out rows that none of them was trained on. It predicts like the StackingRegressor and
+    exposes the trained base models the same way (named_estimators_).
+    Args:
+        estimators (list): Trained base models as (name, model) tuples.
+        final_estimator: Estimator blending the predictions of the base models.
+
+    """
+
+    def __init__(self, estimators, final_estimator):
+        self.estimators = estimators
+        self.final_estimator = final_estimator
+
+    @property
+    def named_estimators_(self):
+        return dict(self.estimators)
+
+    def transform(self, X):
+        # Predictions of the base models, one column per model
+        return np.column_stack([model.predict(X) for _, model in self.estimators])
+
+    def fit_final(self, X, y):
+        self.final_estimator_ = self.final_estimator.fit(self.transform(X), y)
+        return self
+
+    def predict(self, X):
+        return self.final_estimator_.predict(self.transform(X))
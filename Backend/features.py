@@ -0,0 +1,178 @@
+"""
+Feature calculation shared by the model training (model_generator.py) and the model usage (model_usage.py).
+The features of a batch of sequences are stored in a contiguous float32 matrix with one row per sequence
+and the columns in FEATURE_NAMES order, which is the format the models are trained on and predict from.
+The structural features are calculated with the ViennaRNA package and the one-hot encoding is vectorized over
+the whole batch (uint8) before it is copied into the matrix.
+"""
+
+# Importing required libraries
+import RNA
+import numpy as np
+import pandas as pd
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+KMER_LENGTH = 23
+BASES = b'AUCG'  # One-hot encoded bases (in this order)
+
+# Names of the features (same order as the columns of the feature matrix)
+STRUCTURE_FEATURES = ['MFE', 'Avg_BP_Prob', 'Ensemble_Energy', 'Helices', 'Avg_Helix_Length', 'Fraction_Paired']
+ONE_HOT_FEATURES = [f'OneHot_{i}' for i in range(KMER_LENGTH * len(BASES))]
+FEATURE_NAMES = STRUCTURE_FEATURES[:3] + ONE_HOT_FEATURES + STRUCTURE_FEATURES[3:]
+STRUCTURE_COLUMNS = [0, 1, 2] + [len(FEATURE_NAMES) - 3, len(FEATURE_NAMES) - 2, len(FEATURE_NAMES) - 1]
+ONE_HOT_COLUMNS = slice(3, 3 + len(ONE_HOT_FEATURES))
+
+# Function to calculate the structural features of a sequence
+def structure_features(seq, timings=None):
+
+    """
+    Function to calculate the structural features of a single sequence using the ViennaRNA package:
+    1. Minimum free energy (MFE) of the secondary structure.
+    2. Average base-pairing probability.
+    3. Ensemble energy (mean base pair distance of the ensemble).
+    4. Number of helices, average helix length and fraction of paired bases of the MFE structure.
+    Args:
+        seq (str): RNA sequence
+        timings (dict): Seconds spent per feature, the time of this sequence is added to it (optional)
+    Returns:
+        features (list): Structural features in STRUCTURE_FEATURES order
+
+    """
+    start = time.perf_counter()
+    fc = RNA.fold_compound(seq)
+
+    # 1. Minimum free energy (MFE)
+    (ss, mfe) = fc.mfe()
+    mfe_end = time.perf_counter()
+
+    # 2. Base-pairing probabilities
+    fc.pf()
+    n = len(seq)
+    bp_probs = np.array(fc.bpp())[:n, :n]
+    avg_bp_prob = bp_probs[np.triu_indices(n, 1)].mean()
+    bpp_end = time.perf_counter()
+
+    # 3. Thermodynamic properties (using ensemble free energy)
+    ensemble_energy = fc.mean_bp_distance()
+    ensemble_end = time.perf_counter()
+
+    # 4. Structural properties
+    helices, paired_bases, in_helix, current_helix_length, helix_lengths = 0, 0, False, 0, []
+    for char in ss:
+        if char == '(':
+            paired_bases += 1
+            if not in_helix:
+                helices += 1
+                in_helix = True
+            current_helix_length += 1
+        elif char == ')':
+            paired_bases += 1
+            current_helix_length += 1
+        else:
+            if in_helix:
+                helix_lengths.append(current_helix_length)
+                current_helix_length = 0
+                in_helix = False
+
+    if in_helix:
+        helix_lengths.append(current_helix_length)
+
+    avg_helix_length = np.mean(helix_lengths) if helix_lengths else 0
+    fraction_paired = paired_bases / n
+
+    if timings is not None:
+        for feature, seconds in [('MFE', mfe_end - start), ('Avg_BP_Prob', bpp_end - mfe_end),
+                                 ('Ensemble_Energy', ensemble_end - bpp_end),
+                                 ('Helices', time.perf_counter() - ensemble_end)]:
+            timings[feature] = timings.get(feature, 0.0) + seconds
+
+    return [mfe, avg_bp_prob, ensemble_energy, helices, avg_helix_length, fraction_paired]
+
+# Function to one-hot encode a batch of sequences
+def one_hot_encode(seqs, length=KMER_LENGTH):
+
+    """
+    Function to one-hot encode a batch of sequences. Each position is encoded as 4 values for the bases A, U, C, G.
+    Sequences shorter than length are padded with zeros.
+    Args:
+        seqs (list): Sequences
+        length (int): Number of encoded positions
+    Returns:
+        one_hot (np.ndarray): uint8 matrix of shape (number of sequences, length * 4)
+
+    """
+    padded = ''.join(seq[:length].ljust(length, '-') for seq in seqs).encode('ascii', errors='replace')
+    positions = np.frombuffer(padded, dtype=np.uint8).reshape(len(seqs), length)
+    one_hot = positions[:, :, None] == np.frombuffer(BASES, dtype=np.uint8)
+    return one_hot.reshape(len(seqs), length * len(BASES)).view(np.uint8)
+
+# Function to calculate the feature matrix of a batch of sequences
+def feature_matrix(seqs, dtype=np.float32, timings=None, errors=None):
+
+    """
+    Function to calculate the features of a batch of sequences into a contiguous matrix.
+    If the calculation fails for a sequence, its row is filled with NaN and it is marked in the returned mask.
+    If timings is given, the seconds spent per feature are added to it: the ViennaRNA steps per structural feature
+    ('Helices' covers the three features derived from the MFE structure) and 'OneHot' for the one-hot encoding.
+    Args:
+        seqs (list): Sequences
+        dtype (np.dtype): Data type of the matrix (default float32)
+        timings (dict): Seconds spent per feature (optional)
+        errors (list): List to append (position, sequence, error message) of the failed sequences to (optional)
+    Returns:
+        X (np.ndarray): Feature matrix of shape (number of sequences, number of features)
+        failed (np.ndarray): Boolean mask of the sequences for which the calculation failed
+
+    """
+    seqs = list(seqs)
+    X = np.empty((len(seqs), len(FEATURE_NAMES)), dtype=dtype)
+    failed = np.zeros(len(seqs), dtype=bool)
+    start = time.perf_counter()
+    X[:, ONE_HOT_COLUMNS] = one_hot_encode(seqs)
+    if timings is not None:
+        timings['OneHot'] = timings.get('OneHot', 0.0) + time.perf_counter() - start
+    for i, seq in enumerate(seqs):
+        try:
+            X[i, STRUCTURE_COLUMNS] = structure_features(seq, timings)
+        except Exception as e:
+            logger.error(f"Error calculating features for sequence: {seq}. Error: {str(e)}")
+            X[i] = np.nan
+            failed[i] = True
+            if errors is not None:
+                errors.append((i, seq, str(e)))
+    return X, failed
+
+# Function to rebuild the one-hot encoded features of k-mers
+def one_hot_frame(kmers, index=None):
+
+    """
+    Function to rebuild the one-hot encoded features of k-mers (they are not stored with the saved results,
+    since they only depend on the k-mer).
+    Args:
+        kmers (list): k-mers
+        index (list): Index of the DataFrame (optional)
+    Returns:
+        one_hot (pd.DataFrame): uint8 one-hot encoded features with the ONE_HOT_FEATURES columns
+
+    """
+    return pd.DataFrame(one_hot_encode(list(kmers)), columns=ONE_HOT_FEATURES, index=index)
+
+# Function to convert a feature matrix into a DataFrame
+def feature_frame(X, index=None):
+
+    """
+    Function to wrap a feature matrix into a DataFrame with the feature names as columns.
+    The structural features stay float32 and the one-hot encoded features are stored as uint8.
+    Args:
+        X (np.ndarray): Feature matrix
+        index (list): Index of the DataFrame (optional)
+    Returns:
+        features (pd.DataFrame): Features
+
+    """
+    features = pd.DataFrame(X, columns=FEATURE_NAMES, index=index)
+    features[ONE_HOT_FEATURES] = features[ONE_HOT_FEATURES].astype(np.uint8)
+    return features
@@ -0,0 +1,171 @@
+"""
+Time-budgeted hyperparameter search for the base models (RandomForest and XGBoost) of the stacking model.
+The search uses successive halving: many random configurations are evaluated on a small part of the training data,
+the best third of them is kept and evaluated again on three times as much data, until one configuration per model
+is left or the wall-clock budget is used up. The evaluations run in a pool of worker processes, which all read the
+same cached feature matrix from disk (memory mapped), so the features are never calculated or copied again.
+"""
+
+# Importing required libraries
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import mean_squared_error
+from xgboost import XGBRegressor
+
+from Backend.profiling import core_budget
+
+logger = logging.getLogger(__name__)
+
+# Search spaces of the base models
+SEARCH_SPACES = {
+    'random_forest': {
+        'n_estimators': [100, 200, 400],
+        'max_depth': [None, 10, 20, 30],
+        'min_samples_leaf': [1, 2, 4],
+        'max_features': [1.0, 0.5, 'sqrt']
+    },
+    'xgboost': {
+        'n_estimators': [100, 200, 400],
+        'max_depth': [3, 4, 6, 8],
+        'learning_rate': [0.03, 0.1, 0.3],
+        'subsample': [0.7, 0.85, 1.0],
+        'colsample_bytree': [0.5, 0.8, 1.0]
+    }
+}
+
+def _make_model(name, params, random_state=42):
+    if name == 'random_forest':
+        return RandomForestRegressor(random_state=random_state, n_jobs=1, **params)
+    return XGBRegressor(random_state=random_state, n_jobs=1, **params)
+
+# Function to evaluate one configuration (in a worker process)
+def evaluate_candidate(cache_dir, name, params, n_rows):
+
+    """
+    Function to fit one configuration of a base model on the first n_rows training rows of the cached feature matrix
+    and score it on the validation rows.
+    Args:
+        cache_dir (str): Directory of the cached feature matrix
+        name (str): Name of the base model ('random_forest' or 'xgboost')
+        params (dict): Hyperparameters of the base model
+        n_rows (int): Number of training rows
+    Returns:
+        mse (float): Validation mean squared error
+        fit_seconds (float): Time needed to fit the model
+
+    """
+    X = np.load(os.path.join(cache_dir, 'X.npy'), mmap_mode='r')
+    y = np.load(os.path.join(cache_dir, 'y.npy'), mmap_mode='r')
+    train = np.load(os.path.join(cache_dir, 'train.npy'))[:n_rows]
+    validation = np.load(os.path.join(cache_dir, 'validation.npy'))
+
+    model = _make_model(name, params)
+    start = time.perf_counter()
+    model.fit(X[train], y[train])
+    fit_seconds = time.perf_counter() - start
+    return mean_squared_error(y[validation], model.predict(X[validation])), fit_seconds
+
+def _sample_candidates(name, n_candidates, rng):
+    space = SEARCH_SPACES[name]
+    candidates = []
+    while len(candidates) < n_candidates:
+        params = {key: values[rng.integers(len(values))] for key, values in space.items()}
+        params = {key: value.item() if isinstance(value, np.generic) else value for key, value in params.items()}
+        if params not in candidates:
+            candidates.append(params)
+    return candidates
+
+# Function to run the hyperparameter search
+def successive_halving_search(X, y, budget_seconds=600, n_candidates=27, eta=3, n_workers=None, random_state=42):
+
+    """
+    Function to search the hyperparameters of the RandomForest and XGBoost base models with successive halving
+    within a wall-clock budget. 20% of the rows are held out for validation. In the first round all the candidates
+    are fitted on a small share of the training rows, every following round keeps the best 1/eta of the candidates
+    of each model and gives them eta times as many rows. Evaluations that are still running when the budget is
+    used up are stopped and the best configuration of the last finished round is returned.
+    Args:
+        X (np.ndarray): Features
+        y (np.ndarray): Target values
+        budget_seconds (float): Wall-clock budget of the search
+        n_candidates (int): Number of random configurations per model in the first round
+        eta (int): Halving factor
+        n_workers (int): Number of worker processes (default: the core budget, see profiling.core_budget)
+        random_state (int): Seed for the configurations and the validation split
+    Returns:
+        dict: Best hyperparameters per model ('random_forest', 'xgboost'), their validation MSE and the search timings
+
+    """
+    start = time.perf_counter()
+    deadline = start + budget_seconds
+    rng = np.random.default_rng(random_state)
+    n_workers = n_workers or core_budget()
+
+    # Cache the feature matrix once for all the workers
+    cache_dir = tempfile.mkdtemp(prefix='castor_search_')
+    order = rng.permutation(len(y))
+    n_validation = max(1, len(y) // 5)
+    np.save(os.path.join(cache_dir, 'X.npy'), np.ascontiguousarray(X, dtype=np.float32))
+    np.save(os.path.join(cache_dir, 'y.npy'), np.asarray(y, dtype=np.float32))
+    np.save(os.path.join(cache_dir, 'validation.npy'), order[:n_validation])
+    np.save(os.path.join(cache_dir, 'train.npy'), order[n_validation:])
+    n_train = len(y) - n_validation
+
+    n_rounds = max(1, int(np.floor(np.log(n_candidates) / np.log(eta))) + 1)
+    candidates = {name: _sample_candidates(name, n_candidates, rng) for name in SEARCH_SPACES}
+    best = {name: {'params': {}, 'mse': None, 'rows': 0} for name in SEARCH_SPACES}  # Defaults if no round finishes
+    rounds = []
+
+    logger.info(f"Hyperparameter search: {n_candidates} candidates per model, {n_rounds} rounds, "
+                f"{n_workers} workers, budget {budget_seconds} s.")
+    pool = multiprocessing.get_context('spawn').Pool(n_workers)
+    try:
+        for round_index in range(n_rounds):
+            n_rows = max(1, int(n_train / eta ** (n_rounds - 1 - round_index)))
+            jobs = {(name, i): pool.apply_async(evaluate_candidate, (cache_dir, name, params, n_rows))
+                    for name in candidates for i, params in enumerate(candidates[name])}
+
+            # Collect the results until the budget is used up
+            results = {}
+            for key, job in jobs.items():
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    results[key] = job.get(timeout=remaining)
+                except multiprocessing.TimeoutError:
+                    break
+            if len(results) < len(jobs):
+                logger.info(f"Hyperparameter search budget used up in round {round_index + 1}.")
+                break
+
+            round_summary = {'round': round_index + 1, 'rows': n_rows, 'evaluations': len(results),
+                             'fit_seconds': sum(fit_seconds for _, fit_seconds in results.values()),
+                             'elapsed_seconds': time.perf_counter() - start}
+            rounds.append(round_summary)
+            logger.info(f"Hyperparameter search round {round_summary}")
+
+            # Keep the best 1/eta of the candidates of each model
+            for name in candidates:
+                scored = sorted(range(len(candidates[name])), key=lambda i: results[(name, i)][0])
+                best[name] = {'params': candidates[name][scored[0]], 'mse': results[(name, scored[0])][0], 'rows': n_rows}
+                candidates[name] = [candidates[name][i] for i in scored[:max(1, len(scored) // eta)]]
+    finally:
+        pool.terminate()
+        pool.join()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    search = {name: best[name]['params'] for name in SEARCH_SPACES}
+    search.update({'validation_mse': {name: best[name]['mse'] for name in SEARCH_SPACES},
+                   'validation_rows': {name: best[name]['rows'] for name in SEARCH_SPACES},
+                   'rounds': rounds, 'budget_seconds': budget_seconds, 'workers': n_workers,
+                   'elapsed_seconds': time.perf_counter() - start})
+    logger.info(f"Hyperparameter search completed: {search}")
+    return search
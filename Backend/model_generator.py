@@ -7,29 +7,44 @@ or loads the data from a CSV file (original dataset) when run locally for the fi
 The module extracts sequence-based features using the ViennaRNA package, preprocesses the data,
 and trains a stacking model combining RandomForest and XGBoost.
 It then evaluates the model's performance and saves the trained model to a file.
-Additionally, it visualizes feature distributions and stores the generated plots in a specified directory.
+Additionally, it visualizes feature distributions and stores the generated plots in a specified directory
+(rendered in parallel once the model is saved, see training_plots.py).
+Optionally, a small student model is distilled from the stacking model for low-latency serving.
 
 """
 
 
 # Importing required libraries
-import RNA
 import pandas as pd
 import numpy as np
-import re
 from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestRegressor, StackingRegressor
+from sklearn.ensemble import StackingRegressor
 from sklearn.metrics import mean_squared_error, r2_score, mean_absolute_error
 from xgboost import XGBRegressor
 from sklearn.linear_model import LinearRegression
 from sklearn.preprocessing import StandardScaler
 from sklearn.impute import SimpleImputer
-import matplotlib.pyplot as plt
-import seaborn as sns
+from sklearn.pipeline import Pipeline
+from joblib import parallel_config
+from joblib.externals.loky import get_reusable_executor
 import logging
 import pickle
+import json
+import time
 import os
+import shutil
+import hashlib
 import sys
+from datetime import datetime
+import RNA
+from Backend.features import FEATURE_NAMES, feature_matrix
+from Backend.data_validation import validate_dataframe
+from Backend.estimators import TimedRandomForestRegressor, TimedXGBRegressor, WarmStartXGBRegressor
+from Backend.hyperparameter_search import successive_halving_search
+from Backend.training_plots import PLOT_DIR, dataset_hash, render_training_plots
+from Backend.profiling import PipelineProfiler, core_budget
+from Backend.cross_validation import cross_validate
+from Backend import model_registry
 
 # Configure logging
 logging.basicConfig(
@@ -42,12 +57,24 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+MODEL_PATH = 'Backend/stacking_model.pkl'  # Output of a local run (imported into the model registry if it has no models yet)
+CANDIDATE_MODEL_PATH = 'Backend/candidate_model.pkl'  # Newly trained model, registered as a new version (see model_registry.py)
+STUDENT_MODEL_PATH = 'Backend/student_model.pkl'
+FEATURE_STORE_PATH = 'Backend/training_features.pkl'  # Features of all the training sequences folded so far
+FEATURE_STORE_FORMAT = 3  # Increased when the layout of the feature store changes, so an older store is not reused
+FEATURE_CHECKPOINT_DIR = 'Backend/feature_checkpoints'  # Completed feature chunks of an unfinished extraction
+CHECKPOINT_ROWS = 2000  # Sequences per feature chunk
+QUARANTINE_PATH = 'Backend/quarantined_rows.csv'  # Training rows whose features could not be calculated
+WARM_START_ROUNDS = 25  # Boosting rounds added to the previous XGBoost booster in incremental training
+CV_FOLDS = 5  # Internal cross-validation folds of the stacking model
+
 # Function to check if the data is valid
 def check_data(df):
 
     """
     Check the input data for completeness and validity. This is done by checking the required columns, na values, and duplicate rows.
     We also check if the sequences contain valid nucleotides (A, U, C, G) (necessary check for biological sequences ).
+    The checks are vectorized and run in chunks (see data_validation.py), invalid rows are logged with their index.
     Args:
         df (pd.DataFrame): Input DataFrame containing RNA sequences and efficacy values.
     Returns:
@@ -62,20 +89,11 @@ def check_data(df):
         
         logger.info(f"Data loaded.....performing checks on the data. Shape:{df.shape}")
         
-        # Check for required columns
-        required_columns = {"gRNA_PAM", "efficacy"}
-        if not required_columns.issubset(df.columns):
-            raise ValueError(f"Missing required columns. Expected columns: {required_columns}")
-                
-        # Drop missing values
-        df = df.dropna()
-
-        # Remove duplicate rows
-        df = df.drop_duplicates()
-
-        # Check for valid nucleotide sequences
-        valid_nucleotides_pattern = re.compile(r"^[ATCG]+$", re.IGNORECASE)
-        df = df[df['gRNA_PAM'].apply(lambda x: isinstance(x, str) and bool(valid_nucleotides_pattern.match(x)))]
+        # Check the required columns, drop missing values, duplicate rows and invalid nucleotide sequences
+        df, report = validate_dataframe(df)
+        if report['invalid_rows'] > 0:
+            logger.warning(f"Dropped {report['invalid_rows']} invalid rows, first rows: "
+                           f"{report['invalid']['reason'].head(10).to_dict()}")
         logger.info(f"Input Data checks done.......Shape:{df.shape}")
         return df
     except Exception as e:
@@ -94,6 +112,7 @@ def calculate_features(seq):
     4. Sequence-based features using one-hot encoding.
     5. Structural properties like number of helices, average helix length, and fraction of paired bases.
     All the features serve as input to the machine learning model for our prediction task.
+    The calculation itself is shared with the model usage (see features.py).
     Args:
         seq (str): RNA sequence.
     Returns:
@@ -101,117 +120,356 @@ def calculate_features(seq):
 
     """
 
-    try:
-        # 1. Minimum free energy (MFE)
-        (ss, mfe) = RNA.fold(seq)
+    X, failed = feature_matrix([seq], dtype=np.float64)
+    return None if failed[0] else X[0].tolist()
 
-        #2. Base-pairing probabilities
-        fc = RNA.fold_compound(seq)
-        (pp, pf) = fc.pf()
-        bp_probs = fc.bpp()
-        avg_bp_prob = np.mean([bp_probs[i][j] for i in range(len(seq)) for j in range(i+1, len(seq)) if i < j])
+def _save_checkpoint(path, checkpoint):
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(checkpoint, f)
+    os.replace(path + '.tmp', path)
 
-        # 3. Thermodynamic properties (using ensemble free energy)
-        ensemble_energy = fc.mean_bp_distance()
-        
-        # 4. Sequence-based features (one-hot encoding)
-        bases = ['A', 'U', 'C', 'G']
-        one_hot = np.array([[1 if seq[i] == b else 0 for b in bases] for i in range(len(seq))]).flatten()
-        
-        # 5. Structural properties
-        helices, paired_bases, in_helix, current_helix_length, helix_lengths = 0, 0, False, 0, []
-        
-        for char in ss:
-            if char == '(':
-                paired_bases += 1
-                if not in_helix:
-                    helices += 1
-                    in_helix = True
-                current_helix_length += 1
-            elif char == ')':
-                paired_bases += 1
-                current_helix_length += 1
+# Function to extract features from RNA sequences
+def extract_features(df, timings=None, errors=None, checkpoint_dir=None):
+
+    """
+    Extract features from RNA sequences using the ViennaRNA package.
+    We calculate features for all RNA sequences in the DataFrame into one contiguous float32 matrix
+    (see features.feature_matrix) and wrap it into a DataFrame using the feature names.
+    The sequences are processed in chunks of CHECKPOINT_ROWS. If a checkpoint directory is given, every completed chunk
+    is saved there and a restarted extraction of the same sequences loads the completed chunks instead of folding them again.
+    Rows for which the calculation fails are left out (quarantined) instead of aborting the extraction.
+    Args:
+        df (pd.DataFrame): DataFrame containing RNA sequences.
+        timings (dict): Seconds spent per feature, updated during the calculation (optional).
+        errors (list): List to append the (sequence, error message) of the quarantined rows to (optional).
+        checkpoint_dir (str): Directory for the completed chunks (optional).
+    Returns:
+        pd.DataFrame: DataFrame containing calculated features for each sequence (index of df, without the failed rows).
+    """
+
+    logger.info("Extracting features for RNA sequences...")
+    try:
+        if checkpoint_dir is not None:
+            os.makedirs(checkpoint_dir, exist_ok=True)
+        chunks, n_failed = [], 0
+        for start in range(0, len(df), CHECKPOINT_ROWS):
+            chunk = df.iloc[start:start + CHECKPOINT_ROWS]
+            path = None if checkpoint_dir is None else os.path.join(checkpoint_dir, f'chunk_{start // CHECKPOINT_ROWS}.pkl')
+            if path is not None and os.path.exists(path):
+                with open(path, 'rb') as f:
+                    checkpoint = pickle.load(f)
+                logger.info(f"Resuming from checkpoint {path}.")
             else:
-                if in_helix:
-                    helix_lengths.append(current_helix_length)
-                    current_helix_length = 0
-                    in_helix = False
-        
-        if in_helix:
-            helix_lengths.append(current_helix_length)
-        
-        avg_helix_length = np.mean(helix_lengths) if helix_lengths else 0
-        fraction_paired = paired_bases / len(seq)
-        
-        return [mfe, avg_bp_prob, ensemble_energy] + list(one_hot) + [helices, avg_helix_length, fraction_paired]
+                # Calculate features for each sequence
+                chunk_errors = []
+                X, failed = feature_matrix(chunk['gRNA_PAM'], timings=timings, errors=chunk_errors)
+                checkpoint = {'features': pd.DataFrame(X[~failed], columns=FEATURE_NAMES, index=chunk.index[~failed]),
+                              'errors': [(seq, error) for _, seq, error in chunk_errors]}
+                if path is not None:
+                    _save_checkpoint(path, checkpoint)
+            chunks.append(checkpoint['features'])
+            n_failed += len(checkpoint['errors'])
+            if errors is not None:
+                errors.extend(checkpoint['errors'])
+        if n_failed > 0:
+            logger.warning(f"Feature calculation failed for {n_failed} sequences, the rows are quarantined.")
+        return pd.concat(chunks) if chunks else pd.DataFrame(columns=FEATURE_NAMES, dtype=np.float32)
+    except Exception as e:
+        logger.error(f"Error during feature extraction: {str(e)}")
+        sys.exit(1)  # The completed chunks are kept for the next run
+
+# Function to save the quarantined rows
+def save_quarantine(df, errors, file_path=QUARANTINE_PATH):
+
+    """
+    Save the training rows whose features could not be calculated, with the error message, as a CSV error report.
+    Args:
+        df (pd.DataFrame): Training data.
+        errors (list): (sequence, error message) of the failed sequences.
+        file_path (str): File path of the error report.
+    Returns:
+        dict: Number of quarantined rows, path of the report and the first rows.
+
+    """
+    messages = dict(errors)
+    quarantined = df[df['gRNA_PAM'].isin(messages.keys())].copy()
+    quarantined['error'] = quarantined['gRNA_PAM'].map(messages)
+    quarantined.rename_axis('row').to_csv(file_path)
+    logger.warning(f"{len(quarantined)} training rows quarantined in {file_path}.")
+    return {'rows': len(quarantined), 'report': file_path,
+            'first_rows': quarantined.head(20).reset_index(names='row').to_dict(orient='records')}
+
+# Function to get the schema of the feature store
+def feature_store_schema():
+
+    """
+    Get the schema of the stored training features: the format of the store, the feature names and the version of
+    the ViennaRNA package the structural features are calculated with.
+    Returns:
+        dict: Schema of the feature store.
+
+    """
+    return {'format': FEATURE_STORE_FORMAT, 'features': FEATURE_NAMES, 'vienna_rna': RNA.__version__}
+
+# Function to load the stored training features
+def load_feature_store(file_path=FEATURE_STORE_PATH):
+
+    """
+    Load the features of the training sequences folded by previous runs.
+    The store holds the features as a DataFrame indexed by the sequence with one column per feature, and the error
+    message of every quarantined sequence (whose features could not be calculated) as a Series indexed by the sequence.
+    It is saved together with its schema (see feature_store_schema), a store of another schema (other features,
+    feature calculation or ViennaRNA version) is not reused and all the sequences are folded again.
+    Args:
+        file_path (str): File path of the feature store.
+    Returns:
+        dict: Stored 'features' and 'quarantined' sequences (None if there is no compatible store yet).
+
+    """
+    if not os.path.exists(file_path):
+        logger.info("No stored training features found.")
+        return None
+    try:
+        stored = pd.read_pickle(file_path)
+        if not isinstance(stored, dict) or stored.get('schema') != feature_store_schema():
+            logger.warning("The stored training features have another schema and are not reused.")
+            return None
+        feature_store = {'features': stored['features'], 'quarantined': stored['quarantined']}
+        logger.info(f"Loaded stored features of {len(feature_store['features'])} sequences "
+                    f"({len(feature_store['quarantined'])} quarantined sequences).")
+        return feature_store
     except Exception as e:
-        logger.error(f"Error calculating features for sequence: {seq}. Error: {str(e)}")
+        logger.warning(f"Could not load the stored training features: {str(e)}")
         return None
 
-# Function to extract features from RNA sequences
-def extract_features(df):
+# Function to save the training features
+def save_feature_store(feature_store, file_path=FEATURE_STORE_PATH):
 
     """
-    Extract features from RNA sequences using the ViennaRNA package.
-    We calculate features for each RNA sequence in the DataFrame using the calculate_features function and 
-    combine them into a single DataFrame using the feature names.
+    Save the features of the training sequences, so the next incremental run only folds new sequences.
+    The store is written to a temporary file first and then renamed, so a failed write keeps the old store.
+    Args:
+        feature_store (dict): Features and quarantined sequences (see load_feature_store).
+        file_path (str): File path of the feature store.
+    Returns:
+        None
+
+    """
+    try:
+        pd.to_pickle(dict(feature_store, schema=feature_store_schema()), file_path + '.tmp')
+        os.replace(file_path + '.tmp', file_path)
+        logger.info(f"Stored features of {len(feature_store['features'])} sequences in {file_path}.")
+    except Exception as e:
+        logger.warning(f"Could not save the training features: {str(e)}")
+
+# Function to extract features reusing the stored features
+def extract_features_incremental(df, feature_store=None, timings=None, errors=None):
+
+    """
+    Extract features for the RNA sequences, folding only the sequences that are not in the feature store yet.
+    The features of the new sequences are calculated with extract_features and added to the store. The chunks are
+    checkpointed in a directory named after the hash of the new sequences, so a failed run resumes where it stopped.
+    Sequences whose features cannot be calculated are quarantined, their rows are not part of the returned features.
+    The quarantined sequences are recorded in the store as well, so they are not folded again by the next runs
+    (they are reported with their stored error message).
     Args:
         df (pd.DataFrame): DataFrame containing RNA sequences.
+        feature_store (dict): Stored features and quarantined sequences (None folds all the sequences).
+        timings (dict): Seconds spent per feature, updated during the calculation (optional).
+        errors (list): List to append the (sequence, error message) of the quarantined sequences to (optional).
     Returns:
-        pd.DataFrame: DataFrame containing calculated features for each sequence.
+        pd.DataFrame: DataFrame containing the features for each sequence (in the order and with the index of df).
+        dict: Updated feature store.
+
     """
 
-    logger.info("Extracting features for RNA sequences...")
-    # Calculate features for each sequence
-    features = df['gRNA_PAM'].apply(calculate_features)
-    if features.isnull().any():
-        logger.error("Feature calculation failed for one or more sequences.")
-        sys.exit(1)
-    feature_names = ['MFE', 'Avg_BP_Prob', 'Ensemble_Energy'] +[f'OneHot_{i}' for i in range(92)] + ['Helices', 'Avg_Helix_Length',
-                                                                                                      'Fraction_Paired']
-    return pd.DataFrame(features.tolist(), columns=feature_names)
+    sequences = pd.Index(df['gRNA_PAM'].unique())
+    features = None if feature_store is None else feature_store['features']
+    quarantined = pd.Series(dtype=object) if feature_store is None else feature_store['quarantined']
+    skipped = sequences[sequences.isin(quarantined.index)]
+    if len(skipped) > 0:
+        logger.warning(f"{len(skipped)} sequences were quarantined by a previous run and are skipped.")
+        if errors is not None:
+            errors.extend(zip(skipped, quarantined.loc[skipped]))
+    unseen = sequences.difference(quarantined.index) if features is None else \
+        sequences.difference(features.index).difference(quarantined.index)
+    logger.info(f"{len(unseen)} of {len(sequences)} unique sequences are new and need to be folded.")
+
+    if len(unseen) > 0 or features is None:
+        checkpoint_id = hashlib.sha256('\n'.join(unseen).encode('utf-8')).hexdigest()[:16]
+        checkpoint_dir = os.path.join(FEATURE_CHECKPOINT_DIR, checkpoint_id)
+        if os.path.isdir(FEATURE_CHECKPOINT_DIR):
+            for stale in os.listdir(FEATURE_CHECKPOINT_DIR):  # Checkpoints of other datasets can't be resumed
+                if stale != checkpoint_id:
+                    shutil.rmtree(os.path.join(FEATURE_CHECKPOINT_DIR, stale), ignore_errors=True)
+        new_errors = []
+        new_features = extract_features(pd.DataFrame({'gRNA_PAM': unseen}), timings, new_errors, checkpoint_dir)
+        new_features.index = unseen[np.asarray(new_features.index, dtype=int)]
+        features = new_features if features is None else pd.concat([features, new_features])
+        if new_errors:
+            quarantined = pd.concat([quarantined, pd.Series(dict(new_errors), dtype=object)])
+        if errors is not None:
+            errors.extend(new_errors)
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)  # The features are in the store now
+
+    folded = df['gRNA_PAM'].isin(features.index)
+    X = features.loc[df['gRNA_PAM'][folded]]
+    X.index = df.index[folded]
+    return X, {'features': features, 'quarantined': quarantined}
+
+# Function to hash training sequences
+def sequence_hashes(sequences):
+
+    """
+    Hash training sequences into 64 bit integers (stable between runs), to record compactly which sequences a model
+    was trained on.
+    Args:
+        sequences (list): Sequences.
+    Returns:
+        np.ndarray: uint64 hash of every sequence.
+
+    """
+    return pd.util.hash_pandas_object(pd.Series(sequences, dtype=object), index=False).to_numpy()
+
+# Function to load the XGBoost booster of a saved model
+def load_previous_booster(file_path=None):
+
+    """
+    Load the XGBoost booster of the saved stacking model, to warm-start the XGBoost member of the next model, together
+    with the fitted preprocessing of the model (the booster splits on features in its scale) and the hashes of all
+    the sequences the booster was trained on (see sequence_hashes), which must not be used to evaluate the next model.
+    Args:
+        file_path (str): File path of the saved model (default: the current model of the model registry).
+    Returns:
+        dict: Booster, preprocessor and trained sequence hashes of the saved model (None if there is no usable saved model).
+
+    """
+    try:
+        with open(file_path or model_registry.model_path(), 'rb') as f:
+            model = pickle.load(f)
+        if not hasattr(model, 'preprocessor_') or not hasattr(model, 'trained_sequences_'):
+            raise ValueError("the saved model has no stored preprocessing")
+        return {'booster': model.named_estimators_['xgboost'].get_booster(), 'preprocessor': model.preprocessor_,
+                'trained_sequences': model.trained_sequences_}
+    except Exception as e:
+        logger.warning(f"No previous XGBoost booster to warm-start from ({str(e)}), training from scratch.")
+        return None
 
 # Function to preprocess data (impute missing values and scale features)
-def preprocess_data(X):
+def preprocess_data(X, preprocessor=None):
 
     """
     Preprocess features by imputing missing values and scaling features.
     The missing values are imputed with the mean of the column and the features are scaled using StandardScaler.
     This ensures uniformity in the scale of the features.
+    If the fitted preprocessing of a previous model is given (warm start), it is reused instead of fitted again,
+    so the features are in the scale the previous booster was trained in.
+    The preprocessed features are returned as a contiguous float32 matrix (the format the models predict from).
     Args:
         X (pd.DataFrame): DataFrame containing features.
+        preprocessor (Pipeline): Fitted imputer and scaler of a previous model (optional).
     Returns:    
         np.ndarray: Preprocessed features.
+        Pipeline: Fitted imputer and scaler.
 
     """
 
     try:
         logger.info("Starting data preprocessing...")
         
-        # Impute missing values with mean
-        imputer = SimpleImputer(strategy='mean')
-        X = imputer.fit_transform(X)
-        
-        # Scale features using StandardScaler
-        scaler = StandardScaler()
-        X = scaler.fit_transform(X)
+        if preprocessor is None:
+            # Impute missing values with mean and scale features using StandardScaler
+            preprocessor = Pipeline([('imputer', SimpleImputer(strategy='mean')), ('scaler', StandardScaler())])
+            X = preprocessor.fit_transform(X)
+        else:
+            X = preprocessor.transform(X)
+        X = np.ascontiguousarray(X, dtype=np.float32)
 
         logger.info("Data Preprocessing Completed.")
         
-        return X
+        return X, preprocessor
     except Exception as e:
         logger.error(f"Error during data preprocessing: {str(e)}")
         sys.exit(1)
 
+# Function to plan the cores used by the training
+def plan_resources(total_cores=None, n_estimators=2, cv_folds=CV_FOLDS):
+
+    """
+    Split one total core budget between the parallel levels of the stacking model, so they don't oversubscribe the host.
+    The StackingRegressor runs its base estimators in parallel processes (limited by its n_jobs) and, in each of them,
+    the cross-validation folds one after another (joblib runs nested parallel calls sequentially in its workers).
+    Every concurrent fit gets an equal share of the cores for the RandomForest n_jobs and the XGBoost nthread.
+    Args:
+        total_cores (int): Total number of cores (default: CASTOR_TRAINING_CORES or all the cores of the host).
+        n_estimators (int): Number of base estimators of the stacking model.
+        cv_folds (int): Number of cross-validation folds of the stacking model.
+    Returns:
+        dict: Total cores, StackingRegressor n_jobs, RandomForest n_jobs and XGBoost nthread.
+
+    """
+    total_cores = max(1, int(total_cores or core_budget()))
+    # One process per base estimator, its folds run sequentially
+    stack_jobs = max(1, min(total_cores, n_estimators))
+    threads_per_fit = max(1, total_cores // min(cv_folds, stack_jobs))
+    plan = {'total_cores': total_cores, 'stack_n_jobs': stack_jobs,
+            'rf_n_jobs': threads_per_fit, 'xgb_nthread': threads_per_fit}
+    logger.info(f"Resource plan: {plan}")
+    return plan
+
+# Function to take a snapshot of the used resources
+def resource_snapshot():
+
+    """
+    Take a snapshot of the wall clock and the CPU time used by this process and its finished child processes.
+    Returns:
+        tuple: Wall clock time and CPU time in seconds.
+
+    """
+    times = os.times()
+    return time.perf_counter(), times.user + times.system + times.children_user + times.children_system
+
+# Function to measure the used resources
+def resource_usage(snapshot, total_cores):
+
+    """
+    Measure the wall time and the CPU utilization since a snapshot. The worker processes of joblib are shut down first,
+    so their CPU time is counted as well.
+    Args:
+        snapshot (tuple): Snapshot taken with resource_snapshot.
+        total_cores (int): Number of cores the work was planned for.
+    Returns:
+        dict: Wall time, CPU time (seconds) and CPU utilization (fraction of total_cores).
+
+    """
+    get_reusable_executor().shutdown(wait=True)
+    wall_end, cpu_end = resource_snapshot()
+    wall_seconds, cpu_seconds = wall_end - snapshot[0], cpu_end - snapshot[1]
+    usage = {'wall_seconds': wall_seconds, 'cpu_seconds': cpu_seconds,
+             'cpu_utilization': cpu_seconds / (wall_seconds * total_cores) if wall_seconds > 0 else None}
+    logger.info(f"Resource usage: {usage}")
+    return usage
+
 # Function to train a stacking model
-def train_model(X_train, y_train):
+def train_model(X_train, y_train, init_booster=None, resources=None, params=None):
 
     """
-    Create the base models Random Forest and XGBoost.The models are trained using the  default hyperparameters.
+    Create the base models Random Forest and XGBoost.The models are trained using the  default hyperparameters
+    unless tuned hyperparameters are given (see hyperparameter_search.py).
     After creating the base models we use a Linear Regression model as the final estimator for our stacking ensemble model.
+    If a booster of a previous model is given, the XGBoost member continues boosting from it (WARM_START_ROUNDS rounds)
+    instead of training from scratch. Only its fit on all the training rows does: the previous booster has seen
+    the rows of the earlier trainings, so its out-of-fold predictions would be in-sample for them and the final
+    estimator would over-weight XGBoost. The final estimator is fitted on the out-of-fold predictions of XGBoost
+    trained from scratch instead.
+    The cores are assigned to the cross-validation folds, RandomForest and XGBoost according to the resource plan.
+    The base models record the duration of their final fit (fit_seconds_) for the training profile.
     Args:
         X_train (np.ndarray): Training features.
         y_train (np.ndarray): Training target values.
+        init_booster (xgboost.Booster): Booster of a previous model to warm-start the XGBoost member (optional).
+        resources (dict): Resource plan from plan_resources (default: plan for all the available cores).
+        params (dict): Hyperparameters per base model, e.g. {'random_forest': {...}, 'xgboost': {...}} (optional).
     Returns:
         StackingRegressor: Trained stacking model.  
 
@@ -219,11 +477,32 @@ def train_model(X_train, y_train):
 
     logger.info("Training model...")
     try:
+        if resources is None:
+            resources = plan_resources()
+        params = params or {}
+        rf_params = params.get('random_forest', {})
+        xgb_params = params.get('xgboost', {})
+
         # Define base models and stacking model
-        base_models = [('random_forest', RandomForestRegressor(random_state=42)),
-                        ('xgboost', XGBRegressor(random_state=42))] # Keep the random_state constant for reproducibility
-        stacking_model = StackingRegressor(estimators=base_models, final_estimator=LinearRegression(), n_jobs=-1)
-        stacking_model.fit(X_train, y_train)
+        base_models = [('random_forest', TimedRandomForestRegressor(random_state=42, n_jobs=resources['rf_n_jobs'], **rf_params)),
+                        ('xgboost', TimedXGBRegressor(random_state=42, n_jobs=resources['xgb_nthread'], **xgb_params))] # Keep the random_state constant for reproducibility
+        stacking_model = StackingRegressor(estimators=base_models, final_estimator=LinearRegression(),
+                                           cv=CV_FOLDS, n_jobs=resources['stack_n_jobs'])
+        # Limit the threads of native libraries (OpenMP, BLAS) in the joblib workers to the planned threads per fit
+        with parallel_config(backend='loky', inner_max_num_threads=resources['xgb_nthread']):
+            stacking_model.fit(X_train, y_train)
+        if init_booster is not None:
+            # Replace the XGBoost member fitted on all the training rows by one continuing from the previous booster
+            logger.info(f"Warm-starting XGBoost from the previous booster ({init_booster.num_boosted_rounds()} rounds).")
+            xgb_params = {key: value for key, value in xgb_params.items() if key != 'n_estimators'}
+            xgboost_model = WarmStartXGBRegressor(init_model=init_booster, n_estimators=WARM_START_ROUNDS, random_state=42,
+                                                  n_jobs=resources['total_cores'], **xgb_params)
+            xgboost_model.fit(X_train, y_train)
+            # The previous booster is part of the new booster now, don't save it a second time with the model
+            xgboost_model.set_params(init_model=None, n_jobs=resources['xgb_nthread'])
+            index = [name for name, _ in base_models].index('xgboost')
+            stacking_model.estimators_[index] = xgboost_model
+            stacking_model.named_estimators_['xgboost'] = xgboost_model
         logger.info("Model training completed.")
         return stacking_model
     except Exception as e:
@@ -231,7 +510,7 @@ def train_model(X_train, y_train):
         sys.exit(1)
 
 # Function to save trained model to a file
-def save_model(model, file_path='Backend/stacking_model.pkl'):
+def save_model(model, file_path=MODEL_PATH):
 
     """ 
     Save the trained model to a file. The model is saved using the pickle module.
@@ -254,6 +533,166 @@ def save_model(model, file_path='Backend/stacking_model.pkl'):
         logger.error(f"Error saving the model: {str(e)}")
         sys.exit(1)
 
+# Function to save the metadata of a model
+def save_metadata(metadata, model_path=MODEL_PATH):
+
+    """
+    Save the metadata of a model (metrics, timings etc.) as a JSON file next to the model file.
+    The JSON file has the same name as the model file, e.g. Backend/stacking_model.json for Backend/stacking_model.pkl.
+    The entries saved earlier in the same run are kept unless they are overwritten by the new metadata
+    (the metadata file of a previous run is removed when a run starts, see remove_metadata).
+    Args:
+        metadata (dict): Metadata of the model.
+        model_path (str): File path of the model.
+    Returns:
+        str: File path of the metadata file.
+
+    """
+    metadata_path = os.path.splitext(model_path)[0] + '.json'
+    try:
+        existing = {}
+        if os.path.exists(metadata_path):
+            with open(metadata_path, 'r') as f:
+                existing = json.load(f)
+        existing.update(metadata)
+        with open(metadata_path, 'w') as f:
+            json.dump(existing, f, indent=4, default=str)
+        logger.info(f"Model metadata saved as {metadata_path}.")
+        return metadata_path
+    except Exception as e:
+        logger.error(f"Error saving the model metadata: {str(e)}")
+        sys.exit(1)
+
+# Function to remove the metadata of a model
+def remove_metadata(model_path=MODEL_PATH):
+
+    """
+    Remove the metadata file of a model, so the metadata of a new run doesn't inherit entries of a previous run.
+    Args:
+        model_path (str): File path of the model.
+    Returns:
+        None
+
+    """
+    metadata_path = os.path.splitext(model_path)[0] + '.json'
+    if os.path.exists(metadata_path):
+        os.remove(metadata_path)
+        logger.info(f"Removed the model metadata {metadata_path} of the previous run.")
+
+# Function to generate synthetic 23-mers
+def generate_synthetic_kmers(n_samples, k=23, random_state=42):
+
+    """
+    Generate random k-mers that look like the k-mers scored at prediction time, i.e. random nucleotides followed by
+    one of the suffixes AG, GG or GA (see model_usage.generate_kmers).
+    Args:
+        n_samples (int): Number of k-mers to generate.
+        k (int): Length of the k-mers.
+        random_state (int): Seed of the random number generator.
+    Returns:
+        list: List of k-mers.
+
+    """
+    rng = np.random.default_rng(random_state)
+    nucleotides = np.frombuffer(b'ACGT', dtype=np.uint8)
+    body = nucleotides[rng.integers(0, 4, size=(n_samples, k - 2))]
+    suffixes = np.array(['AG', 'GG', 'GA'])[rng.integers(0, 3, size=n_samples)]
+    return [row.tobytes().decode('ascii') + suffix for row, suffix in zip(body, suffixes)]
+
+# Function to measure the prediction time of a model
+def time_predictions(model, X, repeats=3):
+
+    """
+    Measure the time a model needs to predict X. The best time of a few repeats is used to reduce noise.
+    Args:
+        model: Trained model object.
+        X (np.ndarray): Features.
+        repeats (int): Number of repeats.
+    Returns:
+        float: Prediction time in seconds.
+
+    """
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        model.predict(X)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+# Function to distill a student model from the stacking model
+def distill_model(teacher, X_test=None, y_test=None, n_samples=20000, random_state=42, teacher_path=MODEL_PATH):
+
+    """
+    Distill a small gradient boosted student model from the trained stacking model (teacher).
+    A large pool of synthetic 23-mers is featurized and labelled with the predictions of the teacher,
+    and the student is trained to reproduce these predictions. 20% of the pool is held out to measure how closely
+    the student follows the teacher and how much faster it predicts. If the test data is given, the accuracy of both
+    models on the real efficacy values is compared as well.
+    The features are passed to the models the same way as at prediction time (see model_usage.predict_efficacy_scores).
+    Args:
+        teacher: Trained stacking model.
+        X_test (pd.DataFrame): Test features (optional).
+        y_test (pd.Series): Test target values (optional).
+        n_samples (int): Size of the synthetic k-mer pool.
+        random_state (int): Seed for the k-mer pool and the student model.
+        teacher_path (str): Path the teacher was saved to, recorded in the metadata.
+    Returns:
+        XGBRegressor: Trained student model.
+        dict: Metadata of the student model (fidelity, accuracy gap and speedup).
+
+    """
+
+    logger.info(f"Distilling student model on {n_samples} synthetic k-mers...")
+    try:
+        kmers = generate_synthetic_kmers(n_samples, random_state=random_state)
+        X_pool = extract_features(pd.DataFrame({'gRNA_PAM': kmers})).to_numpy()  # Without the failed k-mers
+        y_pool = teacher.predict(X_pool)
+        X_train, X_holdout, y_train, y_holdout = train_test_split(X_pool, y_pool, test_size=0.2,
+                                                                  random_state=random_state)
+
+        student = XGBRegressor(n_estimators=300, max_depth=6, learning_rate=0.1, random_state=random_state)
+        student.fit(X_train, y_train)
+
+        # How closely the student follows the teacher
+        y_student = student.predict(X_holdout)
+        metadata = {
+            'created': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'teacher': teacher_path,
+            'student': type(student).__name__,
+            'student_params': {key: value for key, value in student.get_params().items()
+                               if value is not None and value == value},  # Skip unset and NaN parameters
+            'synthetic_pool_size': n_samples,
+            'fidelity': {'mse': mean_squared_error(y_holdout, y_student),
+                         'mae': mean_absolute_error(y_holdout, y_student),
+                         'r2': r2_score(y_holdout, y_student)}
+        }
+
+        # How much faster the student predicts
+        teacher_time = time_predictions(teacher, X_holdout)
+        student_time = time_predictions(student, X_holdout)
+        metadata['teacher_predict_seconds'] = teacher_time
+        metadata['student_predict_seconds'] = student_time
+        metadata['speedup'] = teacher_time / student_time if student_time > 0 else None
+
+        # Accuracy gap on the real test data
+        if X_test is not None and y_test is not None:
+            X_test = np.asarray(X_test)
+            teacher_pred, student_pred = teacher.predict(X_test), student.predict(X_test)
+            metadata['accuracy_gap'] = {
+                'teacher_mse': mean_squared_error(y_test, teacher_pred),
+                'student_mse': mean_squared_error(y_test, student_pred),
+                'mse_gap': mean_squared_error(y_test, student_pred) - mean_squared_error(y_test, teacher_pred),
+                'teacher_r2': r2_score(y_test, teacher_pred),
+                'student_r2': r2_score(y_test, student_pred),
+                'r2_gap': r2_score(y_test, teacher_pred) - r2_score(y_test, student_pred)
+            }
+
+        logger.info(f"Student model distilled. Fidelity R2: {metadata['fidelity']['r2']}, Speedup: {metadata['speedup']}")
+        return student, metadata
+    except Exception as e:
+        logger.error(f"Error during model distillation: {str(e)}")
+        sys.exit(1)
+
 # Function to evaluate model performance
 def evaluate_model(model, X_test, y_test):
 
@@ -287,96 +726,62 @@ def evaluate_model(model, X_test, y_test):
         logger.error(f"Error during evaluation: {str(e)}")
         sys.exit(1)
 
-# Function to visualize and save feature distributions (excluding one-hot encoded features)
-def visualize_features(X, output_dir='Backend/feature_plots'):
+# Function to visualize and save the training plots
+def visualize_training(X, y_test, y_pred, data_hash, output_dir=PLOT_DIR, n_workers=None):
 
     """
-    Visualize and save feature distributions.
-    Histograms are plotted for each feature to understand the distribution of the features.
-    The plots are saved to a directory for further analysis.
+    Visualize and save the feature distributions (excluding one-hot encoded features) and the residual plot.
+    Histograms are plotted for each feature to understand the distribution of the features, and the residual plot
+    (actual vs predicted target values) helps us check if the errors are randomly distributed.
+    The plots are rendered in parallel after the model is saved and cached by the hash of the data (see training_plots.py).
+    A failure only skips the plots, the trained model is kept.
     Args:
         X (pd.DataFrame): DataFrame containing features.
-        output_dir (str): Directory to save the plots.  
-    Returns:
-        None
-
-    """
-
-    try:
-        logger.info("Visualizing feature distributions...")
-
-        # Create output directory if it doesn't exist
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-
-        # Exclude one-hot encoded features (columns starting with 'OneHot_')
-        features_to_plot = [col for col in X.columns if not col.startswith('OneHot_')]
-
-        # Plot distributions for each feature
-        for feature in features_to_plot:
-            plt.figure(figsize=(8, 6))
-            sns.histplot(X[feature], kde=True)
-            plt.title(f'Distribution of {feature}')
-            plt.xlabel(feature)
-            plt.ylabel('Frequency')
-            plt.savefig(os.path.join(output_dir, f'{feature}_distribution.png'))
-            plt.close()
-            logger.debug(f"Saved plot for feature: {feature}")
-
-        logger.info(f"Feature plots saved in directory: {output_dir}")
-
-    except Exception as e:
-        logger.error(f"Error during feature visualization: {str(e)}")
-        sys.exit(1)
-
-# Function to visualize and save residual plot
-def visualize_residualplot(y_test, y_pred,output_dir='Backend/feature_plots'):
-
-    """ 
-    The residual plot is a scatter plot of the actual target values vs the predicted target values.
-    This plot helps us understand the anlyse the performance of the model and check if the errors are randomly distributed.
-    The plot is saved to a directory for further analysis.
-    Args:
         y_test (np.ndarray): Test target values.
         y_pred (np.ndarray): Predicted target values.
-        output_dir (str): Directory to save the plot.
+        data_hash (str): Hash of the training data.
+        output_dir (str): Directory to save the plots.
+        n_workers (int): Number of worker processes (default: the core budget, see profiling.core_budget).
     Returns:
-        None
+        dict: Rendered and skipped plots and the rendering time (None if the rendering failed).
 
     """
 
     try:
-        logger.info("Visualizing residual plot...")
-
-        # Create output directory if it doesn't exist
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-
-        # Plot residual plot
-        plt.figure(figsize=(8, 6))
-        plt.scatter(y_test, y_pred)
-        plt.xlabel('Actual Efficacy')
-        plt.ylabel('Predicted Efficacy')
-        plt.title('Actual vs Predicted Efficacy')
-        plt.savefig(os.path.join(output_dir, 'residual_plot.png'))        
-
-
-        logger.info("Residual plot saved.")
-
+        logger.info("Visualizing feature distributions and residual plot...")
+        return render_training_plots(X, y_test, y_pred, data_hash, output_dir, n_workers)
     except Exception as e:
-        logger.error(f"Error during residual plot visualization: {str(e)}")
-        sys.exit(1)
+        logger.warning(f"Error during training plot visualization: {str(e)}")
+        return None
 
 # Main function
-def main(df):
+def main(df, distill=False, incremental=False, progress=None, model_path=MODEL_PATH, search_budget=None, kfold=None):
 
     """
     Main function to run the model training pipeline.
     The dataframe is passed from the frontend and the model is trained using the RNA sequences and efficacy values.
     This part is used when the admin wants to update the model with new data.
     For normal prediction purposes the model is loaded from the file.
+    If distill is set, a lightweight student model is distilled from the trained model and saved as an alternative
+    serving model (STUDENT_MODEL_PATH) together with its accuracy gap and speedup.
+    If incremental is set, only the sequences that are not in the stored training features are folded and
+    the XGBoost member is warm-started from the booster of the saved model, in the scale of its saved preprocessing.
+    The model is then only evaluated on sequences the saved booster was never trained on.
+    If search_budget is set, the hyperparameters of the base models are tuned first with a successive halving search
+    of at most search_budget seconds (the stored features are reused, so repeated searches don't fold again).
+    If kfold is set, the pipeline is additionally cross-validated with kfold folds in parallel (see cross_validation.py)
+    and the per-fold accuracy and latency are saved under 'cross_validation' in the metadata of the model.
+    Every stage is timed and the peak memory of the process and its workers recorded (see profiling.py), the profile is saved under 'profile' in the metadata of the model.
+    When the pipeline runs as a background job (see training_jobs.py), progress is called with the name of each
+    stage ('validate', 'featurize', 'fit', 'evaluate', 'render') before the stage starts.
     Args:
         df (pd.DataFrame): Input DataFrame containing RNA sequences and efficacy values.
+        distill (bool): Also distill a student model for low-latency serving.
+        incremental (bool): Reuse the stored features and warm-start XGBoost from the saved model.
+        progress (callable): Function called with the name of each stage (optional).
+        model_path (str): File path to save the trained model.
+        search_budget (float): Wall-clock budget of the hyperparameter search in seconds (None skips the search).
+        kfold (int): Number of folds of the cross-validation report (None skips the cross-validation).
     Returns:
         float: Mean squared error of the model.
         float: Mean absolute error of the model.
@@ -385,29 +790,106 @@ def main(df):
     """
         
     logger.info("Starting model training pipeline...")
+    if progress is None:
+        progress = lambda stage: None
+    # The metadata is written fresh for the models of this run
+    remove_metadata(model_path)
+    if distill:
+        remove_metadata(STUDENT_MODEL_PATH)
+    profiler = PipelineProfiler()
+    progress('validate')
     # Check  input data    
-    df = check_data(df)
-    # Extract features
-    X = extract_features(df)
-    # Extract efficacy values
-    y = df['efficacy']
-    # Visualize feature distributions
-    visualize_features(X)
+    with profiler.stage('check_data'):
+        df = check_data(df)
+        data_hash = dataset_hash(df)
+    progress('featurize')
+    # Extract features (only for the new sequences in incremental training)
+    feature_timings, feature_errors = {}, []
+    with profiler.stage('extract_features'):
+        X, feature_store = extract_features_incremental(df, load_feature_store() if incremental or search_budget else None,
+                                                        feature_timings, feature_errors)
+        save_feature_store(feature_store)
+    profiler.add_details('feature_seconds', feature_timings)
+    if feature_errors:
+        quarantine = save_quarantine(df, feature_errors)
+    elif os.path.exists(QUARANTINE_PATH):
+        os.remove(QUARANTINE_PATH)  # Report of a previous run
+    if X.empty:
+        logger.error("Feature calculation failed for all the sequences.")
+        sys.exit(1)
+    # Extract efficacy values (of the rows that were not quarantined)
+    y = df['efficacy'].loc[X.index]
+    sequences = df['gRNA_PAM'].loc[X.index]
+    # Warm start from the saved model: its booster, its preprocessing and the sequences it was trained on
+    previous = load_previous_booster() if incremental else None
+    seen = np.zeros(len(X), dtype=bool)
+    if previous is not None:
+        seen = np.isin(sequence_hashes(sequences), previous['trained_sequences'])
+        if (~seen).sum() < 2:
+            logger.warning("Too few sequences the saved model wasn't trained on to evaluate a warm start, training from scratch.")
+            previous, seen = None, np.zeros(len(X), dtype=bool)
+    progress('fit')
     # Preprocess data
-    X_preprocessed = preprocess_data(X)
-    # Split data(Training(80%) and Testing(20%))
-    X_train, X_test, y_train, y_test = train_test_split(X_preprocessed, y,
-                                                         test_size=0.2, random_state=42) # Keep the random_state constant for reproducibility
-    # Train model
-    model = train_model(X_train, y_train)
+    with profiler.stage('preprocess_data'):
+        X_preprocessed, preprocessor = preprocess_data(X, previous and previous['preprocessor'])
+        # Split data(Training(80%) and Testing(20%)), the sequences the previous booster was trained on are only used for training
+        train_rows, test_rows = train_test_split(np.flatnonzero(~seen), test_size=0.2, random_state=42) # Keep the random_state constant for reproducibility
+        train_rows = np.concatenate([np.flatnonzero(seen), train_rows])
+        X_train, X_test, X_test_raw = X_preprocessed[train_rows], X_preprocessed[test_rows], X.iloc[test_rows]
+        y_train, y_test = y.iloc[train_rows], y.iloc[test_rows]
+    # Train model (with an explicit core budget for the folds, RandomForest and XGBoost)
+    resources = plan_resources()
+    params = None
+    if search_budget:
+        with profiler.stage('hyperparameter_search'):
+            search = successive_halving_search(X_train, y_train, budget_seconds=search_budget,
+                                               n_workers=resources['total_cores'])
+        params = {name: search[name] for name in ['random_forest', 'xgboost']}
+    with profiler.stage('train_model'):
+        snapshot = resource_snapshot()
+        model = train_model(X_train, y_train, previous and previous['booster'], resources, params)
+        resources.update(resource_usage(snapshot, resources['total_cores']))
+    # Saved with the model for the next warm start
+    model.preprocessor_ = preprocessor
+    trained = sequence_hashes(sequences.iloc[train_rows])
+    model.trained_sequences_ = trained if previous is None else np.union1d(previous['trained_sequences'], trained)
+    profiler.add_details('estimator_fit_seconds', {name: getattr(estimator, 'fit_seconds_', None)
+                                                   for name, estimator in model.named_estimators_.items()})
     # Save model
-    save_model(model)
+    with profiler.stage('save_model'):
+        save_model(model, model_path)
+        save_metadata({'training_resources': resources}, model_path)
+        if search_budget:
+            save_metadata({'hyperparameter_search': search}, model_path)
+        save_metadata({'quarantine': quarantine if feature_errors else {'rows': 0}}, model_path)
+    progress('evaluate')
     # Evaluate model
-    y_test, y_pred, mse, mae, r2 = evaluate_model(model, X_test, y_test)
-    
-    # Visualize residual plot
-    visualize_residualplot(y_test, y_pred)
-
+    with profiler.stage('evaluate_model'):
+        y_test, y_pred, mse, mae, r2 = evaluate_model(model, X_test, y_test)
+        save_metadata({'metrics': {'mse': mse, 'mae': mae, 'r2': r2}, 'training_rows': len(X_train),
+                       'warm_start': previous is not None}, model_path)
+    if kfold:
+        with profiler.stage('cross_validate'):
+            try:
+                save_metadata({'cross_validation': cross_validate(X, y, kfold, params=params, total_cores=resources['total_cores'])}, model_path)
+            except Exception as e:
+                logger.warning(f"Error during cross-validation: {str(e)}")
+
+    # Distill a student model for low-latency serving
+    if distill:
+        with profiler.stage('distill_model'):
+            student, student_metadata = distill_model(model, X_test_raw, y_test, teacher_path=model_path)
+            save_model(student, STUDENT_MODEL_PATH)
+            save_metadata(student_metadata, STUDENT_MODEL_PATH)
+            save_metadata({'student': {key: student_metadata.get(key) for key in ['fidelity', 'accuracy_gap', 'speedup']}},
+                          model_path)
+
+    # Visualize feature distributions and residual plot (off the critical path, the model is saved already)
+    progress('render')
+    with profiler.stage('visualize_training'):
+        visualize_training(X, y_test, y_pred, data_hash, n_workers=resources['total_cores'])
+
+    save_metadata({'profile': profiler.report()}, model_path)
     logger.info("Model training pipeline completed.")
     # Return evaluation metrics
     return mse, mae, r2
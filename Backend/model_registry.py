@@ -0,0 +1,347 @@
+"""
+Registry of the trained models.
+Every trained model is registered as an immutable version: a directory in REGISTRY_DIR/versions with the model file,
+its metadata (metrics, feature schema, training time, size, hash) and the distilled student model if there is one.
+The version in use is named in the CURRENT file, which is replaced atomically, so promoting a version or rolling back
+to the previous one is a single rename. Every promotion records the version it replaced, so repeated rollbacks walk
+back through the promoted versions. Serving processes read the pointer on every prediction and keep the models
+they loaded in memory, so they pick up a promote or rollback without a restart (and a rollback without reloading).
+Usage:
+    version = register('Backend/candidate_model.pkl')
+    promote(version)
+    model = load_current_model()
+    rollback()
+    set_serve_student(True)
+"""
+
+# Importing required libraries
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import stat
+import tempfile
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from Backend import prediction_cache
+from Backend.features import FEATURE_NAMES
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_DIR = 'Backend/model_registry'
+VERSIONS_DIR = os.path.join(REGISTRY_DIR, 'versions')
+CURRENT_PATH = os.path.join(REGISTRY_DIR, 'CURRENT')
+HISTORY_PATH = os.path.join(REGISTRY_DIR, 'history.jsonl')  # Promotions and rollbacks, oldest first
+SERVE_STUDENT_PATH = os.path.join(REGISTRY_DIR, 'SERVE_STUDENT')  # Exists while the admin serves the student models
+LEGACY_MODEL_PATH = 'Backend/stacking_model.pkl'  # Deployed model before the registry, imported as the first version
+LEGACY_IMPORT_PATH = os.path.join(REGISTRY_DIR, 'legacy_import')  # Created by the one process that imports it
+LEGACY_IMPORT_SECONDS = 30  # Time other processes wait for the import
+LOADED_MODELS = 3  # Models kept in memory per process
+
+# Models loaded by this process, keyed by version (most recently used last)
+_loaded_models = OrderedDict()
+
+def _version_dir(version):
+    return os.path.join(VERSIONS_DIR, version)
+
+def _metadata_path(model_path):
+    return os.path.splitext(model_path)[0] + '.json'
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _write_atomic(path, text):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+# Function to register a trained model
+def register(model_path, student_path=None):
+
+    """
+    Function to register a trained model as a new version. The model file, its metadata file (same name with .json)
+    and the student model (if given) are copied into a new version directory, which is made read-only.
+    The version is not served until it is promoted.
+    Args:
+        model_path (str): Path of the trained model
+        student_path (str): Path of the distilled student model (optional)
+    Returns:
+        version (str): Version of the registered model
+
+    """
+    model_hash = _file_hash(model_path)
+    version = datetime.now().strftime("%Y%m%d%H%M%S") + '_' + model_hash[:8]
+    os.makedirs(VERSIONS_DIR, exist_ok=True)
+
+    metadata = {}
+    if os.path.exists(_metadata_path(model_path)):
+        with open(_metadata_path(model_path)) as f:
+            metadata = json.load(f)
+    metadata.update({'version': version, 'registered': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                     'sha256': model_hash, 'size_bytes': os.path.getsize(model_path), 'feature_schema': FEATURE_NAMES,
+                     'training_seconds': metadata.get('training_resources', {}).get('wall_seconds')})
+
+    # Build the version in a temporary directory, so a version directory is always complete
+    tmp_dir = tempfile.mkdtemp(dir=VERSIONS_DIR, prefix='.tmp_')
+    shutil.copyfile(model_path, os.path.join(tmp_dir, 'model.pkl'))
+    if student_path is not None and os.path.exists(student_path):
+        shutil.copyfile(student_path, os.path.join(tmp_dir, 'student.pkl'))
+        if os.path.exists(_metadata_path(student_path)):
+            shutil.copyfile(_metadata_path(student_path), os.path.join(tmp_dir, 'student.json'))
+        metadata['student'] = dict(metadata.get('student', {}), size_bytes=os.path.getsize(student_path))
+    with open(os.path.join(tmp_dir, 'model.json'), 'w') as f:
+        json.dump(metadata, f, indent=4, default=str)
+    for name in os.listdir(tmp_dir):
+        os.chmod(os.path.join(tmp_dir, name), stat.S_IREAD | stat.S_IRGRP | stat.S_IROTH)
+    os.rename(tmp_dir, _version_dir(version))
+    logger.info(f"Registered model version {version}.")
+    return version
+
+# Function to get the metadata of a version
+def get_version(version):
+
+    """
+    Function to get the metadata of a registered version.
+    Args:
+        version (str): Version
+    Returns:
+        metadata (dict): Metadata of the version (None if the version doesn't exist)
+
+    """
+    try:
+        with open(os.path.join(_version_dir(version), 'model.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+# Function to list the registered versions
+def list_versions():
+
+    """
+    Function to list the metadata of all the registered versions, the newest version first.
+    Returns:
+        versions (list): Metadata of the versions
+
+    """
+    if not os.path.isdir(VERSIONS_DIR):
+        return []
+    versions = [get_version(version) for version in os.listdir(VERSIONS_DIR) if not version.startswith('.')]
+    return sorted([metadata for metadata in versions if metadata], key=lambda metadata: metadata['version'], reverse=True)
+
+def _history():
+    if not os.path.exists(HISTORY_PATH):
+        return []
+    with open(HISTORY_PATH) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def _read_current():
+    try:
+        with open(CURRENT_PATH) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def _import_legacy_model():
+    # Only the process that creates the marker imports the model, the others wait for its pointer
+    os.makedirs(REGISTRY_DIR, exist_ok=True)
+    try:
+        os.close(os.open(LEGACY_IMPORT_PATH, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        deadline = time.time() + LEGACY_IMPORT_SECONDS
+        while _read_current() is None and time.time() < deadline:
+            time.sleep(0.1)
+        return _read_current()
+    try:
+        version = register(LEGACY_MODEL_PATH)
+        promote(version)
+    except BaseException:
+        os.remove(LEGACY_IMPORT_PATH)  # Retried by the next call
+        raise
+    return version
+
+# Function to get the current version
+def current_version():
+
+    """
+    Function to get the version that is currently served. A model deployed before the registry existed
+    (LEGACY_MODEL_PATH) is registered and promoted once, by the first process that finds no current version.
+    Returns:
+        version (str): Current version (None if no model was promoted yet)
+
+    """
+    version = _read_current()
+    if version is None and os.path.exists(LEGACY_MODEL_PATH):
+        return _import_legacy_model()
+    return version
+
+def _previous_version(history, version):
+    # Version that was current before the version (recorded by its last promotion)
+    for i in range(len(history) - 1, -1, -1):
+        if history[i]['version'] == version:
+            if 'previous' in history[i]:
+                return history[i]['previous']
+            return history[i - 1]['version'] if i > 0 else None  # Recorded before the previous versions were
+    return None
+
+def _set_current(version, action, previous):
+    if get_version(version) is None:
+        raise ValueError(f"Model version {version} is not registered.")
+    os.makedirs(REGISTRY_DIR, exist_ok=True)
+    _write_atomic(CURRENT_PATH, version)
+    with open(HISTORY_PATH, 'a') as f:
+        f.write(json.dumps({'version': version, 'action': action, 'previous': previous,
+                            'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S")}) + '\n')
+    logger.info(f"Model version {version} is now current ({action}).")
+
+# Function to promote a version
+def promote(version):
+
+    """
+    Function to make a registered version the current version. The pointer is replaced atomically and the version
+    it replaces is recorded as the previous version (see rollback).
+    Args:
+        version (str): Version to promote
+    Returns:
+        None
+
+    """
+    previous = _read_current()
+    _set_current(version, 'promote', previous if previous != version else _previous_version(_history(), version))
+
+# Function to roll back to the previous version
+def rollback():
+
+    """
+    Function to roll back to the version that was current before the current version. The version rolled back to
+    keeps its own previous version, so repeated rollbacks go further back instead of alternating between two versions.
+    Returns:
+        version (str): Version that is current now (None if there is no previous version)
+
+    """
+    history = _history()
+    previous = _previous_version(history, current_version())
+    if previous is None or get_version(previous) is None:
+        logger.warning("No previous model version to roll back to.")
+        return None
+    _set_current(previous, 'rollback', _previous_version(history, previous))
+    return previous
+
+# Function to get the candidate versions
+def candidates():
+
+    """
+    Function to list the versions that were registered after the current version and never promoted,
+    i.e. trained models waiting for the admin to promote or reject them.
+    Returns:
+        versions (list): Metadata of the candidate versions, the newest first
+
+    """
+    promoted = {entry['version'] for entry in _history()}
+    current = current_version() or ''
+    return [metadata for metadata in list_versions()
+            if metadata['version'] not in promoted and metadata['version'] > current]
+
+# Function to delete a version
+def delete_version(version):
+
+    """
+    Function to delete a version that was never promoted (e.g. a rejected candidate) and its cached predictions.
+    Args:
+        version (str): Version to delete
+    Returns:
+        None
+
+    """
+    if version in {entry['version'] for entry in _history()}:
+        raise ValueError(f"Model version {version} was promoted before and is kept for rollbacks.")
+    version_dir = _version_dir(version)
+    for name in os.listdir(version_dir):
+        os.chmod(os.path.join(version_dir, name), stat.S_IREAD | stat.S_IWRITE)
+    shutil.rmtree(version_dir)
+    prediction_cache.invalidate(version)
+    logger.info(f"Deleted model version {version}.")
+
+# Function to select the served model
+def set_serve_student(enabled):
+
+    """
+    Function to select whether the student model of the current version is served instead of the stacking model.
+    The setting applies to all the serving processes and to the versions promoted later.
+    Args:
+        enabled (bool): Serve the student model
+    Returns:
+        None
+
+    """
+    os.makedirs(REGISTRY_DIR, exist_ok=True)
+    if enabled:
+        _write_atomic(SERVE_STUDENT_PATH, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    elif os.path.exists(SERVE_STUDENT_PATH):
+        os.remove(SERVE_STUDENT_PATH)
+    logger.info(f"Serving the {'student' if enabled else 'stacking'} models.")
+
+# Function to check the served model
+def serve_student(version=None):
+
+    """
+    Function to check whether the student model is served for a version, i.e. the admin selected the student
+    models and the version has one (versions trained without distillation are served with the stacking model).
+    Args:
+        version (str): Version (default: the current version)
+    Returns:
+        student (bool): The student model is served
+
+    """
+    if not os.path.exists(SERVE_STUDENT_PATH):
+        return False
+    version = version or current_version()
+    return version is not None and os.path.exists(model_path(version, student=True))
+
+# Function to get the path of a model file
+def model_path(version=None, student=False):
+
+    """
+    Function to get the path of the model file of a version.
+    Args:
+        version (str): Version (default: the current version)
+        student (bool): Path of the student model instead of the stacking model
+    Returns:
+        path (str): Path of the model file (None if there is no current version)
+
+    """
+    version = version or current_version()
+    if version is None:
+        return None
+    return os.path.join(_version_dir(version), 'student.pkl' if student else 'model.pkl')
+
+# Function to load the model of a version
+def load_version(version, student=False):
+
+    """
+    Function to load the model of a version. The loaded models are kept in memory (the LOADED_MODELS most recently
+    used), versions are immutable so a loaded model never has to be reloaded.
+    Args:
+        version (str): Version
+        student (bool): Load the student model instead of the stacking model
+    Returns:
+        model: Trained model object
+
+    """
+    key = (version, student)
+    if key not in _loaded_models:
+        with open(model_path(version, student), 'rb') as f:
+            _loaded_models[key] = pickle.load(f)
+        logger.info(f"Loaded model version {version}{' (student)' if student else ''}.")
+        while len(_loaded_models) > LOADED_MODELS:
+            _loaded_models.popitem(last=False)
+    _loaded_models.move_to_end(key)
+    return _loaded_models[key]
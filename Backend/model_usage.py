@@ -6,14 +6,17 @@ Authors: Zeynep Aslan and Mateo Carvajal
 """
 
 # Importing required libraries
-import RNA
 import pandas as pd
 import numpy as np
 import pickle
 import logging
+import hashlib
+import os
 import plotly.express as px
 import plotly.graph_objects as go
 from traceback import print_exc
+from Backend import prediction_cache, model_registry
+from Backend.features import feature_matrix, feature_frame
 # Zeynep Aslan
 # Configure logging
 logging.basicConfig(
@@ -26,8 +29,11 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# The served model is the current version of the model registry (see model_registry.py). The lightweight student
+# model distilled from it (see model_generator.distill_model) is served with student=True for low-latency predictions.
+
 # Function to generate k-mers
-def generate_kmers(sequence, k=23):
+def generate_kmers(sequence, k=23, positions=False):
 
     """
     Function to generate k-mers from a given DNA sequence of length 23 that ends with AG, GG, or GA.
@@ -36,18 +42,21 @@ def generate_kmers(sequence, k=23):
     Args:
         sequence (str): Input DNA sequence
         k (int): Length of k-mers to generate (default=23)
+        positions (bool): Also return the (1-based) start positions of the k-mers in the sequence
     Returns:
         kmers (list): List of k-mers that end with AG, GG, or GA
+        starts (list): Start positions of the k-mers (only if positions is True)
 
     """
     sequence = sequence.replace('\n', '')
     kmers = []
+    starts = []
     suffixes = {'AG', 'GG', 'GA'}
     valid_bases = {'A', 'T', 'C', 'G'}
     
     # Ensure the sequence is long enough to generate k-mers of length k
     if len(sequence) < k:  
-        return kmers
+        return (kmers, starts) if positions else kmers
     
     for i in range(len(sequence) - k + 1):
         kmer = sequence[i:i + k]
@@ -55,81 +64,27 @@ def generate_kmers(sequence, k=23):
         # Check if all characters in the k-mer are valid DNA bases
         if set(kmer).issubset(valid_bases) and kmer[-2:] in suffixes:
             kmers.append(kmer)
+            starts.append(i + 1)
     
-    return kmers
+    return (kmers, starts) if positions else kmers
 
 
 # Function to calculate features for a single RNA sequence
 def calculate_features(seq):
-    
+
     """
     Function to calculate features for a single RNA sequence.
+    The features of a batch of k-mers should be calculated with features.feature_matrix instead.
     Args:
         seq (str): RNA sequence
     Returns:
-        features (list): List of calculated features
+        features (list): List of calculated features (None if the calculation failed)
 
     """
 
-    try:
-        logger.debug(f"Calculating features for sequence: {seq}")
-
-        # 1. Minimum free energy (MFE)
-        (ss, mfe) = RNA.fold(seq)
-        logger.debug(f"Secondary structure: {ss}, MFE: {mfe}")
-
-        # 2. Base-pairing probabilities
-        fc = RNA.fold_compound(seq)
-        (pp, pf) = fc.pf()
-        bp_probs = fc.bpp()
-        avg_bp_prob = np.mean([bp_probs[i][j] for i in range(len(seq)) for j in range(i+1, len(seq)) if i < j])
-        logger.debug(f"Average base-pairing probability: {avg_bp_prob}")
-
-        # 3. Thermodynamic properties (using ensemble free energy)
-        ensemble_energy = fc.mean_bp_distance()
-        logger.debug(f"Ensemble energy: {ensemble_energy}")
-
-        # 4. Sequence-based features (one-hot encoding)
-        bases = ['A', 'U', 'C', 'G']
-        one_hot = np.array([[1 if seq[i] == b else 0 for b in bases] for i in range(len(seq))]).flatten()
-        logger.debug(f"One-hot encoding: {one_hot}")
-
-        # 5. Structural properties
-        helices = 0
-        helix_lengths = []
-        paired_bases = 0
-        in_helix = False
-        current_helix_length = 0
-
-        for char in ss:
-            if char == '(':
-                paired_bases += 1
-                if not in_helix:
-                    helices += 1
-                    in_helix = True
-                current_helix_length += 1
-            elif char == ')':
-                paired_bases += 1
-                current_helix_length += 1
-            else:  # unpaired base
-                if in_helix:
-                    helix_lengths.append(current_helix_length)
-                    current_helix_length = 0
-                    in_helix = False
-
-        if in_helix:
-            helix_lengths.append(current_helix_length)
-
-        avg_helix_length = np.mean(helix_lengths) if helix_lengths else 0
-        fraction_paired = paired_bases / len(seq)
-        logger.debug(f"Helices: {helices}, Avg helix length: {avg_helix_length}, Fraction paired: {fraction_paired}")
-
-        return [mfe, avg_bp_prob, ensemble_energy] + list(one_hot) + [helices, avg_helix_length, fraction_paired]
-
-    except Exception as e:
-        logger.error(f"Error calculating features for sequence: {seq}. Error: {str(e)}")
-        print_exc()
-        return None
+    logger.debug(f"Calculating features for sequence: {seq}")
+    X, failed = feature_matrix([seq], dtype=np.float64)
+    return None if failed[0] else X[0].tolist()
 
 # Mateo Carvajal
 
@@ -205,55 +160,144 @@ def visualize_features(X: pd.DataFrame):
         return None
 
 
+# Versions of the model files already hashed, keyed by (path, modification time, size)
+_model_versions = {}
+
+# Function to get the version of a saved model
+def model_version(model_path):
+
+    """
+    Function to get the version of a saved model, which is the (shortened) SHA-256 hash of the model file.
+    The hash is only recalculated when the model file changes, e.g. when the admin deploys a new model.
+    Args:
+        model_path (str): Path of the saved model
+    Returns:
+        version (str): Version of the model
+
+    """
+    stat = os.stat(model_path)
+    file_id = (os.path.abspath(model_path), stat.st_mtime_ns, stat.st_size)
+    if file_id not in _model_versions:
+        digest = hashlib.sha256()
+        with open(model_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        _model_versions[file_id] = digest.hexdigest()[:16]
+    return _model_versions[file_id]
+
+# Function to load a saved model
+def load_model(model_path=None, student=False):
+
+    """
+    Function to load a saved model from its pickle file, by default the current model of the registry
+    (kept in memory, so it is only loaded again after a promote or rollback to a version that is not loaded yet).
+    Args:
+        model_path (str): Path of the saved model (default: current version of the model registry)
+        student (bool): Load the student model of the current version instead of the stacking model
+    Returns:
+        model: Trained model object
+
+    """
+    if model_path is None:
+        version = model_registry.current_version()
+        if version is None:
+            raise FileNotFoundError("No model has been promoted in the model registry yet.")
+        return model_registry.load_version(version, student)
+    with open(model_path, 'rb') as f:
+        return pickle.load(f)
+
+# Function to get the version of the served model
+def served_version(model_path=None, student=False):
+
+    """
+    Function to get the version of the model used for a prediction: the registry version of the current model,
+    or the file hash of an explicitly given model file (see model_version).
+    Args:
+        model_path (str): Path of the saved model (default: current version of the model registry)
+        student (bool): Version of the student model of the current version
+    Returns:
+        version (str): Version of the model
+
+    """
+    if model_path is None:
+        version = model_registry.current_version()
+        return None if version is None else version + ('_student' if student else '')
+    return model_version(model_path)
+
 # Function to predict efficacy scores for k-mers
-def predict_efficacy_scores(sequence, model_path='Backend/stacking_model.pkl'):
+def predict_efficacy_scores(sequence, model_path=None, top_k=None, use_cache=True, student=False):
+
+    """
+    Function to predict efficacy scores for all the k-mers of a sequence and rank them.
+    When top_k is given only the best top_k k-mers are selected (using np.argpartition instead of a full sort)
+    and the feature columns are materialized for those rows only, which keeps the result small for long inputs.
+    Args:
+        sequence (str): Input DNA sequence
+        model_path (str): Path of the saved model (default: current version of the model registry)
+        top_k (int): Number of best k-mers to return (default=None, returns all the k-mers)
+        use_cache (bool): Return the cached results if the same sequence was already predicted with the same model
+        student (bool): Use the student model of the current version (low-latency serving)
+    Returns:
+        results (pd.DataFrame): k-mers with their predicted efficacy and features, sorted by the predicted efficacy.
+                                results.attrs['total_kmers'] holds the number of k-mers that were scored.
+
+    """
+
     logger.info(f"Input sequence provided")
     try:
+        # Check the prediction cache
+        if use_cache:
+            version = served_version(model_path, student)
+            key = prediction_cache.cache_key(sequence, version, top_k)
+            results = prediction_cache.load(key)
+            if results is not None:
+                return results
+
         # Generate k-mers
-        kmers = generate_kmers(sequence)
+        kmers, starts = generate_kmers(sequence, positions=True)
         logger.info(f"Generated {len(kmers)} k-mers ending with AG, GG, or GA.")
 
         if not kmers:
             logger.warning("No valid k-mers found.")
             return
 
-        # Calculate features for each k-mer
-        features = [calculate_features(kmer) for kmer in kmers]
+        # Calculate the features of all the k-mers into a contiguous float32 matrix
+        X, failed = feature_matrix(kmers)
 
         # Check if any feature calculation failed
-        if None in features:
+        if failed.any():
             logger.error("Feature calculation failed for one or more k-mers. Exiting.")
             return
-
-        # Convert features to a DataFrame
-
-        feature_names = ['MFE', 'Avg_BP_Prob', 'Ensemble_Energy'] + \
-                        [f'OneHot_{i}' for i in range(92)] + \
-                        ['Helices', 'Avg_Helix_Length', 'Fraction_Paired']
-        X = pd.DataFrame(features, columns=feature_names)
-        logger.info(f"Feature matrix created. Shape: {X.shape}")
+        logger.info(f"Feature matrix created. Shape: {X.shape}, dtype: {X.dtype}")
 
         # Load the saved model
         logger.info("Loading the saved model...")
-        with open(model_path, 'rb') as f:
-            model = pickle.load(f)
+        model = load_model(model_path, student)
         logger.info("Model loaded successfully.")
 
         # Predict efficacy scores
         logger.info("Predicting efficacy scores...")
         predictions = model.predict(X)
 
-        # Create a DataFrame with k-mers and their predicted efficacy scores
-        X['k-mer'] = kmers
-        results = pd.DataFrame({
-            'k-mer': kmers,
-            'Predicted_Efficacy': predictions
-        })
-
-        # Sort the results in descending order by Predicted_Efficacy
-        results_sorted = results.sort_values(by='Predicted_Efficacy', ascending=False,ignore_index=True)
-        results_sorted = pd.merge(results_sorted,X,on='k-mer',how='inner')
-        return results_sorted
+        # Rank the k-mers in descending order of Predicted_Efficacy
+        if top_k is not None and 0 < top_k < len(kmers):
+            # Partial selection of the best top_k k-mers, only those are sorted afterwards
+            top = np.argpartition(-predictions, top_k - 1)[:top_k]
+            order = top[np.argsort(-predictions[top], kind='stable')]
+            logger.info(f"Selected the top {top_k} of {len(kmers)} k-mers.")
+        else:
+            order = np.argsort(-predictions, kind='stable')
+
+        # Create a DataFrame with the ranked k-mers, their positions, predicted efficacy scores and features
+        results = feature_frame(X[order])
+        results.insert(0, 'k-mer', [kmers[i] for i in order])
+        results.insert(1, 'Position', np.asarray(starts, dtype=np.int32)[order])
+        results.insert(2, 'Predicted_Efficacy', predictions[order])
+        results.attrs['total_kmers'] = len(kmers)
+
+        if use_cache:
+            prediction_cache.store(key, results)
+        return results
     except Exception as e:
         logger.error(f"Error during prediction: {str(e)}")
         print_exc()
@@ -0,0 +1,289 @@
+"""
+Out-of-core training of the stacking model for datasets that don't fit into memory.
+model_generator.main keeps the whole dataset, its features and the preprocessed features in memory. Here the CSV file
+is read in chunks instead: every chunk is validated, featurized and written to disk as float32 matrices, so only one
+chunk is in memory at a time. The rows are assigned at random to the training rows (80%), the blend rows (10%) that
+fit the final estimator on held-out predictions of the base models, and the test rows (10%).
+    - XGBoost is trained on all the training rows through its external memory data iterator (tree_method 'hist'),
+      which reads the chunks from disk and keeps its quantized pages in a disk cache.
+    - RandomForest cannot be trained in chunks and is trained on a fixed-size reservoir sample of the training rows.
+    - The final LinearRegression is trained on a reservoir sample of the blend rows.
+The peak memory therefore depends on the chunk and sample sizes, not on the size of the dataset.
+The features are used unscaled, the way they are passed to the model at prediction time (see model_usage.py).
+The trained model is registered as a candidate version of the model registry, which the admin promotes or rejects.
+Usage:
+    python -m Backend.out_of_core <csv_path> [model_path]
+The admin page runs it as a training job (see training_jobs.submit_job).
+"""
+
+# Importing required libraries
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+import xgboost
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.linear_model import LinearRegression
+from xgboost import XGBRegressor
+
+from Backend.data_validation import iter_valid_chunks, new_report, read_csv_chunks
+from Backend.estimators import BlendedStackingRegressor
+from Backend.features import FEATURE_NAMES, feature_matrix
+from Backend.model_generator import (CANDIDATE_MODEL_PATH, plan_resources, remove_metadata, resource_snapshot,
+                                    resource_usage, save_metadata, save_model)
+from Backend import model_registry
+
+logger = logging.getLogger(__name__)
+
+CHUNK_ROWS = 20000  # Rows read, featurized and written per chunk
+RF_SAMPLE_ROWS = 200000  # Reservoir size of the RandomForest training rows
+BLEND_SAMPLE_ROWS = 50000  # Reservoir size of the blend rows
+XGB_ROUNDS = 100  # Boosting rounds (the XGBRegressor default)
+SPLIT = (0.8, 0.1, 0.1)  # Share of the training, blend and test rows
+
+class Reservoir:
+
+    """
+    Fixed-size uniform sample of a stream of rows (reservoir sampling, algorithm R), filled chunk by chunk.
+    Args:
+        size (int): Maximum number of sampled rows.
+        n_features (int): Number of features.
+        rng (np.random.Generator): Random number generator.
+
+    """
+
+    def __init__(self, size, n_features, rng):
+        self.X = np.empty((size, n_features), dtype=np.float32)
+        self.y = np.empty(size, dtype=np.float32)
+        self.size, self.seen, self.rng = size, 0, rng
+
+    def add(self, X, y):
+        # The first rows fill the reservoir, every later row t replaces a random slot with probability size / (t + 1)
+        n_fill = min(max(self.size - self.seen, 0), len(y))
+        self.X[self.seen:self.seen + n_fill], self.y[self.seen:self.seen + n_fill] = X[:n_fill], y[:n_fill]
+        if n_fill < len(y):
+            positions = np.arange(self.seen + n_fill, self.seen + len(y)) + 1
+            slots = self.rng.integers(0, positions)
+            keep = slots < self.size
+            self.X[slots[keep]], self.y[slots[keep]] = X[n_fill:][keep], y[n_fill:][keep]
+        self.seen += len(y)
+
+    def sample(self):
+        n = min(self.size, self.seen)
+        return self.X[:n], self.y[:n]
+
+class ChunkIterator(xgboost.DataIter):
+
+    """
+    XGBoost data iterator over the training chunks on disk, used to build an external memory DMatrix.
+    Args:
+        chunks (list): File paths of the (features, target) chunks.
+        cache_prefix (str): Path prefix of the XGBoost disk cache.
+
+    """
+
+    def __init__(self, chunks, cache_prefix):
+        self.chunks, self.position = chunks, 0
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data):
+        if self.position == len(self.chunks):
+            return 0
+        X, y = load_chunk(self.chunks[self.position])
+        input_data(data=X, label=y)
+        self.position += 1
+        return 1
+
+    def reset(self):
+        self.position = 0
+
+def _save_chunk(path, X, y):
+    np.save(path + '_X.npy', X)
+    np.save(path + '_y.npy', y)
+    return path
+
+# Function to load a chunk from disk
+def load_chunk(path):
+
+    """
+    Function to load a featurized chunk written by featurize_to_disk.
+    Args:
+        path (str): Path prefix of the chunk
+    Returns:
+        X (np.ndarray): float32 features
+        y (np.ndarray): float32 target values
+
+    """
+    return np.load(path + '_X.npy'), np.load(path + '_y.npy')
+
+# Function to featurize the training data chunk by chunk
+def featurize_to_disk(csv_path, work_dir, chunk_rows=CHUNK_ROWS, random_state=42):
+
+    """
+    Function to read the training data in chunks, featurize every chunk and write it to disk, split into
+    training and test chunks. The RandomForest and blend rows are sampled into reservoirs on the way.
+    Invalid and duplicate rows (see data_validation.py) and rows for which the feature calculation fails are skipped.
+    Args:
+        csv_path (str): Path of the CSV file with the gRNA_PAM and efficacy columns
+        work_dir (str): Directory for the chunks
+        chunk_rows (int): Number of rows per chunk
+        random_state (int): Seed of the split and the reservoirs
+    Returns:
+        split (dict): Training chunks, test chunks, RandomForest reservoir, blend reservoir and row counts
+
+    """
+    rng = np.random.default_rng(random_state)
+    rf_sample = Reservoir(RF_SAMPLE_ROWS, len(FEATURE_NAMES), rng)
+    blend_sample = Reservoir(BLEND_SAMPLE_ROWS, len(FEATURE_NAMES), rng)
+    split = {'train': [], 'test': [], 'rows': 0, 'valid_rows': 0, 'failed_rows': 0}
+    report = new_report()
+    thresholds = np.cumsum(SPLIT)
+
+    for i, chunk in enumerate(iter_valid_chunks(read_csv_chunks(csv_path, chunk_rows), report)):
+        split['rows'] = report['rows']
+        X, failed = feature_matrix(chunk['gRNA_PAM'])
+        X, y = X[~failed], chunk['efficacy'].to_numpy(dtype=np.float32)[~failed]
+        split['valid_rows'] += len(y)
+        split['failed_rows'] += int(failed.sum())
+
+        assignment = np.searchsorted(thresholds, rng.random(len(y)), side='right')
+        train, blend, test = assignment == 0, assignment == 1, assignment == 2
+        if train.any():
+            split['train'].append(_save_chunk(os.path.join(work_dir, f'train_{i}'), X[train], y[train]))
+            rf_sample.add(X[train], y[train])
+        if test.any():
+            split['test'].append(_save_chunk(os.path.join(work_dir, f'test_{i}'), X[test], y[test]))
+        blend_sample.add(X[blend], y[blend])
+        logger.info(f"Featurized chunk {i}: {split['rows']} rows read, {split['valid_rows']} valid rows.")
+
+    split['invalid_rows'], split['duplicate_rows'] = report['invalid_rows'], report['duplicate_rows']
+    split['rf_sample'], split['blend_sample'] = rf_sample, blend_sample
+    return split
+
+# Function to train XGBoost with external memory
+def train_xgboost_external(chunks, cache_dir, n_threads, n_rounds=XGB_ROUNDS, random_state=42):
+
+    """
+    Function to train the XGBoost member on the training chunks through an external memory DMatrix.
+    The trained booster is wrapped into an XGBRegressor, so it predicts from plain matrices like the in-memory model.
+    Args:
+        chunks (list): Path prefixes of the training chunks
+        cache_dir (str): Directory of the XGBoost disk cache
+        n_threads (int): Number of threads
+        n_rounds (int): Number of boosting rounds
+        random_state (int): Seed of XGBoost
+    Returns:
+        model (XGBRegressor): Trained XGBoost model
+
+    """
+    dtrain = xgboost.DMatrix(ChunkIterator(chunks, os.path.join(cache_dir, 'xgb_cache')))
+    booster = xgboost.train({'tree_method': 'hist', 'objective': 'reg:squarederror', 'seed': random_state,
+                             'nthread': n_threads}, dtrain, num_boost_round=n_rounds)
+    model = XGBRegressor(n_jobs=n_threads)
+    model.load_model(booster.save_raw(raw_format='ubj'))
+    return model
+
+# Function to evaluate the model on the test chunks
+def evaluate_chunks(model, chunks):
+
+    """
+    Function to evaluate the model on the test chunks one chunk at a time.
+    Args:
+        model: Trained model object
+        chunks (list): Path prefixes of the test chunks
+    Returns:
+        mse (float): Mean squared error
+        mae (float): Mean absolute error
+        r2 (float): R-squared score
+
+    """
+    n, squared_error, absolute_error, y_sum, y_squared_sum = 0, 0.0, 0.0, 0.0, 0.0
+    for chunk in chunks:
+        X, y = load_chunk(chunk)
+        y, residuals = y.astype(np.float64), y - model.predict(X)
+        n += len(y)
+        squared_error += float(np.sum(residuals.astype(np.float64) ** 2))
+        absolute_error += float(np.sum(np.abs(residuals)))
+        y_sum, y_squared_sum = y_sum + float(y.sum()), y_squared_sum + float(np.sum(y ** 2))
+    if n == 0:
+        raise ValueError("No test rows.")
+    total_variance = y_squared_sum - y_sum ** 2 / n
+    return squared_error / n, absolute_error / n, 1 - squared_error / total_variance if total_variance > 0 else float('nan')
+
+# Main function of the out-of-core training
+def main_out_of_core(csv_path, model_path=None, chunk_rows=CHUNK_ROWS, work_dir=None, progress=None):
+
+    """
+    Main function of the out-of-core training pipeline (see the module docstring).
+    The chunks and the XGBoost cache are written to a temporary directory (or work_dir) that is removed at the end.
+    The evaluated model is registered as a new version of the model registry (like the models of the training jobs,
+    see training_jobs.py), the model file and its metadata are removed afterwards (also if the training fails).
+    By default the model file is a new temporary file next to CANDIDATE_MODEL_PATH, so concurrent runs and the
+    training jobs never share it.
+    Args:
+        csv_path (str): Path of the CSV file with the gRNA_PAM and efficacy columns
+        model_path (str): File path to save the trained model until it is registered (default: a new temporary file)
+        chunk_rows (int): Number of rows per chunk
+        work_dir (str): Directory for the chunks (default: a temporary directory)
+        progress (callable): Function called with the name of each stage (optional)
+    Returns:
+        mse (float): Mean squared error of the model
+        mae (float): Mean absolute error of the model
+        r2 (float): R-squared score of the model
+        version (str): Version of the registered model
+
+    """
+    logger.info(f"Starting out-of-core training pipeline for {csv_path}...")
+    if progress is None:
+        progress = lambda stage: None
+    if model_path is None:
+        fd, model_path = tempfile.mkstemp(prefix='candidate_', suffix='.pkl', dir=os.path.dirname(CANDIDATE_MODEL_PATH))
+        os.close(fd)
+    remove_metadata(model_path)
+    work_dir = tempfile.mkdtemp(prefix='castor_ooc_', dir=work_dir)
+    try:
+        progress('featurize')
+        split = featurize_to_disk(csv_path, work_dir, chunk_rows)
+        logger.info(f"Out-of-core split: {split['valid_rows']} valid rows, {len(split['train'])} training chunks.")
+        if not split['train'] or not split['test'] or split['blend_sample'].seen == 0:
+            raise ValueError("Not enough valid rows to train the model.")
+
+        progress('fit')
+        resources = plan_resources(n_estimators=1, cv_folds=1)
+        snapshot = resource_snapshot()
+        xgboost_model = train_xgboost_external(split['train'], work_dir, resources['total_cores'])
+        X_rf, y_rf = split['rf_sample'].sample()
+        random_forest = RandomForestRegressor(random_state=42, n_jobs=resources['total_cores']).fit(X_rf, y_rf)
+        model = BlendedStackingRegressor([('random_forest', random_forest), ('xgboost', xgboost_model)],
+                                         LinearRegression()).fit_final(*split['blend_sample'].sample())
+        resources.update(resource_usage(snapshot, resources['total_cores']))
+        save_model(model, model_path)
+        save_metadata({'training_resources': resources,
+                       'out_of_core': {'rows': split['rows'], 'valid_rows': split['valid_rows'],
+                                       'invalid_rows': split['invalid_rows'], 'duplicate_rows': split['duplicate_rows'],
+                                       'failed_rows': split['failed_rows'], 'chunk_rows': chunk_rows,
+                                       'training_chunks': len(split['train']), 'test_chunks': len(split['test']),
+                                       'rf_sample_rows': len(y_rf), 'blend_rows': len(split['blend_sample'].sample()[1])}},
+                      model_path)
+
+        progress('evaluate')
+        mse, mae, r2 = evaluate_chunks(model, split['test'])
+        logger.info(f"MSE: {mse}, MAE: {mae}, R2: {r2}")
+        save_metadata({'metrics': {'mse': mse, 'mae': mae, 'r2': r2}}, model_path)
+        version = model_registry.register(model_path)
+        logger.info(f"Out-of-core training pipeline completed, the model is registered as candidate version {version}.")
+        return mse, mae, r2, version
+    except Exception as e:
+        logger.error(f"Error during out-of-core training: {str(e)}")
+        sys.exit(1)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        for file_path in [model_path, os.path.splitext(model_path)[0] + '.json']:  # The registry holds a copy now
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+if __name__ == '__main__':
+    main_out_of_core(*sys.argv[1:3])
@@ -0,0 +1,215 @@
+"""
+Disk cache for the PNG images of the result plots (see model_usage.visualize_features) that are put in the downloads.
+Rendering a plot to PNG (with kaleido) is the slowest step of a download, so every image is stored under the hash of
+the plotted data of the project and the name of the plot: a plot is rendered at most once until the project changes.
+The cache lives on the server and is shared by all the users (projects with the same results share their images).
+Its size is bounded and the least recently used images are evicted first.
+For the export of all the projects, the missing images are rendered in parallel worker processes (one project per
+task) and returned as soon as a project is done, so they can be written to the archive while the others render.
+The projects are submitted while they are read, with a bounded number of projects in flight, so only a few projects
+are in memory at a time.
+"""
+
+# Importing required libraries
+import hashlib
+import logging
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+
+import pandas as pd
+
+from Backend.features import STRUCTURE_FEATURES
+from Backend.model_usage import visualize_features
+from Backend.profiling import core_budget
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = 'Backend/plot_cache'
+MAX_CACHE_BYTES = 256 * 1024 * 1024  # 256 MB
+PLOT_NAMES = STRUCTURE_FEATURES + ['Feature Correlation Matrix']  # Plots of model_usage.visualize_features
+PNG_OPTIONS = {'format': 'png', 'width': 800, 'height': 600, 'scale': 2}
+RENDER_FORMAT = 1  # Increased when the plots or PNG_OPTIONS change, so older images are not returned anymore
+TASKS_PER_WORKER = 2  # Projects in flight per worker process (one rendering, one queued)
+
+# Function to hash the plotted data of a project
+def results_hash(results):
+
+    """
+    Function to calculate the hash of the data the plots of a project are drawn from (the structural features).
+    Args:
+        results (pd.DataFrame): Predicted k-mers of the project
+    Returns:
+        hash (str): Hexadecimal SHA-256 hash
+
+    """
+    digest = hashlib.sha256(f'v{RENDER_FORMAT}'.encode('ascii'))
+    digest.update(pd.util.hash_pandas_object(results[STRUCTURE_FEATURES], index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def _entry_path(content_hash, plot_name, cache_dir):
+    return os.path.join(cache_dir, f"{content_hash}_{plot_name.lower().replace(' ', '_')}.png")
+
+# Function to load a cached image
+def load(content_hash, plot_name, cache_dir=CACHE_DIR):
+
+    """
+    Function to load the cached image of a plot. The access time of the entry is updated so that
+    the eviction removes the least recently used images first.
+    Args:
+        content_hash (str): Hash of the plotted data (see results_hash)
+        plot_name (str): Name of the plot
+        cache_dir (str): Directory of the cache
+    Returns:
+        png (bytes): Cached image or None if the plot is not cached
+
+    """
+    path = _entry_path(content_hash, plot_name, cache_dir)
+    try:
+        with open(path, 'rb') as f:
+            png = f.read()
+        os.utime(path)
+        return png
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Could not read the cached plot {path}. Error: {str(e)}")
+        return None
+
+# Function to store an image in the cache
+def store(content_hash, plot_name, png, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+
+    """
+    Function to store the image of a plot in the cache.
+    The image is written to a temporary file first and then renamed, so concurrent sessions never read a partial image.
+    Args:
+        content_hash (str): Hash of the plotted data (see results_hash)
+        plot_name (str): Name of the plot
+        png (bytes): Image
+        cache_dir (str): Directory of the cache
+        max_bytes (int): Maximum size of the cache in bytes
+    Returns:
+        None
+
+    """
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(png)
+        os.replace(tmp_path, _entry_path(content_hash, plot_name, cache_dir))
+        evict(cache_dir, max_bytes)
+    except Exception as e:
+        logger.warning(f"Could not cache the plot {plot_name}. Error: {str(e)}")
+
+# Function to evict images from the cache
+def evict(cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+
+    """
+    Function to keep the cache bounded. The least recently used images are removed until the total size of the cache
+    is below max_bytes.
+    Args:
+        cache_dir (str): Directory of the cache
+        max_bytes (int): Maximum size of the cache in bytes
+    Returns:
+        None
+
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith('.png'):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue  # Removed by another session
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+# Function to get the images of the plots of a project
+def project_pngs(results, figures=None, cache_dir=CACHE_DIR):
+
+    """
+    Function to get the PNG images of all the plots of a project. Cached images are returned as they are, the other
+    plots are rendered (the figures are only built if an image is missing) and stored in the cache.
+    Args:
+        results (pd.DataFrame): Predicted k-mers of the project
+        figures (dict): Figures of the project by plot name, if they are already built (see model_usage.visualize_features)
+        cache_dir (str): Directory of the cache
+    Returns:
+        pngs (dict): PNG image of every plot by plot name
+
+    """
+    content_hash = results_hash(results)
+    pngs = {plot_name: load(content_hash, plot_name, cache_dir) for plot_name in PLOT_NAMES}
+    missing = [plot_name for plot_name, png in pngs.items() if png is None]
+    if missing:
+        figures = figures or visualize_features(results)
+        for plot_name in missing:
+            pngs[plot_name] = figures[plot_name].to_image(**PNG_OPTIONS)
+            store(content_hash, plot_name, pngs[plot_name], cache_dir)
+        logger.info(f"Rendered {len(missing)} of {len(PLOT_NAMES)} plots of project {content_hash[:12]}.")
+    return pngs
+
+def _render_project(results, cache_dir):
+    # Runs in a worker process
+    return project_pngs(results, cache_dir=cache_dir)
+
+# Function to get the images of the plots of many projects
+def iter_project_pngs(projects, n_workers=None, cache_dir=CACHE_DIR):
+
+    """
+    Function to get the PNG images of the plots of many projects (e.g. for the export of all the projects).
+    Projects whose images are all cached are returned as they are read, the other projects are submitted to parallel
+    worker processes as they are read (at most TASKS_PER_WORKER per worker in flight, reading waits for a project to
+    be done) and returned in the order they are done.
+    Args:
+        projects (iterable): (project name, predicted k-mers) of every project
+        n_workers (int): Number of worker processes (default: the core budget, see profiling.core_budget;
+                         started when a project has to be rendered)
+        cache_dir (str): Directory of the cache
+    Yields:
+        project_name (str): Project name
+        pngs (dict): PNG image of every plot by plot name
+
+    """
+    n_workers = n_workers or core_budget()
+    if n_workers == 1:
+        # No worker processes for a single core
+        for project_name, results in projects:
+            yield project_name, project_pngs(results, cache_dir=cache_dir)
+        return
+
+    executor, in_flight, rendered = None, {}, 0
+    try:
+        for project_name, results in projects:
+            content_hash = results_hash(results)
+            pngs = {plot_name: load(content_hash, plot_name, cache_dir) for plot_name in PLOT_NAMES}
+            if all(png is not None for png in pngs.values()):
+                yield project_name, pngs
+                continue
+            if executor is None:
+                executor = ProcessPoolExecutor(n_workers, mp_context=multiprocessing.get_context('spawn'))
+            in_flight[executor.submit(_render_project, results, cache_dir)] = project_name
+            rendered += 1
+            while len(in_flight) >= n_workers * TASKS_PER_WORKER:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield in_flight.pop(future), future.result()
+        for future in as_completed(in_flight):
+            yield in_flight[future], future.result()
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+            logger.info(f"Rendered the plots of {rendered} projects in {n_workers} worker processes.")
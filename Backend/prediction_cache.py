@@ -0,0 +1,183 @@
+"""
+Disk cache for the prediction results of the k-mers of an input sequence.
+The results are stored as pickle files keyed by the hash of the normalized input sequence and the version of the model
+that produced them, so re-submitting the same sequence (modifying a project or re-using a previously loaded input)
+returns the stored results instead of folding and predicting every k-mer again.
+The cache lives on the server and is therefore shared by all the users. Its size is bounded and the least recently used
+entries are evicted first. Entries of several model versions live side by side (e.g. the stacking and the student
+model of a version, or the previous version after a rollback), the entries of a version are only removed explicitly
+when the version is retired (see invalidate).
+"""
+
+# Importing required libraries
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = 'Backend/prediction_cache'
+MAX_CACHE_BYTES = 512 * 1024 * 1024  # 512 MB
+RESULTS_FORMAT = 3  # Increased when the results or their keys change, so older entries are not returned anymore
+
+# Function to normalize an input sequence
+def normalize_sequence(sequence):
+
+    """
+    Function to normalize an input sequence for its cache key, so that the same sequence always gives the same key.
+    Only the newlines are removed, which are the only characters the k-mer generation ignores (see
+    model_usage.generate_kmers): lower case (soft-masked) bases and other whitespace change the scored k-mers.
+    Args:
+        sequence (str): Input DNA sequence
+    Returns:
+        sequence (str): Normalized DNA sequence
+
+    """
+    return sequence.replace('\n', '')
+
+# Function to hash an input sequence
+def sequence_hash(sequence):
+
+    """
+    Function to calculate the SHA-256 hash of a normalized sequence.
+    Args:
+        sequence (str): Input DNA sequence
+    Returns:
+        hash (str): Hexadecimal SHA-256 hash
+
+    """
+    return hashlib.sha256(normalize_sequence(sequence).encode('utf-8')).hexdigest()
+
+# Function to build the cache key
+def cache_key(sequence, model_version, top_k=None):
+
+    """
+    Function to build the cache key of a prediction.
+    Args:
+        sequence (str): Input DNA sequence
+        model_version (str): Version of the model used for the prediction
+        top_k (int): Number of best k-mers requested (None for all the k-mers)
+    Returns:
+        key (str): Cache key (also used as file name)
+
+    """
+    return f"v{RESULTS_FORMAT}_{model_version}_{sequence_hash(sequence)}_{'all' if top_k is None else int(top_k)}"
+
+def _entry_path(key, cache_dir):
+    return os.path.join(cache_dir, f'{key}.pkl')
+
+# Function to load a cached prediction
+def load(key, cache_dir=CACHE_DIR):
+
+    """
+    Function to load the cached results for a key. The access time of the entry is updated so that
+    the eviction removes the least recently used entries first.
+    Args:
+        key (str): Cache key
+        cache_dir (str): Directory of the cache
+    Returns:
+        results (pd.DataFrame): Cached results or None if the key is not cached
+
+    """
+    path = _entry_path(key, cache_dir)
+    try:
+        with open(path, 'rb') as f:
+            results = pickle.load(f)
+        os.utime(path)
+        logger.info(f"Prediction cache hit: {key}")
+        return results
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Could not read the cached prediction {key}. Error: {str(e)}")
+        return None
+
+# Function to store a prediction in the cache
+def store(key, results, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+
+    """
+    Function to store the results of a prediction in the cache.
+    The entry is written to a temporary file first and then renamed, so concurrent sessions never read a partial entry.
+    Args:
+        key (str): Cache key
+        results (pd.DataFrame): Prediction results
+        cache_dir (str): Directory of the cache
+        max_bytes (int): Maximum size of the cache in bytes
+    Returns:
+        None
+
+    """
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(results, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, _entry_path(key, cache_dir))
+        evict(cache_dir, max_bytes)
+    except Exception as e:
+        logger.warning(f"Could not cache the prediction {key}. Error: {str(e)}")
+
+# Function to evict entries from the cache
+def evict(cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+
+    """
+    Function to keep the cache bounded. Entries of an older results format are removed, then the least recently used
+    entries are removed until the total size of the cache is below max_bytes.
+    Args:
+        cache_dir (str): Directory of the cache
+        max_bytes (int): Maximum size of the cache in bytes
+    Returns:
+        None
+
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith('.pkl'):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            if not name.startswith(f'v{RESULTS_FORMAT}_'):
+                os.remove(path)  # Invalidated by a new results format
+                continue
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue  # Removed by another session
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+# Function to remove the entries of a model version
+def invalidate(model_version, cache_dir=CACHE_DIR):
+
+    """
+    Function to remove all the entries of a retired model version (including the entries of its student model).
+    Args:
+        model_version (str): Retired version of the model
+        cache_dir (str): Directory of the cache
+    Returns:
+        removed (int): Number of removed entries
+
+    """
+    if not os.path.isdir(cache_dir):
+        return 0
+    removed = 0
+    for name in os.listdir(cache_dir):
+        if name.endswith('.pkl') and name.startswith(f'v{RESULTS_FORMAT}_{model_version}_'):
+            try:
+                os.remove(os.path.join(cache_dir, name))
+                removed += 1
+            except FileNotFoundError:
+                continue  # Removed by another session
+    if removed:
+        logger.info(f"Removed {removed} cached predictions of model version {model_version}.")
+    return removed
@@ -0,0 +1,142 @@
+"""
+Profiler of the model training pipeline (model_generator.main).
+Every stage of the pipeline is timed (wall clock and CPU time). The resident set size of the process is sampled by
+a thread while the stage runs, which gives the peak of the stage itself (ru_maxrss only gives the peak since the
+process started). For the finished worker processes (e.g. the joblib workers of the training) only that high-water
+mark is available, so a stage records how much it rose during the stage.
+The peak memory per stage can additionally be measured with tracemalloc, which tracks the Python and numpy allocations
+but slows down every allocation, so it is only enabled on request (trace_memory or CASTOR_TRACE_MEMORY=1).
+Additional details, like the time spent per ViennaRNA feature or the fit time of every estimator, are added to the
+report by the stages themselves.
+The core budget shared by the stages and their worker processes (CASTOR_TRAINING_CORES, see core_budget) is
+defined here as well, so the modules that start worker processes don't have to import the training pipeline.
+Usage:
+    profiler = PipelineProfiler()
+    with profiler.stage('extract_features'):
+        ...
+    profiler.report()
+"""
+
+# Importing required libraries
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+TRACE_MEMORY = os.getenv('CASTOR_TRACE_MEMORY') == '1'  # Measure the peak memory per stage with tracemalloc
+TRAINING_CORES = os.getenv('CASTOR_TRAINING_CORES')  # Total number of cores used for training (default: all cores)
+RSS_SAMPLE_SECONDS = 0.05  # Interval of the resident set size samples
+
+# Function to get the core budget
+def core_budget():
+
+    """
+    Function to get the total number of cores the training pipeline and its worker processes may use
+    (CASTOR_TRAINING_CORES or all the cores of the host).
+    Returns:
+        total_cores (int): Number of cores
+
+    """
+    return max(1, int(TRAINING_CORES or os.cpu_count() or 1))
+
+def _max_rss_mb(children=False):
+    # Peak resident set size in MB of this process or of its largest finished child process (ru_maxrss is in KB on Linux)
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _rss_mb():
+    # Current resident set size in MB of this process (None where /proc is not available)
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / MB
+    except (OSError, ValueError, IndexError):
+        return None
+
+class _RSSSampler(threading.Thread):
+
+    """
+    Thread sampling the resident set size of the process every RSS_SAMPLE_SECONDS until it is stopped.
+
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak = _rss_mb()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while self.peak is not None and not self._stop_event.wait(RSS_SAMPLE_SECONDS):
+            self.peak = max(self.peak, _rss_mb() or 0)
+
+    def stop(self):
+        # Stop sampling and return the peak in MB (None if the resident set size can't be read)
+        self._stop_event.set()
+        self.join()
+        return None if self.peak is None else max(self.peak, _rss_mb() or 0)
+
+class PipelineProfiler:
+
+    """
+    Collects the timing and peak memory of the stages of a pipeline run.
+    Args:
+        trace_memory (bool): Measure the peak memory of every stage with tracemalloc (slows down allocations).
+
+    """
+
+    def __init__(self, trace_memory=TRACE_MEMORY):
+        self.trace_memory = trace_memory
+        self.stages = []
+        self.details = {}
+        self.start = time.perf_counter()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name):
+        # Time the stage and measure its peak memory (also if it fails)
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        child_rss = _max_rss_mb(children=True)
+        sampler = _RSSSampler()
+        sampler.start()
+        times, start = os.times(), time.perf_counter()
+        try:
+            yield
+        finally:
+            end_times = os.times()
+            record = {'stage': name, 'wall_seconds': time.perf_counter() - start,
+                      'cpu_seconds': (end_times.user + end_times.system + end_times.children_user +
+                                      end_times.children_system) -
+                                     (times.user + times.system + times.children_user + times.children_system),
+                      'peak_rss_mb': sampler.stop(),
+                      'child_max_rss_rise_mb': None if child_rss is None else _max_rss_mb(children=True) - child_rss}
+            if self.trace_memory:
+                record['peak_memory_mb'] = tracemalloc.get_traced_memory()[1] / MB
+            self.stages.append(record)
+            logger.info(f"Stage {record}")
+
+    def add_details(self, name, details):
+        self.details[name] = details
+
+    def report(self):
+        # Stop tracing and return the report
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        total = time.perf_counter() - self.start
+        return {'total_seconds': total,
+                'max_rss_mb': _max_rss_mb(),
+                'max_child_rss_mb': _max_rss_mb(children=True),
+                'stages': [dict(record, share=record['wall_seconds'] / total if total > 0 else None)
+                           for record in self.stages],
+                **self.details}
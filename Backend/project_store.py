@@ -0,0 +1,388 @@
+"""
+Storage of the user projects (input sequence and predicted k-mers) in one SQLite database per user (data/<user>.db).
+The projects table is the index of the projects (the Summary of the Excel export) and the results of every project
+are stored in their own table, so adding, renaming or deleting a project only touches that project's rows and
+tables instead of rewriting all the projects of the user. The Excel workbook is only produced for the export.
+The input sequences are stored once, compressed, in the sequence store (see sequence_store.py), the index only holds
+the hash and the length of the sequence of every project.
+Only the k-mer, its position, the predicted efficacy and the structural features of the results are stored
+(RESULT_COLUMNS), the one-hot encoded features only depend on the k-mer and are rebuilt when they are needed.
+Workbooks of the previous storage (data/<user>.xlsx) are migrated on the first login.
+Several sessions (e.g. browser tabs) of the same user can use the store at the same time: the database is in WAL mode,
+so reads never wait for a write, and every write is one transaction that takes the write lock of the store when it
+starts (BEGIN IMMEDIATE) and is committed atomically. Every project has a revision that is increased by every change,
+a session passes the revision it has seen to a change and gets a ConflictError if another session changed the project
+in the meantime, instead of overwriting that change.
+"""
+
+# Importing required libraries
+import logging
+import os
+import sqlite3
+import tempfile
+from contextlib import closing, contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from Backend import sequence_store
+from Backend.features import STRUCTURE_FEATURES, one_hot_frame
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = 'data'
+SUMMARY_COLUMNS = ['Project Name', 'Sequence Hash', 'Base pairs', 'Timestamp']
+BUSY_TIMEOUT = 30  # Seconds a write waits for the write lock of the store
+# Stored columns of the results and their (compact) data types
+RESULT_COLUMNS = {'k-mer': object, 'Position': np.int32, 'Predicted_Efficacy': np.float32,
+                  **{feature: np.float32 for feature in STRUCTURE_FEATURES}}
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS projects (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL UNIQUE,
+    sequence_hash TEXT NOT NULL,
+    base_pairs INTEGER NOT NULL,
+    timestamp TEXT NOT NULL,
+    revision INTEGER NOT NULL DEFAULT 1
+)
+'''
+_SQL_TYPES = {object: 'TEXT', np.int32: 'INTEGER', np.float32: 'REAL'}
+
+class ConflictError(RuntimeError):
+
+    """
+    Raised when a project was changed (or a project name was taken) by another session.
+
+    """
+
+# Function to get the path of the store of a user
+def store_path(username, data_dir=DATA_DIR):
+
+    """
+    Function to get the path of the project store of a user.
+    Args:
+        username (str): Username
+        data_dir (str): Directory of the stores
+    Returns:
+        path (str): Path of the SQLite database
+
+    """
+    return os.path.join(data_dir, f'{username}.db')
+
+@contextmanager
+def _connect(path, write=False, wal=True):
+    # One transaction per operation, committed on success and rolled back on errors.
+    # Writes take the write lock when they start, so two writes never have to upgrade a read lock at the same time
+    with closing(sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None)) as conn:
+        conn.execute(f"PRAGMA journal_mode={'WAL' if wal else 'DELETE'}")
+        _upgrade(conn)
+        conn.execute('BEGIN IMMEDIATE' if write else 'BEGIN')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+def _columns(conn):
+    return {column[1] for column in conn.execute('PRAGMA table_info(projects)')}
+
+def _upgrade(conn):
+    # Create the schema or upgrade the schema of an older store, in its own write transaction (only if it is needed)
+    if _columns(conn) == {'id', 'name', 'sequence_hash', 'base_pairs', 'timestamp', 'revision'}:
+        return
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute(_SCHEMA)
+        columns = _columns(conn)
+        if 'revision' not in columns:  # Stores before revisions
+            conn.execute('ALTER TABLE projects ADD COLUMN revision INTEGER NOT NULL DEFAULT 1')
+        if 'sequence' in columns:  # Stores with the sequences in the index
+            conn.execute("ALTER TABLE projects ADD COLUMN sequence_hash TEXT NOT NULL DEFAULT ''")
+            for project_id, sequence in conn.execute('SELECT id, sequence FROM projects').fetchall():
+                conn.execute('UPDATE projects SET sequence_hash = ? WHERE id = ?', (sequence_store.put(sequence), project_id))
+            conn.execute('ALTER TABLE projects DROP COLUMN sequence')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+def _table(project_id):
+    return f'results_{int(project_id)}'
+
+def _project_id(conn, name, revision=None):
+    # Id of a project, checking that it still has the revision the session has seen
+    row = conn.execute('SELECT id, revision FROM projects WHERE name = ?', (name,)).fetchone()
+    if row is None:
+        if revision is not None:
+            raise ConflictError(f"Project {name} was renamed or deleted in another session.")
+        raise KeyError(f"Project {name} does not exist.")
+    if revision is not None and row[1] != int(revision):
+        raise ConflictError(f"Project {name} was changed in another session.")
+    return row[0]
+
+def _check_name(conn, name, project_id=None):
+    row = conn.execute('SELECT id FROM projects WHERE name = ?', (name,)).fetchone()
+    if row is not None and row[0] != project_id:
+        raise ConflictError(f"Project name {name} was taken in another session.")
+
+def _write_results(conn, project_id, results):
+    # (Re)create the results table of a project in the current transaction
+    table = _table(project_id)
+    conn.execute(f'DROP TABLE IF EXISTS {table}')
+    conn.execute(f'CREATE TABLE {table} (' +
+                 ', '.join(f'"{column}" {_SQL_TYPES[dtype]}' for column, dtype in RESULT_COLUMNS.items()) + ')')
+    conn.executemany(f'INSERT INTO {table} VALUES ({", ".join("?" * len(RESULT_COLUMNS))})',
+                     zip(*(results[column].tolist() for column in RESULT_COLUMNS)))
+
+# Function to select the stored columns of the results
+def slim_results(results, sequence=None):
+
+    """
+    Function to select the stored columns of the results (RESULT_COLUMNS) in their compact data types.
+    Results without positions (saved before the positions were predicted) get the first position of the k-mer
+    in the input sequence.
+    Args:
+        results (pd.DataFrame): Predicted k-mers (see model_usage.predict_efficacy_scores)
+        sequence (str): Input sequence (only needed for results without positions)
+    Returns:
+        results (pd.DataFrame): Stored columns of the predicted k-mers
+
+    """
+    if 'Position' not in results.columns:
+        sequence = ''.join(str(sequence or '').split()).upper()
+        results = results.assign(Position=[sequence.find(kmer) + 1 for kmer in results['k-mer']])
+    return results[list(RESULT_COLUMNS)].astype(RESULT_COLUMNS).reset_index(drop=True)
+
+# Function to load the project index
+def load_summary(path, revisions=False):
+
+    """
+    Function to load the index of the projects of a user (the Summary sheet of the Excel export).
+    Args:
+        path (str): Path of the store
+        revisions (bool): Add the Revision column (the revisions a session passes to its changes)
+    Returns:
+        summary (pd.DataFrame): Project Name, Sequence Hash, Base pairs and Timestamp of every project (oldest first)
+
+    """
+    if not os.path.exists(path):
+        return _summary(None, revisions)
+    with _connect(path) as conn:
+        return _summary(conn, revisions)
+
+def _summary(conn, revisions=False):
+    columns = SUMMARY_COLUMNS + (['Revision'] if revisions else [])
+    rows = [] if conn is None else \
+        conn.execute('SELECT name, sequence_hash, base_pairs, timestamp, revision FROM projects ORDER BY id').fetchall()
+    return pd.DataFrame([row[:len(columns)] for row in rows], columns=columns)
+
+# Function to load the results of a project
+def load_project(path, name, one_hot=False, revision=None):
+
+    """
+    Function to load the results of one project.
+    Args:
+        path (str): Path of the store
+        name (str): Project name
+        one_hot (bool): Rebuild the one-hot encoded features of the k-mers as well
+        revision (int): Revision of the project the session has seen (raises ConflictError if it was changed since)
+    Returns:
+        results (pd.DataFrame): Predicted k-mers of the project (RESULT_COLUMNS)
+
+    """
+    with _connect(path) as conn:
+        results = pd.read_sql_query(f'SELECT * FROM {_table(_project_id(conn, name, revision))}', conn, dtype=RESULT_COLUMNS)
+    if one_hot:
+        results = pd.concat([results, one_hot_frame(results['k-mer'], index=results.index)], axis=1)
+    return results
+
+# Function to save a new project
+def save_project(path, name, sequence, results):
+
+    """
+    Function to add a project to the store.
+    Args:
+        path (str): Path of the store
+        name (str): Project name
+        sequence (str): Input sequence
+        results (pd.DataFrame): Predicted k-mers
+    Returns:
+        timestamp (str): Time the project was saved
+        revision (int): Revision of the project
+
+    """
+    timestamp = _now()
+    digest = sequence_store.put(sequence)
+    with _connect(path, write=True) as conn:
+        _check_name(conn, name)
+        cursor = conn.execute('INSERT INTO projects (name, sequence_hash, base_pairs, timestamp) VALUES (?, ?, ?, ?)',
+                              (name, digest, len(sequence), timestamp))
+        _write_results(conn, cursor.lastrowid, slim_results(results, sequence))
+    logger.info(f"Project {name} saved in {path}.")
+    return timestamp, 1
+
+# Function to replace a project
+def replace_project(path, old_name, name, sequence, results, revision=None):
+
+    """
+    Function to replace the name, input sequence and results of an existing project.
+    Args:
+        path (str): Path of the store
+        old_name (str): Current project name
+        name (str): New project name
+        sequence (str): New input sequence
+        results (pd.DataFrame): New predicted k-mers
+        revision (int): Revision of the project the session has seen (optional, checked against the store)
+    Returns:
+        timestamp (str): Time the project was replaced
+        revision (int): New revision of the project
+
+    """
+    timestamp = _now()
+    digest = sequence_store.put(sequence)
+    with _connect(path, write=True) as conn:
+        project_id = _project_id(conn, old_name, revision)
+        _check_name(conn, name, project_id)
+        conn.execute('UPDATE projects SET name = ?, sequence_hash = ?, base_pairs = ?, timestamp = ?, revision = revision + 1 '
+                     'WHERE id = ?', (name, digest, len(sequence), timestamp, project_id))
+        _write_results(conn, project_id, slim_results(results, sequence))
+        new_revision = conn.execute('SELECT revision FROM projects WHERE id = ?', (project_id,)).fetchone()[0]
+    logger.info(f"Project {old_name} replaced by {name} in {path}.")
+    return timestamp, new_revision
+
+# Function to rename a project
+def rename_project(path, old_name, name, revision=None):
+
+    """
+    Function to rename a project (only its row of the index is updated).
+    Args:
+        path (str): Path of the store
+        old_name (str): Current project name
+        name (str): New project name
+        revision (int): Revision of the project the session has seen (optional, checked against the store)
+    Returns:
+        timestamp (str): Time the project was renamed
+        revision (int): New revision of the project
+
+    """
+    timestamp = _now()
+    with _connect(path, write=True) as conn:
+        project_id = _project_id(conn, old_name, revision)
+        _check_name(conn, name, project_id)
+        conn.execute('UPDATE projects SET name = ?, timestamp = ?, revision = revision + 1 WHERE id = ?',
+                     (name, timestamp, project_id))
+        new_revision = conn.execute('SELECT revision FROM projects WHERE id = ?', (project_id,)).fetchone()[0]
+    return timestamp, new_revision
+
+# Function to delete a project
+def delete_project(path, name, revision=None):
+
+    """
+    Function to delete a project and its results. Deleting a project that doesn't exist (anymore) does nothing.
+    Args:
+        path (str): Path of the store
+        name (str): Project name
+        revision (int): Revision of the project the session has seen (optional, a project that was changed
+                        in another session since then is not deleted)
+    Returns:
+        None
+
+    """
+    if not os.path.exists(path):
+        return
+    with _connect(path, write=True) as conn:
+        try:
+            project_id = _project_id(conn, name)
+        except KeyError:
+            return
+        _project_id(conn, name, revision)
+        conn.execute(f'DROP TABLE IF EXISTS {_table(project_id)}')
+        conn.execute('DELETE FROM projects WHERE id = ?', (project_id,))
+    logger.info(f"Project {name} deleted from {path}.")
+
+# Function to read all the projects
+@contextmanager
+def read_projects(path):
+
+    """
+    Function to read the index and the results of all the projects of a user (e.g. for the export) in one read
+    transaction, so the index and the projects are consistent with each other. The results are loaded one project
+    at a time, while the projects are iterated inside the with block.
+    Args:
+        path (str): Path of the store
+    Yields:
+        summary (pd.DataFrame): Index of the projects (see load_summary)
+        projects (generator): Project name and predicted k-mers (RESULT_COLUMNS) of every project of the index
+
+    """
+    if not os.path.exists(path):
+        yield _summary(None), iter(())
+        return
+    with _connect(path) as conn:
+        project_ids = conn.execute('SELECT id FROM projects ORDER BY id').fetchall()
+        summary = _summary(conn)
+        projects = ((name, pd.read_sql_query(f'SELECT * FROM {_table(project_id)}', conn, dtype=RESULT_COLUMNS))
+                    for (project_id,), name in zip(project_ids, summary['Project Name']))
+        yield summary, projects
+
+# Function to migrate an Excel workbook of the previous storage
+def migrate_excel(xlsx_path, path):
+
+    """
+    Function to import the projects of a workbook of the previous storage (Summary sheet and one sheet per project)
+    into the store. Projects without a sheet are skipped. The workbook is kept with the extension .xlsx.migrated.
+    The store is built in a temporary file and hard linked to the path of the store, which fails if the store exists,
+    so a store is never half migrated or replaced (if two sessions migrate the same workbook, the first store is kept).
+    Args:
+        xlsx_path (str): Path of the workbook
+        path (str): Path of the store
+    Returns:
+        None
+
+    """
+    sheets = pd.read_excel(xlsx_path, sheet_name=None)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.db.tmp')
+    os.close(fd)
+    try:
+        with _connect(tmp_path, write=True, wal=False) as conn:  # No WAL file next to the temporary store
+            for _, project in sheets.get('Summary', pd.DataFrame(columns=SUMMARY_COLUMNS)).iterrows():
+                name = str(project['Project Name'])
+                if name not in sheets:
+                    continue
+                cursor = conn.execute('INSERT INTO projects (name, sequence_hash, base_pairs, timestamp) VALUES (?, ?, ?, ?)',
+                                      (name, sequence_store.put(str(project['Sequence'])), int(project['Base pairs']),
+                                       str(project['Timestamp'])))
+                _write_results(conn, cursor.lastrowid, slim_results(sheets[name], project['Sequence']))
+        try:
+            os.link(tmp_path, path)
+        except FileExistsError:
+            return  # Migrated by another session
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    try:
+        os.replace(xlsx_path, xlsx_path + '.migrated')
+    except FileNotFoundError:
+        pass  # Moved by another session
+    logger.info(f"Migrated {xlsx_path} to {path}.")
+
+# Function to list the users with a store
+def list_users(data_dir=DATA_DIR):
+
+    """
+    Function to list the users that have a project store.
+    Args:
+        data_dir (str): Directory of the stores
+    Returns:
+        users (list): Usernames
+
+    """
+    if not os.path.isdir(data_dir):
+        return []
+    return sorted(file[:-len('.db')] for file in os.listdir(data_dir) if file.endswith('.db'))
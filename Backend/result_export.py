@@ -0,0 +1,104 @@
+"""
+Export of the predicted k-mers in formats for downstream pipelines: Parquet (if pyarrow is installed) and
+gzip-compressed CSV. The stored columns of the results are exported (k-mer, position in the input sequence,
+predicted efficacy and structural features, see project_store.RESULT_COLUMNS), written with the vectorized pyarrow
+writers (pandas for the CSV if pyarrow is not installed). The projects are written one at a time, so the export of
+all the projects of a user is written incrementally (one Parquet row group per project).
+Usage:
+    with ResultsWriter(output, 'parquet', project_column=True) as writer:
+        writer.write(results, project_name)
+"""
+
+# Importing required libraries
+import gzip
+import io
+import logging
+
+import numpy as np
+
+from Backend.project_store import RESULT_COLUMNS
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:  # Only the gzip-compressed CSV export is available
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+# File extension of every export format
+FORMATS = {'parquet': '.parquet', 'csv.gz': '.csv.gz'}
+
+# Function to list the available export formats
+def available_formats():
+
+    """
+    Function to list the export formats that can be written in this environment.
+    Returns:
+        formats (list): Export formats (keys of FORMATS)
+
+    """
+    return list(FORMATS) if pa is not None else ['csv.gz']
+
+def _schema(project_column):
+    types = {np.int32: pa.int32(), np.float32: pa.float32(), object: pa.string()}
+    fields = [(column, types[dtype]) for column, dtype in RESULT_COLUMNS.items()]
+    return pa.schema(([('Project Name', pa.string())] if project_column else []) + fields)
+
+class ResultsWriter:
+
+    """
+    Writes the results of one or more projects to a binary file object (it doesn't need to be seekable).
+    Args:
+        output: Binary file object
+        fmt (str): Export format ('parquet' or 'csv.gz')
+        project_column (bool): Add the project name as the first column (for the export of several projects)
+
+    """
+
+    def __init__(self, output, fmt, project_column=False):
+        if fmt not in available_formats():
+            raise ValueError(f"Export format {fmt} is not available (available: {available_formats()}).")
+        self.fmt = fmt
+        self.project_column = project_column
+        self.rows = 0
+        if pa is not None:
+            self.schema = _schema(project_column)
+            if fmt == 'parquet':
+                self.writer = pq.ParquetWriter(output, self.schema)
+            else:
+                self.stream = pa.CompressedOutputStream(output, 'gzip')
+                self.writer = pa_csv.CSVWriter(self.stream, self.schema)
+        else:
+            self.stream = gzip.GzipFile(fileobj=output, mode='wb')
+            self.text = io.TextIOWrapper(self.stream, encoding='utf-8', newline='')
+            self.text.write(','.join((['Project Name'] if project_column else []) + list(RESULT_COLUMNS)) + '\n')
+
+    def write(self, results, project_name=None):
+        # Write the results of a project
+        frame = results[list(RESULT_COLUMNS)]
+        if self.project_column:
+            frame = frame.assign(**{'Project Name': project_name})[['Project Name'] + list(RESULT_COLUMNS)]
+        if pa is not None:
+            self.writer.write_table(pa.Table.from_pandas(frame, schema=self.schema, preserve_index=False))
+        else:
+            frame.to_csv(self.text, index=False, header=False)
+        self.rows += len(frame)
+
+    def close(self):
+        if pa is not None:
+            self.writer.close()
+            if self.fmt == 'csv.gz':
+                self.stream.close()
+        else:
+            self.text.flush()
+            self.text.detach()
+            self.stream.close()
+        logger.info(f"Exported {self.rows} k-mers as {self.fmt}.")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,113 @@
+"""
+Content-addressed storage of the input sequences of the projects.
+Every input sequence is stored once, zlib-compressed, in a file named by the SHA-256 hash of the sequence
+(SEQUENCE_DIR/<hash>.zz), so a sequence used by several projects (also of different users) is stored only once and
+the project index only holds the hash and the length of the sequence. A sequence is only decompressed when it is
+needed (e.g. when a project is modified). Sequences that no project refers to anymore are removed by collect_garbage.
+Usage:
+    sequence_hash = put(sequence)
+    sequence = get(sequence_hash)
+"""
+
+# Importing required libraries
+import hashlib
+import logging
+import os
+import tempfile
+import time
+import zlib
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+SEQUENCE_DIR = 'data/sequences'
+COMPRESSION_LEVEL = 9
+GARBAGE_MIN_AGE = 3600  # Seconds an unreferenced sequence is kept (it may belong to a project that is being saved)
+
+# Function to hash a sequence
+def sequence_hash(sequence):
+
+    """
+    Function to calculate the SHA-256 hash of an input sequence (the name of its file in the store).
+    Args:
+        sequence (str): Input sequence
+    Returns:
+        hash (str): Hexadecimal SHA-256 hash
+
+    """
+    return hashlib.sha256(sequence.encode('utf-8')).hexdigest()
+
+def _blob_path(sequence_hash, seq_dir):
+    return os.path.join(seq_dir, f'{sequence_hash}.zz')
+
+# Function to store a sequence
+def put(sequence, seq_dir=SEQUENCE_DIR):
+
+    """
+    Function to store an input sequence (if it is not stored yet).
+    The file is written to a temporary file first and then renamed, so a sequence file is never partial.
+    Args:
+        sequence (str): Input sequence
+        seq_dir (str): Directory of the sequences
+    Returns:
+        hash (str): Hash of the sequence
+
+    """
+    digest = sequence_hash(sequence)
+    path = _blob_path(digest, seq_dir)
+    if os.path.exists(path):
+        os.utime(path)  # Recently used, see collect_garbage
+        return digest
+    os.makedirs(seq_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=seq_dir, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(zlib.compress(sequence.encode('utf-8'), COMPRESSION_LEVEL))
+    os.replace(tmp_path, path)
+    return digest
+
+# Function to load a sequence
+@lru_cache(maxsize=32)
+def get(sequence_hash, seq_dir=SEQUENCE_DIR):
+
+    """
+    Function to load an input sequence (the most recently loaded sequences are kept in memory).
+    Args:
+        sequence_hash (str): Hash of the sequence
+        seq_dir (str): Directory of the sequences
+    Returns:
+        sequence (str): Input sequence
+
+    """
+    with open(_blob_path(sequence_hash, seq_dir), 'rb') as f:
+        return zlib.decompress(f.read()).decode('utf-8')
+
+# Function to remove the sequences that are not used anymore
+def collect_garbage(referenced, seq_dir=SEQUENCE_DIR, min_age=GARBAGE_MIN_AGE):
+
+    """
+    Function to remove the stored sequences that no project refers to anymore.
+    Sequences that were stored (or re-used) less than min_age seconds ago are kept.
+    Args:
+        referenced (set): Hashes of the sequences of all the projects of all the users
+        seq_dir (str): Directory of the sequences
+        min_age (int): Minimum age in seconds of a removed sequence
+    Returns:
+        removed (int): Number of removed sequences
+
+    """
+    if not os.path.isdir(seq_dir):
+        return 0
+    removed = 0
+    for name in os.listdir(seq_dir):
+        if not name.endswith('.zz') or name[:-len('.zz')] in referenced:
+            continue
+        path = os.path.join(seq_dir, name)
+        try:
+            if time.time() - os.stat(path).st_mtime >= min_age:
+                os.remove(path)
+                removed += 1
+        except FileNotFoundError:
+            continue  # Removed by another session
+    if removed:
+        logger.info(f"Removed {removed} unused sequences from {seq_dir}.")
+    return removed
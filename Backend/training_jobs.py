@@ -0,0 +1,317 @@
+"""
+Background jobs for the model training pipeline (model_generator.main).
+A training job runs in its own Python process, so a long training run doesn't block the admin page and a failing
+run (model_generator exits on errors) cannot take down the server. Each job has a directory in JOBS_DIR with a JSON
+record of its status, current stage, progress and result, which the admin page polls.
+Jobs run one at a time: a worker only starts training when it holds the running lock, otherwise its job stays
+queued and the running worker starts the next queued job when it is done.
+Usage:
+    job_id = submit_job(df, incremental=True)
+    job_id = submit_job('dataset.csv', out_of_core=True)  # Trained in chunks (see out_of_core.py)
+    get_job(job_id)  # {'status': 'running', 'stage': 'featurize', 'progress': 0.25, ...}
+    cancel_job(job_id)
+The worker is started as: python -m Backend.training_jobs <job_id>
+"""
+
+# Importing required libraries
+import json
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+JOBS_DIR = os.path.join(ROOT_DIR, 'Backend', 'training_jobs')
+LOCK_PATH = os.path.join(JOBS_DIR, 'running.lock')
+STAGES = ['validate', 'featurize', 'fit', 'evaluate', 'render']
+HEARTBEAT_SECONDS = 5
+STALE_SECONDS = 60  # A running job without heartbeat for this long is considered dead
+
+class JobCancelled(BaseException):
+    """Raised in the worker when its job is cancelled (a BaseException, so the pipeline's error handling doesn't catch it)."""
+
+def _job_dir(job_id):
+    return os.path.join(JOBS_DIR, job_id)
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+def _write_record(record):
+    path = os.path.join(_job_dir(record['id']), 'job.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(record, f, indent=4, default=str)
+    os.replace(path + '.tmp', path)
+
+def _update_record(job_id, **fields):
+    record = get_job(job_id)
+    record.update(fields)
+    _write_record(record)
+    return record
+
+def _data_paths(job_id):
+    return [os.path.join(_job_dir(job_id), name) for name in ['data.pkl', 'data.csv']]
+
+def _remove_data(job_id):
+    for path in _data_paths(job_id):
+        if os.path.exists(path):
+            os.remove(path)
+
+def _cancelled(job_id):
+    return os.path.exists(os.path.join(_job_dir(job_id), 'cancel'))
+
+def _heartbeat_age(job_id):
+    try:
+        return time.time() - os.path.getmtime(os.path.join(_job_dir(job_id), 'heartbeat'))
+    except FileNotFoundError:
+        return None
+
+# Function to get a job record
+def get_job(job_id):
+
+    """
+    Function to get the record of a training job.
+    A running job whose worker stopped sending heartbeats (e.g. the process was killed) is reported as failed,
+    or as cancelled if it was cancelled.
+    Args:
+        job_id (str): Id of the job
+    Returns:
+        record (dict): Job record (id, status, stage, progress, options, created, started, finished, result, error)
+
+    """
+    with open(os.path.join(_job_dir(job_id), 'job.json')) as f:
+        record = json.load(f)
+    if record['status'] == 'running':
+        age = _heartbeat_age(job_id)
+        if age is not None and age > STALE_SECONDS:
+            if _cancelled(job_id):
+                record.update(status='cancelled', finished=_now())
+            else:
+                record.update(status='failed', finished=_now(), error='The training process stopped unexpectedly.')
+    return record
+
+# Function to list the jobs
+def list_jobs():
+
+    """
+    Function to list the records of all the training jobs, the newest job first.
+    Returns:
+        jobs (list): Job records
+
+    """
+    if not os.path.isdir(JOBS_DIR):
+        return []
+    jobs = []
+    for job_id in os.listdir(JOBS_DIR):
+        if os.path.exists(os.path.join(_job_dir(job_id), 'job.json')):
+            jobs.append(get_job(job_id))
+    return sorted(jobs, key=lambda job: job['created'] + job['id'], reverse=True)
+
+# Function to get the latest job
+def latest_job():
+
+    """
+    Function to get the record of the most recently submitted training job.
+    Returns:
+        record (dict): Job record (None if no job was submitted yet)
+
+    """
+    jobs = list_jobs()
+    return jobs[0] if jobs else None
+
+# Function to submit a training job
+def submit_job(data, **options):
+
+    """
+    Function to submit a training job. The dataset is stored in the job directory and a worker process is started.
+    With out_of_core=True the dataset is a CSV file that is copied as it is and trained in chunks
+    (out_of_core.main_out_of_core, which takes no other options), so it is never loaded into memory.
+    Args:
+        data (pd.DataFrame or str or file): Training data (gRNA_PAM and efficacy columns),
+                                            or the path or file object of a CSV file with out_of_core=True
+        **options: Keyword arguments for model_generator.main (e.g. incremental=True, distill=True), or out_of_core=True
+    Returns:
+        job_id (str): Id of the job
+
+    """
+    job_id = datetime.now().strftime("%Y%m%d%H%M%S") + '_' + uuid.uuid4().hex[:6]
+    os.makedirs(_job_dir(job_id))
+    if options.get('out_of_core'):
+        if isinstance(data, str):
+            shutil.copyfile(data, os.path.join(_job_dir(job_id), 'data.csv'))
+        else:
+            data.seek(0)
+            with open(os.path.join(_job_dir(job_id), 'data.csv'), 'wb') as f:
+                shutil.copyfileobj(data, f)
+    else:
+        data.to_pickle(os.path.join(_job_dir(job_id), 'data.pkl'))
+    _write_record({'id': job_id, 'status': 'queued', 'stage': None, 'progress': 0.0, 'options': options,
+                   'created': _now(), 'started': None, 'finished': None, 'pid': None, 'result': None, 'error': None})
+    _start_worker(job_id)
+    logger.info(f"Training job {job_id} submitted.")
+    return job_id
+
+# Function to cancel a training job
+def cancel_job(job_id):
+
+    """
+    Function to cancel a training job. A queued job is cancelled directly, a running worker is signalled to stop
+    (it marks its job as cancelled and starts the next queued job). The cancel marker is written first, the worker
+    checks it after marking its job as running, so a job that starts while it is cancelled ends as cancelled.
+    Args:
+        job_id (str): Id of the job
+    Returns:
+        None
+
+    """
+    if get_job(job_id)['status'] not in ['queued', 'running']:
+        return
+    open(os.path.join(_job_dir(job_id), 'cancel'), 'w').close()
+    record = get_job(job_id)  # Its worker may have started it meanwhile
+    if record['status'] == 'queued':
+        _update_record(job_id, status='cancelled', finished=_now())
+        _remove_data(job_id)
+    elif record['status'] == 'running':
+        try:
+            os.kill(record['pid'], signal.SIGTERM)
+        except (OSError, TypeError) as e:
+            logger.warning(f"Could not signal the training job {job_id}: {str(e)}")
+    logger.info(f"Training job {job_id} cancelled.")
+
+def _start_worker(job_id):
+    with open(os.path.join(_job_dir(job_id), 'output.log'), 'ab') as output:
+        subprocess.Popen([sys.executable, '-m', 'Backend.training_jobs', job_id], cwd=ROOT_DIR,
+                         stdout=output, stderr=subprocess.STDOUT)
+
+def _acquire_lock(job_id):
+    # Only one worker trains at a time, a lock of a dead worker is taken over
+    while True:
+        try:
+            fd = os.open(LOCK_PATH, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            with os.fdopen(fd, 'w') as f:
+                f.write(job_id)
+            return True
+        except FileExistsError:
+            try:
+                with open(LOCK_PATH) as f:
+                    owner = f.read().strip()
+                lock_age = time.time() - os.path.getmtime(LOCK_PATH)
+            except FileNotFoundError:
+                continue
+            age = _heartbeat_age(owner) if owner else None
+            alive = (age if age is not None else lock_age) <= STALE_SECONDS
+            try:
+                active = bool(owner) and get_job(owner)['status'] in ['queued', 'running']
+            except FileNotFoundError:
+                active = False  # The job of the owner was removed
+            if alive and active:
+                return False
+            try:
+                os.remove(LOCK_PATH)
+            except FileNotFoundError:
+                pass
+
+def _release_lock(job_id):
+    # Only the lock of this job is removed (a lock taken over by another worker is kept)
+    try:
+        with open(LOCK_PATH) as f:
+            owner = f.read().strip()
+        if owner == job_id:
+            os.remove(LOCK_PATH)
+    except FileNotFoundError:
+        pass
+
+def _heartbeat(job_id, stop):
+    path = os.path.join(_job_dir(job_id), 'heartbeat')
+    while not stop.is_set():
+        with open(path, 'a'):
+            os.utime(path)
+        stop.wait(HEARTBEAT_SECONDS)
+
+def _cancel_handler(signum, frame):
+    raise JobCancelled()
+
+def _remove_models(model_paths):
+    # Model files with their metadata files
+    for path in model_paths:
+        for file_path in [path, os.path.splitext(path)[0] + '.json']:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+# Function to run a training job (in the worker process)
+def run_job(job_id):
+
+    """
+    Function to run a training job in the worker process. The progress of model_generator.main is written to the
+    job record after every stage and the result (metrics and path of the trained model) when it is done.
+    The model is registered as a new version of the model registry, which the admin promotes or rejects.
+    Args:
+        job_id (str): Id of the job
+    Returns:
+        None
+
+    """
+    record = get_job(job_id)
+    if record['status'] != 'queued' or not _acquire_lock(job_id):
+        return
+
+    stop = threading.Event()
+    candidate_paths = []
+    try:
+        from Backend.model_generator import main, CANDIDATE_MODEL_PATH, STUDENT_MODEL_PATH
+        from Backend.model_registry import register
+        if not record['options'].get('out_of_core'):
+            candidate_paths = [CANDIDATE_MODEL_PATH] + ([STUDENT_MODEL_PATH] if record['options'].get('distill') else [])
+        signal.signal(signal.SIGTERM, _cancel_handler)
+        threading.Thread(target=_heartbeat, args=(job_id, stop), daemon=True).start()
+        _update_record(job_id, status='running', started=_now(), pid=os.getpid())
+        if _cancelled(job_id):
+            raise JobCancelled()  # Cancelled while it was queued (cancel_job writes the marker first)
+
+        def progress(stage):
+            if _cancelled(job_id):
+                raise JobCancelled()
+            _update_record(job_id, stage=stage, progress=STAGES.index(stage) / len(STAGES))
+
+        if record['options'].get('out_of_core'):
+            # Registers the model itself, from a model file of its own
+            from Backend.out_of_core import main_out_of_core
+            mse, mae, r2, version = main_out_of_core(os.path.join(_job_dir(job_id), 'data.csv'), progress=progress)
+        else:
+            df = pd.read_pickle(os.path.join(_job_dir(job_id), 'data.pkl'))
+            mse, mae, r2 = main(df, progress=progress, model_path=CANDIDATE_MODEL_PATH, **record['options'])
+            student_path = STUDENT_MODEL_PATH if record['options'].get('distill') else None
+            version = register(CANDIDATE_MODEL_PATH, student_path)
+        _update_record(job_id, status='done', progress=1.0, finished=_now(),
+                       result={'mse': mse, 'mae': mae, 'r2': r2, 'version': version})
+    except JobCancelled:
+        _update_record(job_id, status='cancelled', finished=_now())
+    except SystemExit:
+        _update_record(job_id, status='failed', finished=_now(), error='Training failed, see Backend/rna_model.log for details.')
+    except Exception as e:
+        # A job cancelled while it starts can fail on its removed dataset
+        _update_record(job_id, finished=_now(), **({'status': 'cancelled'} if _cancelled(job_id) else
+                       {'status': 'failed', 'error': str(e)}))
+    finally:
+        stop.set()
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        _remove_models(candidate_paths)  # The registry holds a copy now (a failed or cancelled run leaves nothing behind)
+        _remove_data(job_id)
+        _release_lock(job_id)
+
+    # Start the next queued job
+    queued = [job for job in list_jobs() if job['status'] == 'queued']
+    if queued:
+        _start_worker(queued[-1]['id'])
+
+if __name__ == '__main__':
+    run_job(sys.argv[1])
@@ -0,0 +1,142 @@
+"""
+Rendering of the training plots (feature distributions and residual plot) shown to the admin after a retrain.
+The plots are rendered after the model is saved, in parallel worker processes (one plot per task), so they are not on
+the critical path of the training. For large datasets the histograms are binned with numpy before they are sent to the
+workers, instead of drawing a KDE over every value. The rendered plots are cached by the hash of the dataset
+(and of the predictions for the residual plot), so retraining on unchanged data doesn't render them again.
+"""
+
+# Importing required libraries
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from Backend.profiling import core_budget
+
+logger = logging.getLogger(__name__)
+
+PLOT_DIR = 'Backend/feature_plots'
+CACHE_FILE = '.plot_cache.json'  # Hashes of the data the plots in PLOT_DIR were rendered from
+BINNING_ROWS = 50000  # Datasets with more rows get pre-binned histograms without KDE
+BINS = 50
+
+# Function to hash a dataset
+def dataset_hash(df):
+
+    """
+    Function to calculate a hash of the training data (sequences and efficacy values, in order).
+    Args:
+        df (pd.DataFrame): Training data
+    Returns:
+        hash (str): Hexadecimal SHA-256 hash
+
+    """
+    row_hashes = pd.util.hash_pandas_object(df[['gRNA_PAM', 'efficacy']], index=False).to_numpy()
+    return hashlib.sha256(row_hashes.tobytes()).hexdigest()
+
+def _array_hash(*arrays):
+    digest = hashlib.sha256()
+    for array in arrays:
+        digest.update(np.ascontiguousarray(array, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+def _render_histogram(feature, path, values=None, counts=None, edges=None):
+    # Runs in a worker process
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    plt.figure(figsize=(8, 6))
+    if counts is None:
+        sns.histplot(values, kde=True)
+    else:
+        plt.stairs(counts, edges, fill=True, alpha=0.6)
+        plt.stairs(counts, edges)
+    plt.title(f'Distribution of {feature}')
+    plt.xlabel(feature)
+    plt.ylabel('Frequency')
+    plt.savefig(path)
+    plt.close()
+    return path
+
+def _render_residuals(y_test, y_pred, path):
+    # Runs in a worker process
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(8, 6))
+    plt.scatter(y_test, y_pred, s=8 if len(y_test) > BINNING_ROWS else None)
+    plt.xlabel('Actual Efficacy')
+    plt.ylabel('Predicted Efficacy')
+    plt.title('Actual vs Predicted Efficacy')
+    plt.savefig(path)
+    plt.close()
+    return path
+
+def _load_cache(output_dir):
+    try:
+        with open(os.path.join(output_dir, CACHE_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+# Function to render the training plots
+def render_training_plots(X, y_test, y_pred, data_hash, output_dir=PLOT_DIR, n_workers=None):
+
+    """
+    Function to render the feature distributions (excluding the one-hot encoded features) and the residual plot
+    in parallel worker processes. Plots whose data hash is unchanged since the last rendering are skipped.
+    Args:
+        X (pd.DataFrame): Features of the training data
+        y_test (np.ndarray): Test target values
+        y_pred (np.ndarray): Predicted target values
+        data_hash (str): Hash of the training data (see dataset_hash)
+        output_dir (str): Directory of the plots
+        n_workers (int): Number of worker processes (default: the core budget, see profiling.core_budget)
+    Returns:
+        summary (dict): Rendered and skipped plots and the rendering time in seconds
+
+    """
+    start = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    cache = _load_cache(output_dir)
+    residual_hash = _array_hash(y_test, y_pred)
+    features = [column for column in X.columns if not column.startswith('OneHot_')]
+
+    tasks = {}
+    if cache.get('features') != data_hash or not all(
+            os.path.exists(os.path.join(output_dir, f'{feature}_distribution.png')) for feature in features):
+        for feature in features:
+            values = X[feature].to_numpy()
+            path = os.path.join(output_dir, f'{feature}_distribution.png')
+            if len(values) > BINNING_ROWS:
+                counts, edges = np.histogram(values[np.isfinite(values)], bins=BINS)
+                tasks[feature] = (_render_histogram, (feature, path, None, counts, edges))
+            else:
+                tasks[feature] = (_render_histogram, (feature, path, values))
+    if cache.get('residuals') != residual_hash or not os.path.exists(os.path.join(output_dir, 'residual_plot.png')):
+        tasks['residuals'] = (_render_residuals, (np.asarray(y_test), np.asarray(y_pred),
+                                                  os.path.join(output_dir, 'residual_plot.png')))
+
+    if tasks:
+        n_workers = min(len(tasks), n_workers or core_budget())
+        with ProcessPoolExecutor(n_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = [executor.submit(function, *args) for function, args in tasks.values()]
+            for future in futures:
+                future.result()
+        with open(os.path.join(output_dir, CACHE_FILE), 'w') as f:
+            json.dump({'features': data_hash, 'residuals': residual_hash}, f)
+
+    summary = {'rendered': list(tasks), 'skipped': [name for name in features + ['residuals'] if name not in tasks],
+               'seconds': time.perf_counter() - start}
+    logger.info(f"Training plots in {output_dir}: {summary}")
+    return summary
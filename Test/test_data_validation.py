@@ -0,0 +1,47 @@
+"""
+Tests of the validation of the training data CSV files (Backend/data_validation.py), with the pyarrow CSV reader
+and with the pandas fallback that is used when pyarrow is not installed.
+"""
+
+import pytest
+
+from Backend import data_validation
+from Backend.data_validation import ValidationError, validate_csv
+
+
+@pytest.fixture(params=['pyarrow', 'pandas'])
+def reader(request, monkeypatch):
+    # Runs a test with both CSV readers
+    if request.param == 'pyarrow':
+        pytest.importorskip('pyarrow')
+    else:
+        monkeypatch.setattr(data_validation, 'pa', None)
+    return request.param
+
+
+def write_csv(tmp_path, text):
+    path = tmp_path / 'training.csv'
+    path.write_text(text)
+    return str(path)
+
+
+def test_valid_and_invalid_rows(reader, tmp_path):
+    path = write_csv(tmp_path, 'gRNA_PAM,efficacy,note\n'
+                               'ACGTACGT,0.5,a\n'
+                               'ACGTACGT,0.5,duplicate\n'
+                               'ACGUXCGT,0.1,b\n'
+                               'TTTTGGGG,high,c\n'
+                               'GGGGCCCC,,d\n')
+    valid, report = validate_csv(path)
+    assert list(valid.columns) == ['gRNA_PAM', 'efficacy']
+    assert valid['gRNA_PAM'].tolist() == ['ACGTACGT']
+    assert (report['rows'], report['valid_rows'], report['duplicate_rows'], report['invalid_rows']) == (5, 1, 1, 3)
+    assert report['invalid_characters'] == ['U', 'X']
+    assert report['invalid'].index.tolist() == [2, 3, 4]
+
+
+@pytest.mark.parametrize('header', ['gRNA_PAM,score', 'sequence,efficacy', 'name,value'])
+def test_missing_column(reader, tmp_path, header):
+    path = write_csv(tmp_path, header + '\nACGT,0.5\n')
+    with pytest.raises(ValidationError, match='Missing required columns'):
+        validate_csv(path)
@@ -0,0 +1,49 @@
+"""
+Tests of the feature calculation (Backend/features.py): the models predict from a float32 feature matrix,
+which must give the same efficacy scores as the float64 features the models were originally trained on.
+"""
+
+import os
+
+import numpy as np
+import pytest
+from Bio import SeqIO
+from sklearn.ensemble import RandomForestRegressor, StackingRegressor
+from sklearn.linear_model import LinearRegression
+from xgboost import XGBRegressor
+
+from Backend.features import FEATURE_NAMES, feature_matrix
+from Backend.model_usage import generate_kmers
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture(scope='module')
+def kmers():
+    # k-mers of the first 300 bases of the test sequence
+    record = next(SeqIO.parse(os.path.join(TEST_DIR, 'test_sequence.txt'), 'fasta'))
+    return generate_kmers(str(record.seq)[:300])
+
+
+@pytest.fixture(scope='module')
+def model(kmers):
+    # Small stacking model of the same structure as the trained model (see model_generator.train_model)
+    X, _ = feature_matrix(kmers, dtype=np.float64)
+    y = np.random.default_rng(42).random(len(kmers))
+    model = StackingRegressor(estimators=[('random_forest', RandomForestRegressor(n_estimators=10, random_state=42)),
+                                          ('xgboost', XGBRegressor(n_estimators=20, random_state=42))],
+                              final_estimator=LinearRegression(), cv=2)
+    return model.fit(X, y)
+
+
+def test_feature_matrix_layout(kmers):
+    X, failed = feature_matrix(kmers)
+    assert X.dtype == np.float32 and X.flags['C_CONTIGUOUS']
+    assert X.shape == (len(kmers), len(FEATURE_NAMES))
+    assert not failed.any()
+
+
+def test_float32_predictions_match_float64(kmers, model):
+    X32, _ = feature_matrix(kmers, dtype=np.float32)
+    X64, _ = feature_matrix(kmers, dtype=np.float64)
+    assert np.allclose(model.predict(X32), model.predict(X64), atol=1e-4)
@@ -0,0 +1,78 @@
+"""
+Tests of the model registry (Backend/model_registry.py): promotions, rollbacks through the history and the import
+of the model deployed before the registry.
+"""
+
+import os
+
+import pytest
+
+from Backend import model_registry
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    registry_dir = str(tmp_path / 'registry')
+    monkeypatch.setattr(model_registry, 'REGISTRY_DIR', registry_dir)
+    monkeypatch.setattr(model_registry, 'VERSIONS_DIR', os.path.join(registry_dir, 'versions'))
+    monkeypatch.setattr(model_registry, 'CURRENT_PATH', os.path.join(registry_dir, 'CURRENT'))
+    monkeypatch.setattr(model_registry, 'HISTORY_PATH', os.path.join(registry_dir, 'history.jsonl'))
+    monkeypatch.setattr(model_registry, 'LEGACY_MODEL_PATH', str(tmp_path / 'stacking_model.pkl'))
+    monkeypatch.setattr(model_registry, 'LEGACY_IMPORT_PATH', os.path.join(registry_dir, 'legacy_import'))
+    monkeypatch.chdir(tmp_path)  # Cached predictions of deleted versions (prediction_cache.CACHE_DIR)
+    return tmp_path
+
+
+def register(tmp_path, content):
+    # Versions are named after the registration time and the model hash, so every model has its own content
+    path = tmp_path / 'candidate_model.pkl'
+    path.write_bytes(content)
+    return model_registry.register(str(path))
+
+
+def test_register_is_not_served(registry):
+    version = register(registry, b'model 1')
+    assert model_registry.current_version() is None
+    assert [metadata['version'] for metadata in model_registry.candidates()] == [version]
+
+
+def test_rollback_walks_back_through_promotions(registry):
+    v1, v2, v3 = (register(registry, f'model {i}'.encode()) for i in range(1, 4))
+    for version in [v1, v2, v3]:
+        model_registry.promote(version)
+    assert model_registry.rollback() == v2
+    assert model_registry.rollback() == v1  # Not back to v3
+    assert model_registry.rollback() is None
+    assert model_registry.current_version() == v1
+
+
+def test_promote_after_rollback(registry):
+    v1, v2, v3 = (register(registry, f'model {i}'.encode()) for i in range(1, 4))
+    model_registry.promote(v1)
+    model_registry.promote(v2)
+    model_registry.rollback()
+    model_registry.promote(v3)
+    assert model_registry.rollback() == v1  # v3 replaced v1, the rolled back v2 is skipped
+    # Promoting the current version again keeps the version it replaced
+    model_registry.promote(v2)
+    model_registry.promote(v2)
+    assert model_registry.rollback() == v1
+
+
+def test_promoted_versions_are_kept(registry):
+    v1, v2 = (register(registry, f'model {i}'.encode()) for i in range(1, 3))
+    model_registry.promote(v1)
+    with pytest.raises(ValueError):
+        model_registry.delete_version(v1)
+    model_registry.delete_version(v2)
+    assert [metadata['version'] for metadata in model_registry.list_versions()] == [v1]
+    with pytest.raises(ValueError):
+        model_registry.promote(v2)
+
+
+def test_legacy_model_is_imported_once(registry):
+    (registry / 'stacking_model.pkl').write_bytes(b'legacy model')
+    version = model_registry.current_version()
+    assert version is not None
+    assert model_registry.current_version() == version
+    assert len(model_registry.list_versions()) == 1
@@ -0,0 +1,63 @@
+"""
+Tests of the disk cache of the prediction results (Backend/prediction_cache.py): the cache key and the eviction.
+"""
+
+import os
+
+import pandas as pd
+
+from Backend import prediction_cache
+from Backend.prediction_cache import cache_key, evict, invalidate, load, store
+
+
+def test_key_ignores_only_newlines():
+    # The k-mer generation only removes newlines, anything else changes the scored k-mers
+    assert cache_key('ACGT\nACGT\n', 'v1') == cache_key('ACGTACGT', 'v1')
+    assert cache_key('acgtACGT', 'v1') != cache_key('ACGTACGT', 'v1')
+    assert cache_key('ACGT ACGT', 'v1') != cache_key('ACGTACGT', 'v1')
+
+
+def test_key_depends_on_model_and_top_k():
+    keys = {cache_key('ACGT', 'v1'), cache_key('ACGT', 'v2'), cache_key('ACGT', 'v1_student'),
+            cache_key('ACGT', 'v1', top_k=10), cache_key('ACGT', 'v1', top_k=20)}
+    assert len(keys) == 5
+
+
+def test_store_and_load(tmp_path):
+    results = pd.DataFrame({'k-mer': ['A' * 23], 'Predicted_Efficacy': [0.5]})
+    store(cache_key('ACGT', 'v1'), results, str(tmp_path))
+    pd.testing.assert_frame_equal(load(cache_key('ACGT', 'v1'), str(tmp_path)), results)
+    assert load(cache_key('ACGT', 'v2'), str(tmp_path)) is None
+
+
+def test_versions_do_not_evict_each_other(tmp_path):
+    results = pd.DataFrame({'x': range(10)})
+    for version in ['v1', 'v1_student', 'v2']:
+        store(cache_key('ACGT', version), results, str(tmp_path))
+    assert all(load(cache_key('ACGT', version), str(tmp_path)) is not None for version in ['v1', 'v1_student', 'v2'])
+
+
+def test_evict_least_recently_used(tmp_path):
+    keys = [cache_key(sequence, 'v1') for sequence in ['AAAA', 'CCCC', 'GGGG']]
+    for i, key in enumerate(keys):
+        store(key, pd.DataFrame({'x': range(1000)}), str(tmp_path))
+        os.utime(os.path.join(tmp_path, f'{key}.pkl'), (i, i))  # Oldest first
+    load(keys[0], str(tmp_path))  # Used again, so it is the most recently used now
+    size = os.path.getsize(os.path.join(tmp_path, f'{keys[0]}.pkl'))
+    evict(str(tmp_path), max_bytes=2 * size)
+    assert [load(key, str(tmp_path)) is not None for key in keys] == [True, False, True]
+
+
+def test_evict_older_results_format(tmp_path):
+    stale = os.path.join(tmp_path, f'v{prediction_cache.RESULTS_FORMAT - 1}_v1_hash_all.pkl')
+    open(stale, 'wb').close()
+    evict(str(tmp_path))
+    assert not os.path.exists(stale)
+
+
+def test_invalidate_retired_version(tmp_path):
+    results = pd.DataFrame({'x': range(10)})
+    for version in ['v1', 'v1_student', 'v2']:
+        store(cache_key('ACGT', version), results, str(tmp_path))
+    assert invalidate('v1', str(tmp_path)) == 2
+    assert load(cache_key('ACGT', 'v2'), str(tmp_path)) is not None
@@ -0,0 +1,109 @@
+"""
+Tests of the project store (Backend/project_store.py): the revision checks of concurrent sessions and the migration
+of the Excel workbooks of the previous storage.
+"""
+
+import os
+
+import pandas as pd
+import pytest
+
+from Backend import project_store
+from Backend.project_store import ConflictError, RESULT_COLUMNS
+
+SEQUENCE = 'ACGTACGTACGTACGTACGTAGGACGT'
+
+
+def results(efficacy=0.5):
+    return pd.DataFrame({'k-mer': [SEQUENCE[:23]], 'Position': [1], 'Predicted_Efficacy': [efficacy],
+                         **{column: [0.0] for column in list(RESULT_COLUMNS)[3:]}})  # Structure features
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    # The sequences are stored relative to the working directory (sequence_store.SEQUENCE_DIR)
+    monkeypatch.chdir(tmp_path)
+    return str(tmp_path / 'user.db')
+
+
+def test_save_and_load(store):
+    timestamp, revision = project_store.save_project(store, 'p1', SEQUENCE, results())
+    assert revision == 1
+    loaded = project_store.load_project(store, 'p1', revision=1)
+    assert loaded['k-mer'].tolist() == [SEQUENCE[:23]]
+    summary = project_store.load_summary(store, revisions=True)
+    assert summary[['Project Name', 'Base pairs', 'Timestamp', 'Revision']].values.tolist() == \
+        [['p1', len(SEQUENCE), timestamp, 1]]
+
+
+def test_changed_project_conflicts(store):
+    project_store.save_project(store, 'p1', SEQUENCE, results())
+    _, revision = project_store.rename_project(store, 'p1', 'p2', revision=1)
+    assert revision == 2
+    # Another session still has the project under its old name or revision
+    with pytest.raises(ConflictError):
+        project_store.load_project(store, 'p1', revision=1)
+    with pytest.raises(ConflictError):
+        project_store.replace_project(store, 'p2', 'p2', SEQUENCE, results(0.9), revision=1)
+    with pytest.raises(ConflictError):
+        project_store.delete_project(store, 'p2', revision=1)
+    _, revision = project_store.replace_project(store, 'p2', 'p2', SEQUENCE, results(0.9), revision=2)
+    assert revision == 3
+    assert project_store.load_project(store, 'p2')['Predicted_Efficacy'].tolist() == pytest.approx([0.9])
+
+
+def test_taken_name_conflicts(store):
+    project_store.save_project(store, 'p1', SEQUENCE, results())
+    project_store.save_project(store, 'p2', SEQUENCE, results())
+    with pytest.raises(ConflictError):
+        project_store.save_project(store, 'p1', SEQUENCE, results())
+    with pytest.raises(ConflictError):
+        project_store.rename_project(store, 'p2', 'p1', revision=1)
+
+
+def test_missing_project(store):
+    project_store.save_project(store, 'p1', SEQUENCE, results())
+    with pytest.raises(KeyError):
+        project_store.load_project(store, 'p2')
+    project_store.delete_project(store, 'p2')  # Nothing to delete
+    project_store.delete_project(store, 'p1', revision=1)
+    assert project_store.load_summary(store).empty
+
+
+def test_read_projects(store):
+    with project_store.read_projects(store) as (summary, projects):
+        assert summary.empty and list(projects) == []  # No store yet
+    for name in ['p1', 'p2']:
+        project_store.save_project(store, name, SEQUENCE, results())
+    with project_store.read_projects(store) as (summary, projects):
+        project_store.save_project(store, 'p3', SEQUENCE, results())  # Saved in another session after the read started
+        assert [name for name, _ in projects] == summary['Project Name'].tolist() == ['p1', 'p2']
+
+
+def write_workbook(path):
+    summary = pd.DataFrame({'Project Name': ['p1', 'orphan'], 'Sequence': [SEQUENCE, SEQUENCE],
+                            'Base pairs': [len(SEQUENCE), len(SEQUENCE)], 'Timestamp': ['2025-01-01 00:00:00'] * 2})
+    with pd.ExcelWriter(path) as writer:
+        summary.to_excel(writer, sheet_name='Summary', index=False)
+        # Sheet of the previous storage, without positions
+        results().drop(columns='Position').to_excel(writer, sheet_name='p1', index=False)
+
+
+def test_migrate_excel(store, tmp_path):
+    xlsx_path = str(tmp_path / 'user.xlsx')
+    write_workbook(xlsx_path)
+    project_store.migrate_excel(xlsx_path, store)
+    assert not os.path.exists(xlsx_path) and os.path.exists(xlsx_path + '.migrated')
+    assert project_store.load_summary(store)['Project Name'].tolist() == ['p1']  # The project without a sheet is skipped
+    loaded = project_store.load_project(store, 'p1')
+    assert loaded['Position'].tolist() == [1]
+    assert [name for name in os.listdir(tmp_path) if name.endswith('.tmp')] == []
+
+
+def test_migrate_excel_keeps_existing_store(store, tmp_path):
+    project_store.save_project(store, 'p2', SEQUENCE, results())
+    xlsx_path = str(tmp_path / 'user.xlsx')
+    write_workbook(xlsx_path)
+    project_store.migrate_excel(xlsx_path, store)  # Migrated by another session first
+    assert project_store.load_summary(store)['Project Name'].tolist() == ['p2']
+    assert [name for name in os.listdir(tmp_path) if name.endswith('.tmp')] == []
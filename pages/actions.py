@@ -10,14 +10,13 @@ Date of Modified : 17th February, 2025
 import streamlit as st
 from streamlit import session_state as ss
 from time import sleep
-import pandas as pd
-import os
 from traceback import print_exc
 from Bio import SeqIO
 from io import StringIO
 
-from pages.functions import footer, check_name, validate_fasta, save_project, replace_project, show_results, change_project_name, form_glass_bg,selectbox_style
+from pages.functions import footer, check_name, validate_fasta, save_project, replace_project, show_results, change_project_name, form_glass_bg,selectbox_style, uncache_project, project_revision, reload_projects
 from Backend.model_usage import predict_efficacy_scores
+from Backend import model_registry, project_store, sequence_store
 
 def new_project(name = ''):
     """Adds a new project for that user"""
@@ -41,7 +40,7 @@ def new_project(name = ''):
                 st.markdown('<div style="text-align: center;">or</div>', unsafe_allow_html=True)
     
                 if option:
-                    sequence = ss.data['Summary'][ss.data['Summary']["Project Name"]==option]['Sequence'].iloc[0]
+                    sequence = sequence_store.get(ss.data['Summary'][ss.data['Summary']["Project Name"]==option]['Sequence Hash'].iloc[0]) # Decompressed on demand
                     data = f'>{option}\n{sequence}'
                     fasta_text = st.text_area("Insert DNA sequence as a FASTA format",value = data)
                 else:
@@ -51,10 +50,11 @@ def new_project(name = ''):
                 fasta_file = st.file_uploader("Upload FASTA File",type=['txt','fasta'],help='Click on upload and select fasta/text file of your choice')
                 if name not in ss.data['Summary']['Project Name'].unique():
                     return
-                sequence = ss.data['Summary'][ss.data['Summary']['Project Name']==name]['Sequence'].to_list()[0]
+                sequence = sequence_store.get(ss.data['Summary'][ss.data['Summary']['Project Name']==name]['Sequence Hash'].to_list()[0]) # Decompressed on demand
                 fasta_data = f'>{name}\n{sequence}'
                 fasta_text = st.text_area("Insert DNA sequence as a FASTA format", value=fasta_data, help='Must be in FASTA format!')
     
+            top_k = st.number_input("Guide RNAs to keep", min_value=0, value=0, step=100, help='Only the best guide RNAs are kept in the project (0 keeps all of them). Keeps large inputs small and fast to open and download')
             submit = st.form_submit_button("Submit", use_container_width=True,help='Please check before submitting')
             form_glass_bg()
     
@@ -78,7 +78,12 @@ def new_project(name = ''):
                 elif (fasta_data.strip() == data.strip() and project_name != name and name != ''):
                     if check_name(ss.data['Summary'],project_name):
                         st.write('Only project name was changed')
-                        ss.data = change_project_name(ss.data,name,project_name)
+                        try:
+                            ss.data = change_project_name(ss.data,name,project_name)
+                        except project_store.ConflictError as e:
+                            st.error(f'{e} The projects were reloaded, please try again.')
+                            reload_projects()
+                            return
                         st.success('Project Name was changed to '+project_name)
                         return
     
@@ -88,7 +93,7 @@ def new_project(name = ''):
                         data = str(list(SeqIO.parse(StringIO(data), "fasta"))[0].seq)
     #                    print('Data:',data)
                         st.success(f"Submitted")
-                        df = predict_efficacy_scores(data)
+                        df = predict_efficacy_scores(data, top_k=int(top_k) or None, student=model_registry.serve_student())
                         print(df)
                         results = 1
                 else:
@@ -103,6 +108,10 @@ def new_project(name = ''):
                 ss.data = replace_project(ss.data, name, project_name, data, df)
             else:
                 ss.data = save_project(project_name, data, df, ss.data) # Save's Data and also updates ss.data
+        except project_store.ConflictError as e:
+            st.error(f'{e} The projects were reloaded, please try again.')
+            reload_projects()
+            return
         except:
             st.error("Failed to Save! Fix Code")
             print_exc()
@@ -126,14 +135,13 @@ def modify(name):
 def delete(sheet_name_to_remove):
     """Deletes the selected project and updates the Summary sheet.
     """
-    ss.data['Summary'] = ss.data['Summary'][ss.data['Summary']["Project Name"] != sheet_name_to_remove] # Removed from the Summary sheet
-
-    if sheet_name_to_remove in ss.data.keys():
-        del ss.data[sheet_name_to_remove] # Removed sheet from session_state as well
+    try:
+        project_store.delete_project(ss.datapath, sheet_name_to_remove, revision=project_revision(ss.data, sheet_name_to_remove)) # Only this project is removed from the store
+    except project_store.ConflictError as e:
+        st.error(f'{e} The projects were reloaded, please try again.')
+        reload_projects()
+        return
 
-    if os.path.exists(ss.datapath):
-        os.remove(ss.datapath)
+    ss.data['Summary'] = ss.data['Summary'][ss.data['Summary']["Project Name"] != sheet_name_to_remove] # Removed from the Summary sheet
 
-    with pd.ExcelWriter(ss.datapath,engine='openpyxl',mode='w') as writer: # Saving the updated data!
-        for name,sheet in ss.data.items():
-            sheet.to_excel(writer,sheet_name=name,index=False)
+    uncache_project(sheet_name_to_remove) # Removed results from session_state as well
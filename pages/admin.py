@@ -12,8 +12,11 @@ import streamlit as st
 from streamlit import session_state as ss
 import pandas as pd
 import os
+import logging
 from PIL import Image
 
+logger = logging.getLogger(__name__)
+
 if 'page_state' not in ss.keys():
     ss.admin = 'admin'
 
@@ -27,7 +30,10 @@ if ss.page_state == 'admin':
 
 from pages.functions import footer
 from main import set_background
-from Backend.model_generator import main
+from Backend import model_registry, project_store, sequence_store
+from Backend.training_jobs import submit_job, cancel_job, latest_job
+from Backend.data_validation import validate_csv, ValidationError
+from time import sleep
 import firebase_admin
 from firebase_admin import credentials, firestore, auth
 
@@ -41,15 +47,16 @@ def admin_dasboard():
     set_background("images/castor_bg4.jpg")
     st.title('Admin Dashboard')
 
-    user_files = os.listdir(os.getcwd()+'/data')
-    if user_files == []:
+    usernames = project_store.list_users()
+    if usernames == []:
         st.info('No user data to display!')
         return
 
     data = {'User':[],'Number of Projects':[],'Last Login':[]}
-    for file in user_files:
-        username = file.split(".xlsx")[0]
-        excel = pd.read_excel(os.getcwd() + f'/data/{file}',sheet_name='Summary')
+    referenced = set()
+    for username in usernames:
+        excel = project_store.load_summary(project_store.store_path(username))
+        referenced.update(excel['Sequence Hash'])
         if excel.empty:
             rows = 0;login=r'N\A'
         else:
@@ -63,74 +70,134 @@ def admin_dasboard():
 
     st.subheader('User Information')
     st.dataframe(data)
+    if st.button('Remove Unused Sequences', help='Deletes the stored input sequences of deleted projects'):
+        removed = sequence_store.collect_garbage(referenced) # Referenced by the projects listed above
+        st.success(f'{removed} unused sequences removed.')
     footer()
 
 @st.fragment()
 def regenerate_model():
-    """Regenerate the model with new dataset
+    """Regenerate the model with new dataset (the training runs as a background job)
     """
-    model_path = 'Backend/stacking_model.pkl'
-    print('Check :',os.path.exists(model_path+'.tmp'))
-    if os.path.exists(model_path+'.tmp'):
+    job = latest_job()
+
+    # Poll the running training job
+    if job is not None and job['status'] in ['queued', 'running']:
+        st.progress(job['progress'], text=f"Training model... (stage : {job['stage'] or 'queued'})")
+        if st.button('Cancel Training'):
+            cancel_job(job['id'])
+            st.info('Training is being cancelled...')
+        sleep(2)
+        st.rerun(scope='fragment')
+
+    candidates = model_registry.candidates()
+    if candidates:
+        metadata = candidates[0]  # Newest trained model that was not promoted or rejected yet
+        st.write(f"Model version: {metadata['version']}")
+        if 'metrics' in metadata:
+            st.write(f"Mean Squared Error: {metadata['metrics']['mse']}")
+            st.write(f"Mean Absolute Error: {metadata['metrics']['mae']}")
+            st.write(f"R2 Score: {metadata['metrics']['r2']}")
+        if 'training_resources' in metadata:
+            resources = metadata['training_resources']
+            st.write(f"Training time: {resources['wall_seconds']:.1f} s on {resources['total_cores']} cores (CPU utilization: {resources['cpu_utilization']:.0%})")
+        if 'cross_validation' in metadata:
+            cv = metadata['cross_validation']
+            st.write(f"{cv['n_folds']}-fold cross-validation : MSE {cv['mean']['mse']:.4f} ± {cv['std']['mse']:.4f} | R2 {cv['mean']['r2']:.4f} ± {cv['std']['r2']:.4f} | Predict {cv['mean']['predict_ms_per_1000_rows']:.1f} ms per 1000 k-mers")
+            st.dataframe(pd.DataFrame(cv['folds']), hide_index=True)
+        if metadata.get('quarantine', {}).get('rows'):
+            st.warning(f"{metadata['quarantine']['rows']} rows were left out because their features could not be calculated (see {metadata['quarantine']['report']})")
+            st.dataframe(pd.DataFrame(metadata['quarantine']['first_rows']), hide_index=True)
+        if 'profile' in metadata:
+            with st.expander(f"Training profile (total {metadata['profile']['total_seconds']:.1f} s)"):
+                st.dataframe(pd.DataFrame(metadata['profile']['stages']), hide_index=True)
+                st.write('Feature calculation time per feature (s) :', metadata['profile']['feature_seconds'])
+                st.write('Final fit time per estimator (s) :', metadata['profile']['estimator_fit_seconds'])
+        if metadata.get('student', {}).get('speedup'):
+            st.write(f"Student model speedup: {metadata['student']['speedup']:.1f}x")
+            st.write(f"Student model R2 gap: {metadata['student']['accuracy_gap']['r2_gap']}")
+        if job is not None and job['status'] == 'done' and job['result'].get('version') == metadata['version'] \
+                and not job['options'].get('out_of_core'):  # The out-of-core training renders no plots
+            for plot in sorted(os.listdir('Backend/feature_plots')):
+                if plot.endswith('.png'):
+                    st.image(f'Backend/feature_plots/{plot}')  # Display all plots
+
         st.write('Please Confirm to regenerate/Reject the model')
         if st.button('Regenerate Model'):
-            os.remove(model_path)
-            os.rename(model_path+'.tmp', model_path)
+            model_registry.promote(metadata['version']) # Served from the next prediction on
             st.success('Model regenerated successfully!')
             st.rerun(scope='fragment')
         if st.button('Reject Model'):
-            os.remove(model_path+'.tmp')
-#            os.rename(model_path+'.tmp', model_path)
+            model_registry.delete_version(metadata['version'])
             st.success('Model rejected successfully!')
             st.rerun(scope='fragment')
 
     else:
+        if job is not None and job['status'] == 'failed':
+            st.error(f"The last training job failed : {job['error']}")
+        elif job is not None and job['status'] == 'cancelled':
+            st.info('The last training job was cancelled.')
+
         uploaded_file = st.file_uploader("Upload New Dataset", type=['csv'], help='Upload the new dataset to train the model')
+        incremental = st.checkbox("Incremental training", help='Only folds the sequences that were not used for training before and continues boosting from the current XGBoost model')
+        distill = st.checkbox("Distill a lightweight student model", help='Additionally trains a small model on the predictions of the stacking model for low-latency serving')
+        kfold = st.selectbox("K-fold evaluation folds", [0] + list(range(2, 11)), format_func=lambda k: 'Off' if k == 0 else k, help='Additionally cross-validates the pipeline and reports the accuracy and latency of every fold')
+        search_minutes = st.number_input("Hyperparameter search budget (minutes)", min_value=0, value=0, help='Tunes the RandomForest and XGBoost hyperparameters within this time before training (0 = default hyperparameters)')
+        out_of_core = st.checkbox("Out-of-core training", help="For datasets that don't fit into memory : validates and trains from the file in chunks (the options above are not used)")
         if st.button("Train Model"):
-            if uploaded_file is not None:
-                df = pd.read_csv(uploaded_file)
-                required_columns = ['gRNA_PAM', 'efficacy']  # Replace with actual column names from model.py
-                if all(column in df.columns for column in required_columns):
-                    col1 = set(''.join(df['gRNA_PAM'].to_list()))
-                    if not any([False if i not in set('ACGT') else True for i in col1]): # Check if all characters are valid
-                        unknown_char = ','.join([i for i in col1 if i not in set('ACGT')])
-                        st.error(f"gRNA_PAM column seems to have invalid characters : {unknown_char}")
-                    else:
-                        if not pd.api.types.is_numeric_dtype(df['efficacy']): # Check if all values are numeric
-                            st.error(f'Efficacy column contains non-numeric values!')
-                        else:
-                            if df[df['efficacy'].isna()].index.tolist() == []: # Check if there are any NaN values
-                                st.success("File uploaded successfully and contains all necessary columns.")
-                                print("Running Model")
-                                mse, mae, r2 = main(df)
-                                st.write(f"Mean Squared Error: {mse}")
-                                st.write(f"Mean Absolute Error: {mae}")
-                                st.write(f"R2 Score: {r2}")
-                                print('Plotting')
-                                for plot in os.listdir('Backend/feature_plots'):
-                                    st.image(f'Backend/feature_plots/{plot}')  # Display all plots
-
-                #                deploy = st.radio("Do you want to deploy this model for your users?", ('No', 'Yes'),index=None)
-                                with st.container():
-                                    st.write("Do you want to deploy this model for your users?")
-                                    tab1,tab2,tab3,tab4,tab5,tab6 = st.columns(6)
-
-                                    with tab1:
-                                        if st.button('Yes'):
-                                            if os.path.exists(model_path):
-                                                os.remove(model_path)
-                                            os.rename(model_path+'.tmp', model_path)
-                                            st.success("The model has been deployed successfully.")
-                                    with tab2:
-                                        if st.button('No'):
-                                            os.remove(model_path+'.tmp')
-                                            st.info("The model has not been deployed.")
-                                            print("Model not deployed.")
-                            else:
-                                print(df[df["efficacy"].isna()])
-                                st.error(f'Efficacy column contains NaN values at index {df[df["efficacy"].isna()].index.tolist()}')
+            if uploaded_file is not None and out_of_core:
+                logger.info("Submitting an out-of-core training job")
+                submit_job(uploaded_file, out_of_core=True) # Validated while it is trained, invalid rows are skipped
+                st.rerun(scope='fragment')
+            elif uploaded_file is not None:
+                try:
+                    df, report = validate_csv(uploaded_file) # Validated in chunks, only the valid rows are kept
+                except ValidationError as e:
+                    st.error(str(e))
                 else:
-                    st.error(f"The uploaded file columns : {list(df.columns)} | Required : {required_columns}")
+                    if report['invalid_rows'] > 0:
+                        if report['invalid_characters']:
+                            st.error(f"gRNA_PAM column seems to have invalid characters : {','.join(report['invalid_characters'])}")
+                        st.error(f"{report['invalid_rows']} of {report['rows']} rows are invalid (first rows shown below with their index)")
+                        st.dataframe(report['invalid'])
+                    elif df.empty:
+                        st.error('The uploaded file contains no data!')
+                    else:
+                        st.success("File uploaded successfully and contains all necessary columns.")
+                        logger.info("Submitting a training job")
+                        submit_job(df, distill=distill, incremental=incremental, search_budget=search_minutes * 60 or None, kfold=kfold or None) # Training runs in the background
+                        st.rerun(scope='fragment')
+
+    model_versions()
+
+def model_versions():
+    """Registered model versions with promote and rollback
+    """
+    versions = model_registry.list_versions()
+    if not versions:
+        return
+    current = model_registry.current_version()
+    with st.expander(f"Model versions (current : {current})"):
+        st.dataframe(pd.DataFrame([{'Version': version['version'], 'Current': version['version'] == current,
+                                    'Registered': version.get('registered'),
+                                    'R2': version.get('metrics', {}).get('r2'), 'MSE': version.get('metrics', {}).get('mse'),
+                                    'Training Time (s)': version.get('training_seconds'), 'Student': 'student' in version,
+                                    'Size (MB)': version['size_bytes'] / 1e6} for version in versions]), hide_index=True)
+        if st.button('Rollback to Previous Model'):
+            if model_registry.rollback() is None:
+                st.info('There is no previous model to roll back to.')
+            else:
+                st.rerun(scope='fragment')
+        selected = st.selectbox('Version', [version['version'] for version in versions if version['version'] != current])
+        if selected and st.button('Promote Selected Version'):
+            model_registry.promote(selected)
+            st.rerun(scope='fragment')
+        serving = os.path.exists(model_registry.SERVE_STUDENT_PATH)
+        student = st.checkbox('Serve the student models', value=serving,
+                            help='Predict with the distilled student model of the current version (when it has one)')
+        if student != serving:
+            model_registry.set_serve_student(student)
+            st.rerun(scope='fragment')
 
 def user_directory():
     """User directory to manage user accounts
@@ -169,9 +236,9 @@ def user_directory():
             else:
                 with st.expander(user['username']):
                     username = user['username']
-                    user_data_path = f'data/{username}.xlsx'
+                    user_data_path = project_store.store_path(username)
                     if os.path.exists(user_data_path):
-                        projects = pd.read_excel(user_data_path,sheet_name='Summary').shape[0]
+                        projects = project_store.load_summary(user_data_path).shape[0]
                         st.write(f"**Projects:** {projects}")
                         from datetime import datetime
                         modified_date = datetime.utcfromtimestamp(os.path.getmtime(user_data_path)).strftime('%Y-%m-%d %H:%M:%S')
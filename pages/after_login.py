@@ -35,17 +35,17 @@ if ss.page_state == 'home':
 import streamlit_authenticator as stauth
 from pages.auth import get_auth_credentials
 from streamlit import session_state as ss
-import pandas as pd
 
 # Static Pages
 from pages.Static_pages import homepage, change_details, about
 
 # required functions
-from pages.actions import new_project, delete
+from pages.actions import new_project
 from pages.results import view_results
 from pages.admin import admin_dasboard, regenerate_model, user_directory
 from main import set_background
 from pages.functions import tab_style
+from Backend import project_store
 
 auth_credentials = get_auth_credentials()
 
@@ -62,28 +62,17 @@ try:
     os.makedirs('data', exist_ok=True)
     if ss.username!='admin':
         if 'datapath' not in ss.keys():
-            ss.datapath = os.path.join(os.getcwd(),f'data/{ss.username}.xlsx')
+            ss.datapath = os.path.join(os.getcwd(), project_store.store_path(ss.username))
 
+        # Projects saved in the previous Excel storage are moved to the project store once
+        legacy_path = os.path.join(os.getcwd(), f'data/{ss.username}.xlsx')
+        if os.path.exists(legacy_path) and not os.path.exists(ss.datapath):
+            project_store.migrate_excel(legacy_path, ss.datapath)
+
+        # Only the project index is loaded at login, the results are loaded when a project is opened
+        # (the store keeps the index and the project tables consistent, every change is one transaction)
         if 'data' not in ss.keys():
-            ss.data = pd.read_excel(ss.datapath,sheet_name=None) if os.path.exists(ss.datapath) else {'Summary':pd.DataFrame(columns = ['Project Name', 'Sequence', 'Base pairs', 'Timestamp'])}
-
-        if os.path.exists(ss.datapath):
-            # Remove any project that is in the Summary sheet but not as sheet
-            projects = ss.data['Summary']['Project Name'].values
-            for project in projects:
-                if project not in ss.data.keys():
-                    ss.data['Summary'] = ss.data['Summary'][ss.data['Summary']['Project Name'] != project]
-
-            # Remove any project that is not in the Summary sheet
-            projects_to_delete = []
-            for project in ss.data.keys():
-                if project not in ['Summary'] + ss.data['Summary']['Project Name'].to_list():
-                    projects_to_delete.append(project)
-            for project in projects_to_delete:
-                delete(project)
-
-            if ss.data['Summary'].shape[0] == 0:
-                os.remove(ss.datapath)
+            ss.data = {'Summary': project_store.load_summary(ss.datapath, revisions=True)}
 
         tab1, tab4, tab5, tab2, tab6, tab3 = st.tabs(["Homepage :derelict_house_building:", 'New Project:bulb:', 'Results :chart_with_upwards_trend:', "About :technologist:", 'Profile Settings :gear:', "Logout :arrow_right_hook:"])
         with tab1:
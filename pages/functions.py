@@ -11,14 +11,24 @@ import streamlit as st
 from streamlit import session_state as ss
 import pandas as pd
 import os
-from datetime import datetime
 import io
 import zipfile
+import tempfile
+from collections import OrderedDict
+from contextlib import contextmanager
 from Backend.model_usage import visualize_features
+from Backend import project_store, plot_cache, result_export, sequence_store
 from Bio import SeqIO
 from io import StringIO
 import base64
 
+PROJECT_CACHE_SIZE = 5 # Project results kept in the session, the least recently opened are dropped first
+EXPORT_BUFFER_BYTES = 1024 * 1024 # Export archives are written to a temporary file in chunks of this size
+# Formats of the results table in the downloads (label: format), Parquet needs pyarrow
+TABLE_FORMATS = {label: fmt for label, fmt in {'CSV': 'csv', 'Parquet': 'parquet', 'CSV (gzip)': 'csv.gz'}.items()
+                 if fmt == 'csv' or fmt in result_export.available_formats()}
+ALL_TABLE_FORMATS = {'Excel (xlsx)': 'xlsx', **{label: fmt for label, fmt in TABLE_FORMATS.items() if fmt != 'csv'}}
+
 def form_glass_bg():
     glassmorphism_css = """<style>
     /* Glassmorphic Form Styling */
@@ -276,6 +286,53 @@ def footer():
             st.markdown("<p style='text-align: right; color: white;'>© 2025 Castor<p>", unsafe_allow_html=True)
 
 
+def cache_project(project_name, revision, results):
+    """Keeps the results of a revision of a project in the session cache
+    """
+    if 'project_cache' not in ss.keys():
+        ss.project_cache = OrderedDict()
+    ss.project_cache[(project_name, revision)] = results
+    ss.project_cache.move_to_end((project_name, revision))
+    while len(ss.project_cache) > PROJECT_CACHE_SIZE:
+        ss.project_cache.popitem(last=False)
+
+def uncache_project(project_name):
+    """Removes the results of a project (all its revisions) from the session cache and returns the latest ones
+    """
+    results = None
+    if 'project_cache' in ss.keys():
+        for key in [key for key in ss.project_cache if key[0] == project_name]:
+            results = ss.project_cache.pop(key)
+    return results
+
+def project_revision(df, project_name):
+    """Returns the revision of a project the session has seen (None if it is not known)
+    """
+    rows = df['Summary'].loc[df['Summary']['Project Name'] == project_name]
+    return int(rows['Revision'].iloc[0]) if 'Revision' in rows.columns and not rows.empty else None
+
+def reload_projects():
+    """Reloads the project index from the project store (e.g. after a change in another session) and drops the cached results
+    """
+    ss.data = {'Summary': project_store.load_summary(ss.datapath, revisions=True)}
+    if 'project_cache' in ss.keys():
+        ss.project_cache.clear()
+
+def load_project(project_name):
+    """Returns the results of the revision of a project the session has seen, loaded from the project store when they
+    are not in the session cache. Returns None (and reloads the projects) if the project was changed or deleted in another session
+    """
+    revision = project_revision(ss.data, project_name)
+    results = ss.project_cache.get((project_name, revision)) if 'project_cache' in ss.keys() else None
+    if results is None:
+        try:
+            results = project_store.load_project(ss.datapath, project_name, revision=revision)
+        except (KeyError, project_store.ConflictError):
+            reload_projects()
+            return None
+    cache_project(project_name, revision, results)
+    return results
+
 def check_name(df,project_name,pg_state='add',name=''):
     """Checking if the project name already exists?
     """
@@ -340,43 +397,58 @@ def check_dup_rows(df, new_row):
 
 def replace_project(df, name, project_name, ip, op):
     """Replace an existing project with new details."""
-    now = datetime.now()
-    timestamp = now.strftime("%Y-%m-%d %H:%M:%S")
+    timestamp, revision = project_store.replace_project(ss.datapath, name, project_name, ip, op, revision=project_revision(df, name)) # Only this project is rewritten
 
     df['Summary'].loc[df['Summary']['Project Name'] == name, 'Project Name'] = project_name
-    df['Summary'].loc[df['Summary']['Project Name'] == project_name, 'Sequence'] = ip
+    df['Summary'].loc[df['Summary']['Project Name'] == project_name, 'Sequence Hash'] = sequence_store.sequence_hash(ip)
     df['Summary'].loc[df['Summary']['Project Name'] == project_name, 'Base pairs'] = len(ip)
     df['Summary'].loc[df['Summary']['Project Name'] == project_name, 'Timestamp'] = timestamp
-    df[project_name] = op
-
-    with pd.ExcelWriter(ss.datapath, engine="openpyxl") as writer:
-        for sheet_name, sheet in df.items():
-            sheet.to_excel(writer, sheet_name=sheet_name, index=False)
+    df['Summary'].loc[df['Summary']['Project Name'] == project_name, 'Revision'] = revision
+    uncache_project(name)
+    cache_project(project_name, revision, project_store.slim_results(op)) # Only the stored columns are kept in the session
 
     return df
 
 def save_project(project_name, ip, op, df):
-    """Save project details and results to an Excel file
+    """Save project details and results to the project store
     """
-    now = datetime.now()
-    timestamp = now.strftime("%Y-%m-%d %H:%M:%S")
+    timestamp, revision = project_store.save_project(ss.datapath, project_name, ip, op) # Only this project is written
     new_row = {
         'Project Name': project_name,
-        'Sequence': ip,
+        'Sequence Hash': sequence_store.sequence_hash(ip),
         'Base pairs': len(ip),
-        'Timestamp': timestamp
+        'Timestamp': timestamp,
+        'Revision': revision
     }
 
     df['Summary'] = pd.concat([df['Summary'], pd.DataFrame([new_row])], ignore_index=True) # New entry added to Summary sheet
-    df[project_name] = op
-
-    with pd.ExcelWriter(ss.datapath, engine="openpyxl") as writer:
-        for sheet_name, sheet in df.items():
-            sheet.to_excel(writer, sheet_name=sheet_name, index=False)
+    cache_project(project_name, revision, project_store.slim_results(op)) # Only the stored columns are kept in the session
 
     return df
 
-def show_results(df, project_name):
+def new_export_file():
+    """Temporary file an export archive is spooled to (deleted when it is closed)
+    """
+    return tempfile.TemporaryFile(buffering=0)
+
+@contextmanager
+def zip_writer(export):
+    """Writes a ZIP archive to the export file entry by entry and rewinds the file for the download
+    """
+    buffer = io.BufferedWriter(export, buffer_size=EXPORT_BUFFER_BYTES)
+    with zipfile.ZipFile(buffer, "w") as zip_file:
+        yield zip_file
+    buffer.flush()
+    buffer.detach() # The export file stays open
+    export.seek(0)
+
+def write_csv(zip_file, name, df):
+    """Writes a DataFrame as a CSV entry of the archive without building it in memory first
+    """
+    with zip_file.open(name, "w") as entry, io.TextIOWrapper(entry, encoding="utf-8", newline="") as text:
+        df.to_csv(text, index=False)
+
+def show_results(df, project_name, key='new'):
     """Display results and provide a downloadable ZIP file with plots and data."""
     figures = visualize_features(df)
     st.markdown(f"## Results: {project_name}")
@@ -416,57 +488,79 @@ def show_results(df, project_name):
     st.markdown("### Summary")
     for figure in figures.values():
         st.plotly_chart(figure)
-    # Create ZIP buffer for download
-    with io.BytesIO() as zip_buffer:
-        with zipfile.ZipFile(zip_buffer, "w") as zip_file:
-            # Add CSV data
-            zip_file.writestr(f"{project_name}_results.csv", df[['k-mer', 'Predicted_Efficacy']].to_csv(index=False).encode("utf-8"))
-
-            # Add plots as PNGs
-            for name, fig in figures.items():
-                # print(name)
-                zip_file.writestr(f"{project_name}_{name.lower()}_plot.png", fig.to_image(format="png", width=800, height=600, scale=2))
+    table_format = TABLE_FORMATS[st.radio('Format of the results table', list(TABLE_FORMATS), horizontal=True, key=f'{key}_table_format',
+                                          help='Parquet and compressed CSV include the positions and features of the guide RNAs')]
+    # Create the ZIP file for download (spooled to disk)
+    with new_export_file() as export:
+        with zip_writer(export) as zip_file:
+            # Add the results table
+            if table_format == 'csv':
+                write_csv(zip_file, f"{project_name}_results.csv", df[['k-mer', 'Predicted_Efficacy']])
+            else:
+                with zip_file.open(f"{project_name}_results{result_export.FORMATS[table_format]}", "w") as entry, result_export.ResultsWriter(entry, table_format) as writer:
+                    writer.write(df)
+
+            # Add plots as PNGs (rendered once per project content, see plot_cache)
+            for name, png in plot_cache.project_pngs(df, figures).items():
+                zip_file.writestr(f"{project_name}_{name.lower()}_plot.png", png)
 
         # Stream download button
         st.download_button(
             label="Download Results (*.ZIP)",
-            data=zip_buffer.getvalue(),
+            data=export,
             file_name=f"{project_name}_results.zip",
             mime="application/zip"
         )
 
-def download_all_results(path):
-    """Downloads all the results the user has
+def download_all_results(path, progress=None, table_format='xlsx'):
+    """Downloads all the results the user has, progress(done, total) is called after every project.
+    The results table is an Excel workbook (one sheet per project) or one Parquet/compressed CSV table of all the projects.
+    Returns the export file (spooled to disk), which is deleted when it is closed
     """
-    zip_buffer = io.BytesIO()
-
-    with zipfile.ZipFile(zip_buffer, "w") as zip_file:
-        # Save the Excel file to a BytesIO buffer
-        with io.BytesIO() as excel_output:
-            with pd.ExcelWriter(excel_output, engine='xlsxwriter') as writer:
-                # Read all sheets as a dictionary and write each sheet individually
-                sheets = pd.read_excel(path, sheet_name=None)
-                for sheet_name, sheet_df in sheets.items():
-                    if sheet_name!='Summary':
-                        sheet_df = sheet_df[['k-mer', 'Predicted_Efficacy']]
-                    sheet_df.to_excel(writer, sheet_name=sheet_name, index=False)
-            excel_output.seek(0)
-            zip_file.writestr("All_Results.xlsx", excel_output.read())
-
-        # Process sheets and generate plots
-        with pd.ExcelFile(path) as excel_file:
-            for sheet_name in excel_file.sheet_names:
-                if sheet_name != 'Summary':
-                    sheet_df = excel_file.parse(sheet_name)
-                    for plot_name, plot in visualize_features(sheet_df).items():
-                        zip_file.writestr(f"{sheet_name}_{plot_name.lower()}_plot.png", plot.to_image(format="png", width=800, height=600, scale=2))
-
-    return zip_buffer.getvalue()
+    export = new_export_file()
+    table_name = "All_Results" + (".xlsx" if table_format == 'xlsx' else result_export.FORMATS[table_format])
+
+    # Every project is loaded once and feeds both the results table and its plots
+    with tempfile.TemporaryDirectory() as table_dir, zip_writer(export) as zip_file:
+        table_path = os.path.join(table_dir, table_name)
+        # The index and the projects are read in one transaction, so the progress total matches the exported projects
+        with open(table_path, "wb") as table_file, (pd.ExcelWriter(table_file, engine='xlsxwriter') if table_format == 'xlsx' else
+                                                    result_export.ResultsWriter(table_file, table_format, project_column=True)) as table, \
+                project_store.read_projects(path) as (summary, stored_projects):
+            if table_format == 'xlsx':
+                summary.to_excel(table, sheet_name='Summary', index=False)
+
+            def projects():
+                for project_name, sheet_df in stored_projects:
+                    if table_format == 'xlsx':
+                        sheet_df[['k-mer', 'Predicted_Efficacy']].to_excel(table, sheet_name=project_name, index=False)
+                    else:
+                        table.write(sheet_df, project_name)
+                    yield project_name, sheet_df
+
+            # Generate the plots of every project (rendered in parallel, written as soon as a project is done)
+            for done, (project_name, pngs) in enumerate(plot_cache.iter_project_pngs(projects()), start=1):
+                for plot_name, png in pngs.items():
+                    zip_file.writestr(f"{project_name}_{plot_name.lower()}_plot.png", png)
+                if progress is not None:
+                    progress(done, len(summary))
+
+        # The results table is only built for the export
+        zip_file.write(table_path, table_name)
+
+        # The input sequences (the Summary only holds their hashes)
+        with zip_file.open("All_Sequences.fasta", "w") as entry, io.TextIOWrapper(entry, encoding="utf-8", newline="") as fasta:
+            for project_name, digest in zip(summary['Project Name'], summary['Sequence Hash']):
+                fasta.write(f">{project_name}\n{sequence_store.get(digest)}\n")
+
+    return export
 
 def change_project_name(df,old,new):
-    now = datetime.now()
-    timestamp = now.strftime("%Y-%m-%d %H:%M:%S")
+    timestamp, revision = project_store.rename_project(ss.datapath, old, new, revision=project_revision(df, old)) # Only the project's row of the index is updated
     df['Summary'].loc[df['Summary']["Project Name"] == old, 'Timestamp'] = timestamp
+    df['Summary'].loc[df['Summary']["Project Name"] == old, 'Revision'] = revision
     df['Summary'].loc[df['Summary']["Project Name"] == old, 'Project Name'] = new # Changed name in Summary sheet
-    df[new] = df.pop(old) # renamed the old sheet with new sheet name
+    results = uncache_project(old) # renamed the project in the session cache as well
+    if results is not None:
+        cache_project(new, revision, results)
     return df
@@ -13,7 +13,7 @@ import os
 import pandas as pd
 
 #Functions
-from pages.functions import footer, show_results, download_all_results,download_bt_style, selectbox_style
+from pages.functions import footer, show_results, download_all_results,download_bt_style, selectbox_style, load_project, ALL_TABLE_FORMATS
 
 # Actions
 from pages.actions import modify, delete
@@ -33,26 +33,35 @@ def view_results():
 
 
     if os.path.exists(ss.datapath):
-        if pd.read_excel(ss.datapath,sheet_name='Summary').empty:
+        if ss.data['Summary'].empty: # The session index is kept in sync with the store
             st.info('No Results to display!')
-            os.remove(ss.datapath)
         else:
             download_bt_style()
-            st.download_button(
-                label="*Click to download all results to your local system",
-                data=download_all_results(ss.datapath),
-                file_name=f"Results.zip",
-                mime="application/zip",
-                use_container_width=True,
-                help=f'Upon clicking, the {ss.data["Summary"].shape[0]} project results (guide RNAs & Plots) as a *.zip file will be downloaded!' if ss.data["Summary"].shape[0]>1 else
-                        f'Upon Clicking, The Project result (Guide RNAs & corresponding plots) as a *.zip file will be downloaded!'
-            )
+            table_format = ALL_TABLE_FORMATS[st.radio('Format of the results table', list(ALL_TABLE_FORMATS), horizontal=True, key='All_Table_Format',
+                                                      help='Parquet and compressed CSV hold all the projects in one table with the positions and features of the guide RNAs')]
+            if st.button('Prepare the download of all results', use_container_width=True): # The export is only built on request
+                progress_bar = st.progress(0, text='Preparing the download of all results...')
+                with download_all_results(ss.datapath, progress=lambda done, total: progress_bar.progress(done / total, text=f'Preparing the download of all results... ({done}/{total} projects)'), table_format=table_format) as export:
+                    progress_bar.empty()
+                    st.download_button(
+                        label="*Click to download all results to your local system",
+                        data=export,
+                        file_name=f"Results.zip",
+                        mime="application/zip",
+                        use_container_width=True,
+                        help=f'Upon clicking, the {ss.data["Summary"].shape[0]} project results (guide RNAs & Plots) as a *.zip file will be downloaded!' if ss.data["Summary"].shape[0]>1 else
+                                f'Upon Clicking, The Project result (Guide RNAs & corresponding plots) as a *.zip file will be downloaded!'
+                    )
             st.divider()
 
             st.subheader('View Project Results',help='Select the project name to look at the corresponding results')
             view_project = st.selectbox('',(project_names),index=None,key='View_Project')
             if view_project:
-                show_results(ss.data[view_project],view_project)
+                results = load_project(view_project) # Loaded on demand
+                if results is None:
+                    st.error(f'{view_project} was changed or deleted in another session. The projects were reloaded, please select it again.')
+                else:
+                    show_results(results,view_project,key='view')
             st.divider()
 
             st.subheader('Modify Project',help='Upon making any change, it cannot be reverted back!')